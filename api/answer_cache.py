@@ -0,0 +1,106 @@
+"""
+Semantic answer cache for IGCSE Geography Guru /rag/chat
+Answers are keyed by the set of searched document ids and the question embedding.
+A new question reuses a cached answer when its embedding is within a cosine
+similarity threshold of a cached one. Entries expire after a TTL, and they are
+dropped when any of their documents is reprocessed or deleted.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+RAG_ANSWER_CACHE_THRESHOLD = float(os.environ.get('RAG_ANSWER_CACHE_THRESHOLD', 0.97))
+RAG_ANSWER_CACHE_TTL = float(os.environ.get('RAG_ANSWER_CACHE_TTL', 3600))
+RAG_ANSWER_CACHE_SIZE = int(os.environ.get('RAG_ANSWER_CACHE_SIZE', 256))
+
+
+def _unit(vector):
+    v = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm else None
+
+
+class AnswerCache:
+    """Near-duplicate question cache with TTL expiry and per-document invalidation."""
+
+    def __init__(self, threshold=RAG_ANSWER_CACHE_THRESHOLD, ttl=RAG_ANSWER_CACHE_TTL,
+                 max_entries=RAG_ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = []  # dicts: scope, documents, vector, response, expires
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "invalidated": 0, "expired": 0}
+
+    def _expire_locked(self, now):
+        before = len(self._entries)
+        self._entries = [e for e in self._entries if e['expires'] > now]
+        self.stats["expired"] += before - len(self._entries)
+
+    def lookup(self, scope, document_ids, embedding):
+        """Return (response, similarity) for the closest cached answer above the threshold, else (None, 0)."""
+        query = _unit(embedding)
+        if query is None:
+            return None, 0.0
+        documents = frozenset(document_ids or ())
+        with self._lock:
+            self._expire_locked(time.monotonic())
+            best, best_sim = None, self.threshold
+            for entry in self._entries:
+                if entry['scope'] != scope or entry['documents'] != documents:
+                    continue
+                if entry['vector'].shape != query.shape:
+                    continue
+                sim = float(entry['vector'] @ query)
+                if sim >= best_sim:
+                    best, best_sim = entry, sim
+            if best is None:
+                self.stats["misses"] += 1
+                return None, 0.0
+            self.stats["hits"] += 1
+            return best['response'], best_sim
+
+    def store(self, scope, document_ids, embedding, response):
+        vector = _unit(embedding)
+        if vector is None:
+            return
+        with self._lock:
+            self._expire_locked(time.monotonic())
+            self._entries.append({
+                'scope': scope,
+                'documents': frozenset(document_ids or ()),
+                'vector': vector,
+                'response': response,
+                'expires': time.monotonic() + self.ttl,
+            })
+            if len(self._entries) > self.max_entries:
+                # Entries are appended in time order, so the oldest go first
+                del self._entries[:len(self._entries) - self.max_entries]
+            self.stats["stores"] += 1
+
+    def invalidate_documents(self, document_ids):
+        """Drop answers built from any of these documents, and all-document answers."""
+        changed = set(document_ids)
+        with self._lock:
+            before = len(self._entries)
+            self._entries = [e for e in self._entries
+                             if e['documents'] and not (e['documents'] & changed)]
+            self.stats["invalidated"] += before - len(self._entries)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0
+        return stats
+
+
+_cache = AnswerCache()
+
+
+def get_answer_cache():
+    return _cache
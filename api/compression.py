@@ -0,0 +1,129 @@
+"""
+Response compression for IGCSE Geography Guru
+Negotiates gzip or brotli from Accept-Encoding for payloads above a size
+threshold. brotli is used only when the optional `brotli` package is installed.
+Compressed bodies of static responses (curriculum JSON, dev server files) are
+kept in a size-bounded LRU, so repeated requests skip the compressor.
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+COMPRESSION_CACHE_BYTES = int(os.environ.get('COMPRESSION_CACHE_BYTES', 16 * 1024 * 1024))
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+
+def supported_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding):
+    """Pick 'br' or 'gzip' for an Accept-Encoding header value, or None for identity.
+    Clients send a handful of distinct header strings, so the choice is memoized."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():  # server preference breaks ties
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(payload, encoding):
+    if encoding == 'br':
+        return brotli.compress(payload, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(payload, compresslevel=GZIP_LEVEL, mtime=0)
+    return payload
+
+
+class CompressionCache:
+    """LRU of compressed bodies keyed by (content key, encoding), bounded by total bytes."""
+
+    def __init__(self, max_bytes=COMPRESSION_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get_or_compress(self, key, payload, encoding):
+        cache_key = (key, encoding)
+        with self._lock:
+            body = self._entries.get(cache_key)
+            if body is not None:
+                self._entries.move_to_end(cache_key)
+                self.stats["hits"] += 1
+                return body
+            self.stats["misses"] += 1
+        body = compress(payload, encoding)
+        if len(body) <= self.max_bytes:
+            with self._lock:
+                if cache_key not in self._entries:
+                    self._entries[cache_key] = body
+                    self._bytes += len(body)
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= len(evicted)
+                    self.stats["evictions"] += 1
+        return body
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        stats["encodings"] = list(supported_encodings())
+        return stats
+
+
+_cache = CompressionCache()
+
+
+def get_compression_cache():
+    return _cache
+
+
+def encode_body(payload, accept_encoding, static=False, cache_key=None):
+    """Return (body, encoding) for a response payload. Payloads under the threshold,
+    or clients that accept neither encoding, get the payload back unchanged.
+    Static payloads are cached by `cache_key`, or by a digest of their content."""
+    if len(payload) < COMPRESSION_MIN_BYTES:
+        return payload, None
+    encoding = negotiate(accept_encoding or '')
+    if encoding is None:
+        return payload, None
+    if not static:
+        return compress(payload, encoding), encoding
+    key = cache_key or hashlib.blake2b(payload, digest_size=16).digest()
+    return _cache.get_or_compress(key, payload, encoding), encoding
+
+
+def is_compressible(content_type):
+    return bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
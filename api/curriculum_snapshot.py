@@ -0,0 +1,189 @@
+"""
+Compiled curriculum snapshot for IGCSE Geography Guru
+Build step:
+
+    python -m api.curriculum_snapshot [output path]
+
+reads the static curriculum tables through the configured storage backend
+(STORAGE_BACKEND=sqlite builds offline from the migrations) and writes one
+versioned JSON file with the rows pre-sorted in endpoint order and indexed per
+topic. The handler loads it once per process and answers the test-yourself,
+flashcard, tips and objectives endpoints from memory. Supabase is only queried
+when there is no snapshot or the snapshot lacks a table.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+SNAPSHOT_FORMAT = 1
+CURRICULUM_SNAPSHOT_PATH = os.environ.get(
+    'CURRICULUM_SNAPSHOT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'curriculum_snapshot.json'))
+
+# table -> (per-topic index column, sort columns). The sort matches the order the
+# endpoints request, so per-topic slices come out already ordered.
+SNAPSHOT_TABLES = {
+    'topics': (None, ('theme_number', 'topic_number')),
+    'definitions': ('topic_id', ('topic_id', 'id')),
+    'teacher_definitions': ('topic_id', ('topic_id', 'term')),
+    'test_yourself': ('topic_id', ('topic_id', 'question_number')),
+    'tips': ('topic_id', ('topic_id', 'id')),
+    'learning_objectives': ('topic_id', ('topic_id', 'order_num', 'id')),
+}
+
+_snapshot = None
+_loaded = False
+_lock = threading.Lock()
+
+
+def _sort_key(columns):
+    # NULLs last, as Postgres orders them ascending
+    return lambda row: tuple((row.get(c) is None, row.get(c) if row.get(c) is not None else 0) for c in columns)
+
+
+def compile_snapshot(tables):
+    """Build the snapshot dict from {table: rows}; the version is a hash of the content."""
+    compiled, indexes = {}, {}
+    for table, rows in tables.items():
+        index_column, sort_columns = SNAPSHOT_TABLES[table]
+        rows = sorted(rows, key=_sort_key(sort_columns))
+        compiled[table] = rows
+        if index_column:
+            index = {}
+            for position, row in enumerate(rows):
+                index.setdefault(str(row.get(index_column)), []).append(position)
+            indexes[table] = index
+    if 'topics' in compiled:
+        indexes['topic_numbers'] = {t['topic_number']: t['id'] for t in compiled['topics'] if t.get('topic_number')}
+    content = json.dumps([compiled, indexes], sort_keys=True, separators=(',', ':'))
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'version': hashlib.sha256(content.encode('utf-8')).hexdigest()[:12],
+        'built_at': datetime.now(timezone.utc).isoformat(),
+        'tables': compiled,
+        'indexes': indexes,
+    }
+
+
+def test_yourself_from_content_data(topics):
+    """test_yourself rows from the bundled api/content_data.py dataset, keyed to topic ids."""
+    from api.content_data import TEST_YOURSELF
+    topic_ids = {t.get('topic_number'): t.get('id') for t in topics}
+    rows = []
+    for topic_number, topic in TEST_YOURSELF.items():
+        if topic_ids.get(topic_number) is None:
+            continue
+        for q in topic['questions']:
+            rows.append({'id': len(rows) + 1, 'topic_id': topic_ids[topic_number],
+                         'question_number': q['id'], 'question': q['q'], 'answer': q['a']})
+    return rows
+
+
+class CurriculumSnapshot:
+    """Read-only view over a loaded snapshot. Returned rows are shared - do not mutate them."""
+
+    def __init__(self, data):
+        self.version = data['version']
+        self.built_at = data.get('built_at')
+        self.tables = data['tables']
+        self.topic_numbers = data['indexes'].get('topic_numbers', {})
+        self._by_topic = {
+            table: {key: [self.tables[table][p] for p in positions] for key, positions in index.items()}
+            for table, index in data['indexes'].items() if table in self.tables
+        }
+
+    def has(self, table):
+        return table in self.tables
+
+    def rows(self, table, topic_id=None):
+        """All rows of a table, or one topic's rows ([] for an unknown topic)."""
+        if topic_id is None:
+            return self.tables[table]
+        return self._by_topic.get(table, {}).get(str(topic_id), [])
+
+    def topic_id_for(self, topic_number):
+        return self.topic_numbers.get(topic_number)
+
+    def get_stats(self):
+        return {
+            'version': self.version,
+            'built_at': self.built_at,
+            'tables': {table: len(rows) for table, rows in self.tables.items()},
+        }
+
+
+def load_snapshot(path=CURRICULUM_SNAPSHOT_PATH):
+    """Read a snapshot file; None if it is missing, unreadable or from another format."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('format') != SNAPSHOT_FORMAT:
+            print(f"[Curriculum Snapshot] Ignoring {path}: format {data.get('format')}")
+            return None
+        return CurriculumSnapshot(data)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"[Curriculum Snapshot] Ignoring {path}: {e}")
+        return None
+
+
+def get_curriculum_snapshot():
+    """The process-wide snapshot, loaded on first use (None if there is none)."""
+    global _snapshot, _loaded
+    if not _loaded:
+        with _lock:
+            if not _loaded:
+                _snapshot = load_snapshot()
+                _loaded = True
+    return _snapshot
+
+
+def reload_curriculum_snapshot():
+    """Re-read the snapshot file, e.g. after it was rebuilt."""
+    global _snapshot, _loaded
+    with _lock:
+        _snapshot = load_snapshot()
+        _loaded = True
+    return _snapshot
+
+
+def write_snapshot(data, path=CURRICULUM_SNAPSHOT_PATH):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.snapshot.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def build_snapshot(path=CURRICULUM_SNAPSHOT_PATH):
+    """Fetch every snapshot table through the storage layer and write the snapshot file."""
+    from api.index import _supabase_fetch
+
+    tables = {}
+    for table in SNAPSHOT_TABLES:
+        try:
+            rows = _supabase_fetch(table, {'select': '*'})
+        except Exception as e:
+            print(f"[Curriculum Snapshot] Skipping {table}: {e}")
+            continue
+        if isinstance(rows, list):
+            tables[table] = rows
+    if not tables.get('test_yourself') and tables.get('topics'):
+        tables['test_yourself'] = test_yourself_from_content_data(tables['topics'])
+    data = compile_snapshot(tables)
+    write_snapshot(data, path)
+    return data
+
+
+if __name__ == '__main__':
+    output = sys.argv[1] if len(sys.argv) > 1 else CURRICULUM_SNAPSHOT_PATH
+    snapshot = build_snapshot(output)
+    counts = ', '.join(f"{t}={len(rows)}" for t, rows in snapshot['tables'].items())
+    print(f"Wrote curriculum snapshot {snapshot['version']} to {output} ({counts})")
@@ -0,0 +1,122 @@
+"""
+Shared Edge-TTS engine for IGCSE Geography Guru
+One long-lived asyncio event loop runs on a daemon thread per process, and
+request threads submit synthesis jobs to it. Overlapping /tts/speak requests and
+segments share the loop instead of building and tearing down one each. A
+semaphore caps concurrent syntheses, and every job has a deadline.
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+
+EDGE_TTS_CONCURRENCY = int(os.environ.get('EDGE_TTS_CONCURRENCY', 8))
+EDGE_TTS_TIMEOUT = float(os.environ.get('EDGE_TTS_TIMEOUT', 45))
+
+
+class EdgeTTSEngine:
+    """Thread-safe front end to an event loop thread that runs edge_tts.Communicate streams."""
+
+    def __init__(self, concurrency=EDGE_TTS_CONCURRENCY, timeout=EDGE_TTS_TIMEOUT):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._loop = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {"jobs": 0, "active": 0, "waiting": 0, "completed": 0, "timeouts": 0, "errors": 0}
+
+    def _ensure_loop(self):
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    started = threading.Event()
+
+                    def run():
+                        asyncio.set_event_loop(loop)
+                        self._semaphore = asyncio.Semaphore(self.concurrency)
+                        loop.call_soon(started.set)
+                        loop.run_forever()
+
+                    threading.Thread(target=run, name='edge-tts-loop', daemon=True).start()
+                    started.wait()
+                    self._loop = loop
+        return self._loop
+
+    def _count(self, stat, delta=1):
+        with self._stats_lock:
+            self.stats[stat] += delta
+
+    async def _audio_chunks(self, text, voice):
+        import edge_tts
+
+        self._count("waiting")
+        async with self._semaphore:
+            self._count("waiting", -1)
+            self._count("active")
+            try:
+                async for chunk in edge_tts.Communicate(text, voice).stream():
+                    if chunk["type"] == "audio":
+                        yield chunk["data"]
+            finally:
+                self._count("active", -1)
+
+    @staticmethod
+    async def _close(chunks):
+        try:
+            await chunks.aclose()
+        except RuntimeError:
+            pass  # still unwinding from a cancelled step, which runs the same cleanup
+
+    def stream(self, text, voice, timeout=None):
+        """Yield MP3 chunks for text as they arrive. Each chunk is one round trip to the loop
+        thread; the whole job (including waiting for a slot) must finish within `timeout`."""
+        loop = self._ensure_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        chunks = self._audio_chunks(text, voice)
+        self._count("jobs")
+        finished = False
+        try:
+            while True:
+                future = asyncio.run_coroutine_threadsafe(chunks.__anext__(), loop)
+                try:
+                    chunk = future.result(max(deadline - loop.time(), 0))
+                except StopAsyncIteration:
+                    break
+                except concurrent.futures.TimeoutError:
+                    future.cancel()
+                    self._count("timeouts")
+                    raise TimeoutError(f"Edge-TTS timed out after {timeout or self.timeout:g}s")
+                yield chunk
+            finished = True
+            self._count("completed")
+        except TimeoutError:
+            raise
+        except Exception:
+            self._count("errors")
+            raise
+        finally:
+            if not finished:
+                # Release the semaphore slot and the Edge connection on the loop thread
+                asyncio.run_coroutine_threadsafe(self._close(chunks), loop)
+
+    def synthesize(self, text, voice, timeout=None):
+        """MP3 bytes for text."""
+        return b"".join(self.stream(text, voice, timeout))
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["concurrency"] = self.concurrency
+        stats["timeout"] = self.timeout
+        stats["loop_running"] = self._loop is not None
+        return stats
+
+
+_engine = EdgeTTSEngine()
+
+
+def get_edge_tts_engine():
+    return _engine
@@ -0,0 +1,109 @@
+"""
+Query embedding cache for IGCSE Geography Guru
+Two tiers keyed by (model, normalized text):
+    memory - size-bounded LRU, per process
+    disk   - optional SQLite file (EMBEDDING_CACHE_PATH) that survives restarts
+"""
+
+import array
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', 1024))
+EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', '')
+
+
+def normalize_text(text):
+    """Collapse whitespace and case so trivially different questions share an entry."""
+    return ' '.join(text.split()).casefold()
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Thread-safe LRU of embeddings with an optional SQLite disk tier."""
+
+    def __init__(self, max_entries=EMBEDDING_CACHE_SIZE, disk_path=EMBEDDING_CACHE_PATH):
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+    def _disk(self):
+        """Open the SQLite tier lazily (caller holds the lock)."""
+        if self._db is None and self.disk_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.disk_path)), exist_ok=True)
+                self._db = sqlite3.connect(self.disk_path, check_same_thread=False)
+                self._db.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)')
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"[Embedding Cache] Disk tier disabled: {e}")
+                self.disk_path = ''
+                self._db = None
+        return self._db
+
+    def _remember(self, key, embedding):
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, model, text):
+        key = cache_key(model, text)
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return embedding
+            db = self._disk()
+            if db is not None:
+                try:
+                    row = db.execute('SELECT vector FROM embeddings WHERE key = ?', (key,)).fetchone()
+                except sqlite3.Error:
+                    row = None
+                if row:
+                    embedding = array.array('f', row[0]).tolist()
+                    self._remember(key, embedding)
+                    self.stats["disk_hits"] += 1
+                    return embedding
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, model, text, embedding):
+        key = cache_key(model, text)
+        with self._lock:
+            self._remember(key, embedding)
+            self.stats["stores"] += 1
+            db = self._disk()
+            if db is not None:
+                try:
+                    db.execute('INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)',
+                               (key, array.array('f', embedding).tobytes()))
+                    db.commit()
+                except sqlite3.Error as e:
+                    print(f"[Embedding Cache] Disk write failed: {e}")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_enabled"] = bool(self.disk_path)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0
+        return stats
+
+
+_cache = EmbeddingCache()
+
+
+def get_embedding_cache():
+    return _cache
@@ -0,0 +1,135 @@
+"""
+Memory-mapped on-disk embedding index for IGCSE Geography Guru
+One index per PDF document:
+    <doc_id>.f32        raw float32 matrix, one row per chunk (count x dim)
+    <doc_id>.meta.json  sidecar with document_id, dim, count, chunk ids and page numbers
+The matrix is opened with np.memmap, so searches do no JSON decoding and every
+worker process on the host shares the same page-cache pages.
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+
+import numpy as np
+
+from api.similarity import EmbeddingMatrix, parse_embedding
+
+INDEX_VERSION = 1
+INDEX_DIR = os.environ.get('EMBEDDING_INDEX_DIR', os.path.join(tempfile.gettempdir(), 'igcse-embedding-index'))
+
+_cache = {}  # document_id -> (meta mtime, DocumentIndex)
+_cache_lock = threading.Lock()
+
+
+class DocumentIndex:
+    """Loaded index for one document: memory-mapped matrix plus chunk metadata."""
+
+    def __init__(self, document_id, ids, pages, matrix):
+        self.document_id = document_id
+        self.ids = ids
+        self.pages = pages
+        self.matrix = matrix
+        self.row_of = {chunk_id: i for i, chunk_id in enumerate(ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _paths(document_id):
+    safe = re.sub(r'[^\w\-]', '_', str(document_id))
+    base = os.path.join(INDEX_DIR, safe)
+    return base + '.f32', base + '.meta.json'
+
+
+def write_index(document_id, rows):
+    """Write (or replace) the index for a document from rows with id, page_number and embedding.
+    Files are written to temp names and renamed so readers never see a partial index."""
+    ids, pages, vectors = [], [], []
+    dim = None
+    for row in rows:
+        emb = parse_embedding(row.get('embedding'))
+        if not emb or row.get('id') is None:
+            continue
+        if dim is None:
+            dim = len(emb)
+        if len(emb) != dim:
+            continue
+        ids.append(row['id'])
+        pages.append(row.get('page_number'))
+        vectors.append(emb)
+    if not ids:
+        delete_index(document_id)
+        return None
+
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    matrix_path, meta_path = _paths(document_id)
+    matrix = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+
+    fd, tmp_matrix = tempfile.mkstemp(dir=INDEX_DIR, suffix='.f32.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(matrix.tobytes())
+    os.chmod(tmp_matrix, 0o644)  # readable by every worker process on the host
+    os.replace(tmp_matrix, matrix_path)
+
+    meta = {
+        'version': INDEX_VERSION,
+        'document_id': document_id,
+        'dim': dim,
+        'count': len(ids),
+        'ids': ids,
+        'pages': pages,
+    }
+    fd, tmp_meta = tempfile.mkstemp(dir=INDEX_DIR, suffix='.meta.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f, separators=(',', ':'))
+    os.chmod(tmp_meta, 0o644)
+    os.replace(tmp_meta, meta_path)
+
+    with _cache_lock:
+        _cache.pop(document_id, None)
+    return len(ids)
+
+
+def load_index(document_id):
+    """Return the DocumentIndex for a document, or None if there is no valid index on disk."""
+    matrix_path, meta_path = _paths(document_id)
+    try:
+        mtime = os.path.getmtime(meta_path)
+    except OSError:
+        return None
+
+    with _cache_lock:
+        cached = _cache.get(document_id)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION or not meta.get('count'):
+            return None
+        shape = (meta['count'], meta['dim'])
+        if os.path.getsize(matrix_path) != shape[0] * shape[1] * 4:
+            return None
+        mapped = np.memmap(matrix_path, dtype=np.float32, mode='r', shape=shape)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    index = DocumentIndex(document_id, meta['ids'], meta['pages'], EmbeddingMatrix(mapped))
+    with _cache_lock:
+        _cache[document_id] = (mtime, index)
+    return index
+
+
+def delete_index(document_id):
+    """Remove a document's index files (no-op if absent)."""
+    with _cache_lock:
+        _cache.pop(document_id, None)
+    for path in _paths(document_id):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
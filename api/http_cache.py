@@ -0,0 +1,91 @@
+"""
+HTTP caching for IGCSE Geography Guru
+Curriculum GET responses carry a weak ETag over their JSON body and a public
+Cache-Control policy, so browsers revalidate with If-None-Match and the Vercel
+edge can serve them without invoking the function. The ETag last sent for each
+URL is remembered together with the content generation (snapshot version and
+table cache invalidations), so a matching If-None-Match is answered with 304
+before the endpoint runs - no Supabase query at all.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CURRICULUM_CACHE_CONTROL = os.environ.get(
+    'CURRICULUM_CACHE_CONTROL', 'public, max-age=60, s-maxage=300, stale-while-revalidate=86400')
+PRIVATE_CACHE_CONTROL = os.environ.get('PRIVATE_CACHE_CONTROL', 'private, no-store')
+# How long a remembered ETag is trusted without re-running the endpoint; matches the table cache TTL
+ETAG_TTL = float(os.environ.get('ETAG_TTL', os.environ.get('TABLE_CACHE_TTL', 600)))
+ETAG_MAX_ENTRIES = int(os.environ.get('ETAG_MAX_ENTRIES', 4096))
+
+
+def compute_etag(payload):
+    """Weak ETag for a response body; weak because the bytes on the wire vary with Content-Encoding."""
+    return 'W/"' + hashlib.blake2b(payload, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header value against an ETag."""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+class ETagIndex:
+    """URL -> (content generation, expiry, ETag) for the last 200 sent on each curriculum URL."""
+
+    def __init__(self, ttl=ETAG_TTL, max_entries=ETAG_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"not_modified": 0, "revalidated": 0, "stored": 0}
+
+    def lookup(self, url, generation):
+        """The remembered ETag for a URL, or None if it is unknown, expired or from an older generation."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            if entry[0] != generation or entry[1] <= time.monotonic():
+                del self._entries[url]
+                return None
+            self._entries.move_to_end(url)
+            return entry[2]
+
+    def store(self, url, generation, etag):
+        with self._lock:
+            self._entries[url] = (generation, time.monotonic() + self.ttl, etag)
+            self._entries.move_to_end(url)
+            self.stats["stored"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        return stats
+
+
+_index = ETagIndex()
+
+
+def get_etag_index():
+    return _index
@@ -0,0 +1,220 @@
+"""
+Keep-alive HTTP connection pool for IGCSE Geography Guru
+Shared by the supabase_* helpers so repeated PostgREST calls reuse TCP+TLS sessions
+"""
+
+import http.client
+import io
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+
+# Exceptions that mean a reused keep-alive socket was closed by the server
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+# Methods that are safe to resend when the response was lost after the request went out
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+
+class PooledResponse:
+    """Fully-read HTTP response, usable like the object returned by urllib.request.urlopen."""
+
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._body = io.BytesIO(body)
+
+    def read(self, amt=None):
+        return self._body.read() if amt is None else self._body.read(amt)
+
+    def getcode(self):
+        return self.status
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._body.close()
+        return False
+
+
+class ConnectionPool:
+    """Thread-safe HTTP/1.1 connection pool with per-host limits and idle eviction."""
+
+    def __init__(self, max_per_host=10, idle_timeout=30.0, timeout=30.0):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}        # (scheme, host, port) -> [(conn, last_used), ...]
+        self._slots = {}       # (scheme, host, port) -> BoundedSemaphore
+        self._ssl_context = ssl.create_default_context()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "stale_retries": 0, "requests": 0}
+
+    def _host_key(self, url):
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme or 'https'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        return (scheme, parts.hostname, port)
+
+    def _slot(self, key):
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return slot
+
+    def _evict_idle_locked(self, now):
+        """Close connections that have been idle longer than idle_timeout (lock held)."""
+        for key in list(self._idle):
+            fresh = []
+            for conn, last_used in self._idle[key]:
+                if now - last_used > self.idle_timeout:
+                    conn.close()
+                    self.stats["evictions"] += 1
+                else:
+                    fresh.append((conn, last_used))
+            if fresh:
+                self._idle[key] = fresh
+            else:
+                del self._idle[key]
+
+    def _acquire(self, key, timeout):
+        """Return (conn, reused) - an idle connection for key, or a new one."""
+        with self._lock:
+            self._evict_idle_locked(time.monotonic())
+            idle = self._idle.get(key)
+            if idle:
+                conn, _ = idle.pop()
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                self.stats["hits"] += 1
+                return conn, True
+            self.stats["misses"] += 1
+        return self._connect(key, timeout), False
+
+    def _connect(self, key, timeout):
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        return conn
+
+    def _release(self, key, conn):
+        with self._lock:
+            self._idle.setdefault(key, []).append((conn, time.monotonic()))
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        """Send a request over a pooled connection and return a fully-read PooledResponse.
+
+        Raises urllib.error.HTTPError for 4xx/5xx so callers can keep their urllib error handling.
+        """
+        timeout = timeout or self.timeout
+        key = self._host_key(url)
+        parts = urllib.parse.urlsplit(url)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        headers = dict(headers or {})
+        headers.setdefault('Connection', 'keep-alive')
+
+        slot = self._slot(key)
+        slot.acquire()
+        try:
+            with self._lock:
+                self.stats["requests"] += 1
+            conn, reused = self._acquire(key, timeout)
+            sent = False
+            try:
+                conn.request(method, target, body=body, headers=headers)
+                sent = True
+                resp = conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                # Server closed an idle keep-alive socket. Retry once on a newly opened
+                # connection - unless the request went out and resending it is not safe
+                # (a POST/PATCH may already have been applied).
+                conn.close()
+                if not reused or (sent and method.upper() not in IDEMPOTENT_METHODS):
+                    raise
+                with self._lock:
+                    self.stats["stale_retries"] += 1
+                conn = self._connect(key, timeout)
+                try:
+                    conn.request(method, target, body=body, headers=headers)
+                    resp = conn.getresponse()
+                except Exception:
+                    conn.close()
+                    raise
+            except Exception:
+                conn.close()
+                raise
+
+            try:
+                data = resp.read()
+            except Exception:
+                conn.close()
+                raise
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+        finally:
+            slot.release()
+
+        if resp.status >= 400:
+            raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(data))
+        return PooledResponse(url, resp.status, resp.reason, resp.headers, data)
+
+    def urlopen(self, req, timeout=None):
+        """Drop-in replacement for urllib.request.urlopen(Request) over the pool."""
+        headers = dict(req.header_items())
+        if req.data is not None:
+            headers.setdefault('Content-Length', str(len(req.data)))
+        return self.request(req.get_method(), req.full_url, body=req.data, headers=headers, timeout=timeout)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["idle_connections"] = sum(len(v) for v in self._idle.values())
+            stats["hosts"] = len(self._idle)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / total, 4) if total else 0
+        # Every hit is a TCP+TLS handshake we did not have to pay for
+        stats["handshakes_saved"] = stats["hits"]
+        return stats
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+# Process-wide pool shared by every request handled by this serverless instance
+_pool = ConnectionPool()
+
+
+def get_pool():
+    return _pool
+
+
+def urlopen(req, timeout=None):
+    """Module-level shortcut for get_pool().urlopen()."""
+    return _pool.urlopen(req, timeout=timeout)
@@ -5,19 +5,56 @@ With RAG (Retrieval-Augmented Generation) for PDF Chat
 from http.server import BaseHTTPRequestHandler
 import json
 import os
+import random
 import re
 import urllib.request
 import urllib.error
 import urllib.parse
 import uuid
 import base64
+import hashlib
+import hmac
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
 from io import BytesIO
 
+import numpy as np
+
+from api.http_pool import urlopen as pooled_urlopen, get_pool
+from api.similarity import EmbeddingMatrix, top_k
+from api.embedding_index import load_index, write_index, delete_index
+from api.embedding_cache import get_embedding_cache
+from api.table_cache import get_table_cache, MISS
+from api.tts_segments import (split_segments, synthesize_segments, stitch_wav, stitch_mp3,
+                              SegmentError, TTS_MAX_CHARS)
+from api.edge_tts_engine import get_edge_tts_engine
+from api.qwen_realtime import get_session_pool as get_qwen_session_pool
+from api.tts_cache import get_tts_cache, tts_cache_key, TTS_CACHE_BUCKET, TTS_CACHE_MAX_CLIP_BYTES
+from api.qwen_tts import pcm_to_wav, wav_stream_header
+from api.http_cache import (get_etag_index, compute_etag, etag_matches,
+                            CURRICULUM_CACHE_CONTROL, PRIVATE_CACHE_CONTROL)
+from api.answer_cache import get_answer_cache
+from api.keyword_index import KeywordIndex, load_keyword_index, write_keyword_index, delete_keyword_index
+from api.sqlite_backend import get_sqlite_backend
+from api.curriculum_snapshot import get_curriculum_snapshot, reload_curriculum_snapshot
+from api.router import Router
+from api.compression import encode_body, get_compression_cache
+
 # Test Yourself data is now stored in Supabase
 
 SUPABASE_URL = os.environ.get('SUPABASE_URL', 'https://wamzijrgngnvuzczxoqx.supabase.co')
 SUPABASE_KEY = os.environ.get('SUPABASE_SERVICE_KEY', '')
 
+# 'sqlite' serves the supabase_* helpers from a local database (see api/sqlite_backend.py)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'supabase')
+
+def local_backend():
+    """The local SQLite backend when STORAGE_BACKEND=sqlite, else None"""
+    return get_sqlite_backend() if STORAGE_BACKEND == 'sqlite' else None
+
 # OpenAI API for embeddings (user provides their own key)
 OPENAI_EMBEDDING_MODEL = 'text-embedding-3-small'
 OPENAI_EMBEDDING_DIMENSION = 1536
@@ -88,6 +125,12 @@ ALICLOUD_MODELS = [
     {"id": "qwen2.5-32b-instruct", "name": "Qwen2.5 32B Instruct"},
 ]
 
+# Content types for binary /tts/speak responses
+AUDIO_MIME_TYPES = {'mp3': 'audio/mpeg', 'wav': 'audio/wav'}
+
+# Edge-TTS always speaks with this voice
+EDGE_TTS_VOICE = "en-US-EmmaMultilingualNeural"
+
 # AliCloud TTS Voices
 ALICLOUD_TTS_VOICES = [
     {"id": "Cherry", "name": "Cherry (Female, Friendly)"},
@@ -98,7 +141,11 @@ ALICLOUD_TTS_VOICES = [
 
 sessions = {}
 
-def supabase_get(table, params=None):
+def _supabase_fetch(table, params=None):
+    """GET rows from PostgREST, raising on any failure"""
+    backend = local_backend()
+    if backend:
+        return backend.get(table, params)
     url = f"{SUPABASE_URL}/rest/v1/{table}"
     if params:
         url += '?' + '&'.join(f"{k}={v}" for k, v in params.items())
@@ -107,13 +154,161 @@ def supabase_get(table, params=None):
         'Authorization': f'Bearer {SUPABASE_KEY}',
     }
     req = urllib.request.Request(url, headers=headers)
+    with pooled_urlopen(req) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+# Set when a read on this thread fell back to an empty result, so a response built from
+# it is not cached publicly as if the table really were empty
+_read_state = threading.local()
+
+def note_read_failure():
+    _read_state.failed = True
+
+def reset_read_failures():
+    _read_state.failed = False
+
+def read_failed():
+    return getattr(_read_state, 'failed', False)
+
+def supabase_get(table, params=None):
+    """GET rows from Supabase ([] on failure). Static curriculum tables are read through
+    the in-memory table cache; returned rows may be shared, so do not mutate them."""
+    cache = get_table_cache()
+    if cache.is_cached_table(table):
+        rows = cache.get(table, params)
+        if rows is not MISS:
+            return rows
     try:
-        with urllib.request.urlopen(req) as response:
-            return json.loads(response.read().decode('utf-8'))
+        rows = _supabase_fetch(table, params)
     except:
+        note_read_failure()
         return []
+    if cache.is_cached_table(table) and isinstance(rows, list):
+        cache.put(table, params, rows)
+    return rows
+
+# PostgREST caps each response at its max-rows setting (1000 by default)
+SUPABASE_PAGE_SIZE = int(os.environ.get('SUPABASE_PAGE_SIZE', 1000))
+
+def supabase_get_all(table, params=None, page_size=SUPABASE_PAGE_SIZE):
+    """GET every matching row, paging with limit/offset until a short page arrives, so the
+    server's row cap cannot silently truncate the result. [] on failure, like supabase_get."""
+    params = dict(params or {})
+    params.setdefault('order', 'id.asc')  # stable order across pages
+    rows, offset = [], 0
+    while True:
+        try:
+            page = _supabase_fetch(table, dict(params, limit=page_size, offset=offset))
+        except:
+            note_read_failure()
+            return []
+        if not isinstance(page, list):
+            note_read_failure()
+            return []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        offset += len(page)
+
+def curriculum_rows(table, topic_id=None):
+    """Rows from the compiled curriculum snapshot as (rows, response headers), or
+    (None, None) when there is no snapshot or it lacks the table"""
+    snapshot = get_curriculum_snapshot()
+    if snapshot is None or not snapshot.has(table):
+        return None, None
+    return snapshot.rows(table, topic_id), {'X-Curriculum-Version': snapshot.version}
+
+def content_generation():
+    """Changes whenever curriculum responses may change: a reloaded snapshot or a table cache invalidation"""
+    snapshot = get_curriculum_snapshot()
+    return (snapshot.version if snapshot else None, get_table_cache().generation)
+
+def supabase_count(table, filters=None):
+    """Exact row count via PostgREST count headers (HEAD + Prefer: count=exact).
+    Only the Content-Range header comes back, never the rows. Returns None on failure."""
+    backend = local_backend()
+    if backend:
+        try:
+            return backend.count(table, filters)
+        except Exception:
+            return None
+    url = f"{SUPABASE_URL}/rest/v1/{table}?select=id"
+    if filters:
+        url += '&' + '&'.join(f"{k}={v}" for k, v in filters.items())
+    headers = {
+        'apikey': SUPABASE_KEY,
+        'Authorization': f'Bearer {SUPABASE_KEY}',
+        'Prefer': 'count=exact',
+    }
+    req = urllib.request.Request(url, headers=headers, method='HEAD')
+    try:
+        with pooled_urlopen(req) as response:
+            # Content-Range looks like "0-24/3573" or "*/0"
+            content_range = response.headers.get('Content-Range', '')
+            total = content_range.rsplit('/', 1)[-1]
+            return int(total) if total.isdigit() else None
+    except Exception:
+        return None
+
+# Shared bounded pool for independent PostgREST reads issued by a single request
+QUERY_FANOUT_WORKERS = int(os.environ.get('QUERY_FANOUT_WORKERS', 8))
+QUERY_FANOUT_DEADLINE = float(os.environ.get('QUERY_FANOUT_DEADLINE', 10))
+_query_executor = ThreadPoolExecutor(max_workers=QUERY_FANOUT_WORKERS, thread_name_prefix='supabase-query')
+
+def run_concurrently(tasks, deadline=QUERY_FANOUT_DEADLINE, default=None):
+    """Run independent zero-argument callables in parallel under one overall deadline.
+    `tasks` maps a name to a callable; returns {name: result}. Tasks that raise or miss
+    the deadline yield `default` (a copy, if it is a list or dict). Read failures inside
+    the workers are carried back to the calling thread."""
+    def fallback():
+        return type(default)() if isinstance(default, (list, dict)) else default
+
+    def traced(fn):
+        reset_read_failures()
+        return fn(), read_failed()
+
+    futures = {name: _query_executor.submit(traced, fn) for name, fn in tasks.items()}
+    wait(futures.values(), timeout=deadline)
+    results = {}
+    for name, future in futures.items():
+        if future.done() and not future.cancelled() and future.exception() is None:
+            results[name], failed = future.result()
+            if failed:
+                note_read_failure()
+        else:
+            future.cancel()
+            print(f"[Query fan-out] {name} failed or missed the {deadline}s deadline")
+            note_read_failure()
+            results[name] = fallback()
+    return results
+
+def supabase_get_many(queries, deadline=QUERY_FANOUT_DEADLINE):
+    """Concurrent supabase_get: `queries` maps a name to (table, params); returns {name: rows}"""
+    tasks = {name: (lambda t=table, p=params: supabase_get(t, p)) for name, (table, params) in queries.items()}
+    return run_concurrently(tasks, deadline=deadline, default=[])
+
+STATS_CACHE_TTL = float(os.environ.get('STATS_CACHE_TTL', 60))
+STATS_TABLES = ['topics', 'definitions', 'test_yourself', 'exam_questions', 'case_studies', 'tips', 'common_errors']
+_stats_cache = {'expires': 0.0, 'data': None}
+
+def get_table_stats():
+    """Row counts for the dashboard, counted concurrently and cached for STATS_CACHE_TTL seconds"""
+    now = time.monotonic()
+    if _stats_cache['data'] is not None and _stats_cache['expires'] > now:
+        return _stats_cache['data']
+    counts = run_concurrently({t: (lambda t=t: supabase_count(t)) for t in STATS_TABLES})
+    data = {t: counts[t] or 0 for t in STATS_TABLES}
+    # Only cache a complete answer so a transient failure is retried next request
+    if all(counts[t] is not None for t in STATS_TABLES):
+        _stats_cache['data'] = data
+        _stats_cache['expires'] = now + STATS_CACHE_TTL
+    return data
 
 def supabase_upsert(table, data):
+    get_table_cache().invalidate([table])
+    backend = local_backend()
+    if backend:
+        return backend.upsert(table, data)
     url = f"{SUPABASE_URL}/rest/v1/{table}"
     headers = {
         'apikey': SUPABASE_KEY,
@@ -123,7 +318,7 @@ def supabase_upsert(table, data):
     }
     req = urllib.request.Request(url, data=json.dumps(data).encode(), headers=headers, method='POST')
     try:
-        with urllib.request.urlopen(req) as response:
+        with pooled_urlopen(req) as response:
             return json.loads(response.read().decode('utf-8'))
     except Exception as e:
         return {"error": str(e)}
@@ -469,6 +664,167 @@ def call_alicloud(api_key, model, prompt, max_tokens=1024):
 
     return {"success": False, "error": last_error or "Failed to connect to AliCloud API"}
 
+# Streaming variants: generators yielding text deltas as the provider produces them.
+# Errors are raised as RuntimeError so the caller can report them mid-stream.
+def iter_sse_data(response):
+    """Yield the `data:` payloads of a server-sent event stream"""
+    data_lines = []
+    for raw in response:
+        line = raw.decode('utf-8').rstrip('\r\n')
+        if not line:
+            if data_lines:
+                yield '\n'.join(data_lines)
+                data_lines = []
+            continue
+        if line.startswith('data:'):
+            value = line[5:]
+            data_lines.append(value[1:] if value.startswith(' ') else value)
+    if data_lines:
+        yield '\n'.join(data_lines)
+
+def _open_stream(req, provider_name):
+    try:
+        return urllib.request.urlopen(req, timeout=60)
+    except urllib.error.HTTPError as e:
+        error_body = e.read().decode('utf-8') if e.fp else str(e)
+        raise RuntimeError(f"{provider_name} API error: {e.code} - {error_body}")
+
+def stream_claude(api_key, model, prompt, max_tokens=1024):
+    """Stream Claude API text deltas"""
+    url = "https://api.anthropic.com/v1/messages"
+    headers = {
+        'x-api-key': api_key,
+        'anthropic-version': '2023-06-01',
+        'Content-Type': 'application/json'
+    }
+    data = json.dumps({
+        "model": model,
+        "max_tokens": max_tokens,
+        "stream": True,
+        "messages": [{"role": "user", "content": prompt}]
+    }).encode()
+    req = urllib.request.Request(url, data=data, headers=headers, method='POST')
+    with _open_stream(req, 'Claude') as response:
+        for payload in iter_sse_data(response):
+            event = json.loads(payload)
+            if event.get('type') == 'content_block_delta':
+                text = event.get('delta', {}).get('text')
+                if text:
+                    yield text
+            elif event.get('type') == 'error':
+                raise RuntimeError(f"Claude API error: {event.get('error', {}).get('message', payload)}")
+
+def _stream_openai_compatible(req, provider_name):
+    with _open_stream(req, provider_name) as response:
+        for payload in iter_sse_data(response):
+            if payload.strip() == '[DONE]':
+                break
+            event = json.loads(payload)
+            if event.get('error'):
+                raise RuntimeError(f"{provider_name} API error: {event['error'].get('message', payload)}")
+            choices = event.get('choices') or [{}]
+            text = choices[0].get('delta', {}).get('content')
+            if text:
+                yield text
+
+def stream_openai(api_key, model, prompt, max_tokens=1024):
+    """Stream OpenAI API text deltas"""
+    url = "https://api.openai.com/v1/chat/completions"
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    # Newer models (o1, o3, gpt-4o, gpt-5) use max_completion_tokens instead of max_tokens
+    uses_new_param = any(x in model.lower() for x in ['o1', 'o3', 'o4', 'o5', 'gpt-4o', 'gpt-5'])
+    payload = {
+        "model": model,
+        "stream": True,
+        "messages": [{"role": "user", "content": prompt}]
+    }
+    if uses_new_param:
+        payload["max_completion_tokens"] = max_tokens
+    else:
+        payload["max_tokens"] = max_tokens
+    req = urllib.request.Request(url, data=json.dumps(payload).encode(), headers=headers, method='POST')
+    yield from _stream_openai_compatible(req, 'OpenAI')
+
+def stream_gemini(api_key, model, prompt, max_tokens=1024):
+    """Stream Gemini API text deltas"""
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
+    headers = {'Content-Type': 'application/json'}
+    data = json.dumps({
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {"maxOutputTokens": max_tokens}
+    }).encode()
+    req = urllib.request.Request(url, data=data, headers=headers, method='POST')
+    with _open_stream(req, 'Gemini') as response:
+        for payload in iter_sse_data(response):
+            event = json.loads(payload)
+            for part in (event.get('candidates') or [{}])[0].get('content', {}).get('parts', []):
+                if part.get('text'):
+                    yield part['text']
+
+def stream_alicloud(api_key, model, prompt, max_tokens=1024):
+    """Stream AliCloud (DashScope/Qwen) text deltas - tries both international and China endpoints"""
+    endpoints = [
+        "https://dashscope-intl.aliyuncs.com/compatible-mode/v1/chat/completions",
+        "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
+    ]
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    data = json.dumps({
+        "model": model,
+        "stream": True,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": max_tokens
+    }).encode()
+
+    last_error = None
+    for url in endpoints:
+        req = urllib.request.Request(url, data=data, headers=headers, method='POST')
+        try:
+            response = urllib.request.urlopen(req, timeout=60)
+        except urllib.error.HTTPError as e:
+            error_body = ""
+            try:
+                error_body = e.read().decode('utf-8')
+            except:
+                pass
+            # If it's a 401, try the next endpoint
+            if e.code == 401:
+                last_error = f"AliCloud API error: {e.code} - {error_body[:200]}"
+                continue
+            raise RuntimeError(f"AliCloud API error: {e.code} - {error_body}")
+        except Exception as e:
+            last_error = str(e)
+            continue
+        with response:
+            for payload in iter_sse_data(response):
+                if payload.strip() == '[DONE]':
+                    break
+                choices = json.loads(payload).get('choices') or [{}]
+                text = choices[0].get('delta', {}).get('content')
+                if text:
+                    yield text
+        return
+
+    raise RuntimeError(last_error or "Failed to connect to AliCloud API")
+
+STREAM_PROVIDERS = {
+    'claude': stream_claude,
+    'openai': stream_openai,
+    'gemini': stream_gemini,
+    'alicloud': stream_alicloud,
+}
+DEFAULT_CHAT_MODELS = {
+    'claude': 'claude-haiku-4-5-20251001',
+    'openai': 'gpt-4o-mini',
+    'gemini': 'gemini-2.5-flash',
+    'alicloud': 'qwen-flash',
+}
+
 # ============================================
 # RAG HELPER FUNCTIONS
 # ============================================
@@ -496,6 +852,139 @@ def get_openai_embedding(api_key, text):
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+def get_query_embedding(api_key, text):
+    """Embedding for a search query, served from the embedding cache when possible"""
+    cache = get_embedding_cache()
+    embedding = cache.get(OPENAI_EMBEDDING_MODEL, text)
+    if embedding is not None:
+        return {"success": True, "embedding": embedding, "cached": True}
+    result = get_openai_embedding(api_key, text)
+    if result.get('success') and result.get('embedding'):
+        cache.put(OPENAI_EMBEDDING_MODEL, text, result['embedding'])
+    return result
+
+# Embedding batch limits (the API accepts up to 2048 inputs / ~300k tokens per request)
+EMBEDDING_BATCH_MAX_ITEMS = int(os.environ.get('EMBEDDING_BATCH_MAX_ITEMS', 128))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.environ.get('EMBEDDING_BATCH_MAX_TOKENS', 200000))
+EMBEDDING_INPUT_MAX_TOKENS = 8000
+EMBEDDING_MAX_IN_FLIGHT = int(os.environ.get('EMBEDDING_MAX_IN_FLIGHT', 4))
+# Retries of one batch after a 429, 5xx or network error, with exponential backoff
+EMBEDDING_MAX_RETRIES = int(os.environ.get('EMBEDDING_MAX_RETRIES', 3))
+EMBEDDING_RETRY_BASE_DELAY = float(os.environ.get('EMBEDDING_RETRY_BASE_DELAY', 1.0))
+
+def estimate_tokens(text):
+    """Conservative token estimate without a tokenizer (~3 chars per token, at least 1 per word)"""
+    return max(len(text) // 3, len(text.split()), 1)
+
+def get_openai_embeddings(api_key, texts):
+    """Generate embeddings for a list of texts in a single request (array `input`).
+    Failures carry the HTTP `status` (None for network errors and timeouts) and any `retry_after`."""
+    url = "https://api.openai.com/v1/embeddings"
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    data = json.dumps({
+        "model": OPENAI_EMBEDDING_MODEL,
+        "input": texts
+    }).encode()
+    req = urllib.request.Request(url, data=data, headers=headers, method='POST')
+    try:
+        with pooled_urlopen(req, timeout=60) as response:
+            result = json.loads(response.read().decode('utf-8'))
+            items = sorted(result.get('data', []), key=lambda d: d.get('index', 0))
+            embeddings = [item.get('embedding', []) for item in items]
+            if len(embeddings) != len(texts):
+                return {"success": False, "status": 200,
+                        "error": f"Expected {len(texts)} embeddings, got {len(embeddings)}"}
+            return {"success": True, "embeddings": embeddings}
+    except urllib.error.HTTPError as e:
+        error_body = e.read().decode('utf-8') if e.fp else str(e)
+        return {"success": False, "status": e.code, "retry_after": e.headers.get('Retry-After') if e.headers else None,
+                "error": f"OpenAI Embedding error: {e.code} - {error_body}"}
+    except Exception as e:
+        return {"success": False, "status": None, "error": str(e)}
+
+def embedding_error_kind(result):
+    """Classify a failed get_openai_embeddings result: 'input' (split the batch to isolate the
+    bad text), 'auth' (every batch will fail), 'transient' (back off and resend) or 'fatal'."""
+    status = result.get('status')
+    error = (result.get('error') or '').lower()
+    if status in (400, 413) or 'context length' in error or 'maximum context' in error:
+        return 'input'
+    if status in (401, 403):
+        return 'auth'
+    if status is None or status == 429 or status >= 500:
+        return 'transient'
+    return 'fatal'
+
+def batch_texts_for_embedding(texts, max_items=EMBEDDING_BATCH_MAX_ITEMS, max_tokens=EMBEDDING_BATCH_MAX_TOKENS):
+    """Pack text indexes into batches that respect the per-request item and token limits"""
+    batches = []
+    current, current_tokens = [], 0
+    for i, text in enumerate(texts):
+        tokens = min(estimate_tokens(text), EMBEDDING_INPUT_MAX_TOKENS)
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def embed_texts(api_key, texts, max_in_flight=EMBEDDING_MAX_IN_FLIGHT):
+    """Embed many texts with batched requests, keeping up to `max_in_flight` batches running.
+    Rate limits, 5xx and network errors resend the same batch with exponential backoff. Only
+    input errors (400/413, context length) split a batch in half to isolate the bad text. An
+    auth failure (401/403) fails every remaining batch without sending it.
+    Returns (embeddings, errors) where embeddings[i] is the vector for texts[i] or None."""
+    embeddings = [None] * len(texts)
+    errors = []
+    auth_failure = []
+
+    def fail(indexes, error):
+        errors.extend({'index': i, 'error': error} for i in indexes)
+
+    def request_with_backoff(indexes):
+        for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+            result = get_openai_embeddings(api_key, [texts[i] for i in indexes])
+            if result.get('success') or embedding_error_kind(result) != 'transient' or attempt == EMBEDDING_MAX_RETRIES:
+                return result
+            try:
+                delay = float(result.get('retry_after'))
+            except (TypeError, ValueError):
+                delay = EMBEDDING_RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random())
+            time.sleep(delay)
+        return result
+
+    def run_batch(indexes):
+        if auth_failure:
+            fail(indexes, auth_failure[0])
+            return
+        result = request_with_backoff(indexes)
+        if result.get('success'):
+            for i, emb in zip(indexes, result['embeddings']):
+                embeddings[i] = emb
+            return
+        kind = embedding_error_kind(result)
+        if kind == 'auth':
+            auth_failure.append(result.get('error'))
+        if kind != 'input' or len(indexes) == 1:
+            fail(indexes, result.get('error'))
+            return
+        mid = len(indexes) // 2
+        run_batch(indexes[:mid])
+        run_batch(indexes[mid:])
+
+    batches = batch_texts_for_embedding(texts)
+    if len(batches) == 1:
+        run_batch(batches[0])
+    elif batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_in_flight, len(batches)))) as pool:
+            list(pool.map(run_batch, batches))
+    return embeddings, errors
+
 def chunk_text(text, chunk_size=500, overlap=50):
     """Split text into overlapping chunks"""
     words = text.split()
@@ -508,19 +997,25 @@ def chunk_text(text, chunk_size=500, overlap=50):
         start = end - overlap
     return chunks
 
-def supabase_post(table, data):
-    """POST to Supabase (insert only, no upsert)"""
+def supabase_post(table, data, returning='representation'):
+    """POST to Supabase (insert only, no upsert). `data` may be a dict or a list of rows.
+    Use returning='minimal' for bulk inserts where the inserted rows are not needed."""
+    get_table_cache().invalidate([table])
+    backend = local_backend()
+    if backend:
+        return backend.post(table, data, returning)
     url = f"{SUPABASE_URL}/rest/v1/{table}"
     headers = {
         'apikey': SUPABASE_KEY,
         'Authorization': f'Bearer {SUPABASE_KEY}',
         'Content-Type': 'application/json',
-        'Prefer': 'return=representation'
+        'Prefer': f'return={returning}'
     }
     req = urllib.request.Request(url, data=json.dumps(data).encode(), headers=headers, method='POST')
     try:
-        with urllib.request.urlopen(req) as response:
-            return json.loads(response.read().decode('utf-8'))
+        with pooled_urlopen(req) as response:
+            raw = response.read().decode('utf-8')
+            return json.loads(raw) if raw else []
     except urllib.error.HTTPError as e:
         error_body = e.read().decode('utf-8') if e.fp else ''
         return {"error": f"HTTP {e.code}: {error_body}"}
@@ -529,6 +1024,10 @@ def supabase_post(table, data):
 
 def supabase_patch(table, data, filters):
     """PATCH to Supabase (update)"""
+    get_table_cache().invalidate([table])
+    backend = local_backend()
+    if backend:
+        return backend.patch(table, data, filters)
     url = f"{SUPABASE_URL}/rest/v1/{table}?" + '&'.join(f"{k}={v}" for k, v in filters.items())
     headers = {
         'apikey': SUPABASE_KEY,
@@ -538,13 +1037,17 @@ def supabase_patch(table, data, filters):
     }
     req = urllib.request.Request(url, data=json.dumps(data).encode(), headers=headers, method='PATCH')
     try:
-        with urllib.request.urlopen(req) as response:
+        with pooled_urlopen(req) as response:
             return json.loads(response.read().decode('utf-8'))
     except Exception as e:
         return {"error": str(e)}
 
 def supabase_delete(table, filters):
     """DELETE from Supabase"""
+    get_table_cache().invalidate([table])
+    backend = local_backend()
+    if backend:
+        return backend.delete(table, filters)
     url = f"{SUPABASE_URL}/rest/v1/{table}?" + '&'.join(f"{k}={v}" for k, v in filters.items())
     headers = {
         'apikey': SUPABASE_KEY,
@@ -552,13 +1055,16 @@ def supabase_delete(table, filters):
     }
     req = urllib.request.Request(url, headers=headers, method='DELETE')
     try:
-        with urllib.request.urlopen(req) as response:
+        with pooled_urlopen(req) as response:
             return {"success": True}
     except Exception as e:
         return {"error": str(e)}
 
 def supabase_rpc(function_name, params):
     """Call Supabase RPC function"""
+    backend = local_backend()
+    if backend:
+        return backend.rpc(function_name, params)
     url = f"{SUPABASE_URL}/rest/v1/rpc/{function_name}"
     headers = {
         'apikey': SUPABASE_KEY,
@@ -567,7 +1073,7 @@ def supabase_rpc(function_name, params):
     }
     req = urllib.request.Request(url, data=json.dumps(params).encode(), headers=headers, method='POST')
     try:
-        with urllib.request.urlopen(req, timeout=30) as response:
+        with pooled_urlopen(req, timeout=30) as response:
             return json.loads(response.read().decode('utf-8'))
     except urllib.error.HTTPError as e:
         error_body = e.read().decode('utf-8') if e.fp else ''
@@ -575,54 +1081,152 @@ def supabase_rpc(function_name, params):
     except Exception as e:
         return {"error": str(e)}
 
-def search_chunks_fallback(query_embedding, match_count=8, filter_document_id=None):
-    """Fallback search using direct SQL via PostgREST when RPC function is missing.
-    This computes cosine similarity in Python as a fallback when pgvector RPC is unavailable."""
-    import math
-
-    # Fetch all chunks with embeddings in a single query
-    params = {'select': 'id,document_id,chunk_index,page_number,content,token_count,embedding'}
+class SupabaseBatchWriter:
+    """Buffer rows and insert them as PostgREST array inserts.
+
+    A failed batch is split in half and retried until the bad rows are isolated,
+    so one malformed row never loses the rest of its batch. Failed rows are
+    reported individually in `failures`.
+    """
+
+    def __init__(self, table, batch_size=100, key_field=None):
+        self.table = table
+        self.batch_size = max(1, int(batch_size))
+        self.key_field = key_field
+        self.inserted = 0
+        self.failures = []
+        self.requests = 0
+        self._buffer = []
+
+    def add(self, row):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        rows, self._buffer = self._buffer, []
+        if rows:
+            self._insert(rows)
+
+    def _insert(self, rows):
+        self.requests += 1
+        result = supabase_post(self.table, rows, returning='minimal')
+        if not (isinstance(result, dict) and result.get('error')):
+            self.inserted += len(rows)
+            return
+        error = result.get('error')
+        # Only row-level rejections (bad data, conflicts) are worth bisecting;
+        # auth/network/server errors would fail every sub-batch the same way
+        if len(rows) == 1 or not error.startswith(('HTTP 400', 'HTTP 409', 'HTTP 422')):
+            for row in rows:
+                self.failures.append({
+                    'key': row.get(self.key_field) if self.key_field else None,
+                    'error': error
+                })
+            return
+        mid = len(rows) // 2
+        self._insert(rows[:mid])
+        self._insert(rows[mid:])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+        return False
+
+CHUNK_COLUMNS = 'id,document_id,chunk_index,page_number,content,token_count'
+
+def build_document_index(document_id, chunk_rows):
+    """Write the local embedding and keyword indexes for freshly inserted chunks.
+    Chunk ids are assigned by the database, so they are looked up by chunk_index."""
+    stored = supabase_get_all('pdf_chunks', {'select': 'id,chunk_index', 'document_id': f'eq.{document_id}'})
+    if not stored or isinstance(stored, dict):
+        return None
+    id_by_index = {c.get('chunk_index'): c.get('id') for c in stored}
+    rows = [dict(row, id=id_by_index.get(row['chunk_index'])) for row in chunk_rows]
+    try:
+        write_keyword_index(document_id, rows)
+        return write_index(document_id, rows)
+    except OSError as e:
+        print(f"[RAG DEBUG] Could not write embedding index for {document_id}: {e}")
+        return None
+
+def load_documents_chunks(document_ids):
+    """Return [(document_id, EmbeddingMatrix, rows)] for several documents, rows aligned to
+    matrix rows. Chunk rows for every document come from one paged query without the embedding
+    column; documents whose memory-mapped index is missing or stale are re-fetched with
+    embeddings in one more paged query and their indexes rebuilt. An index is only written
+    when the rows fetched match the server's exact count for the document."""
+    in_filter = f"in.({','.join(str(d) for d in document_ids)})"
+    rows_by_doc = {doc_id: [] for doc_id in document_ids}
+    indexes = {doc_id: load_index(doc_id) for doc_id in document_ids}
+
+    loaded = {}
+    if any(indexes.values()):
+        chunks = supabase_get_all('pdf_chunks', {'select': CHUNK_COLUMNS, 'document_id': in_filter})
+        for c in (chunks if isinstance(chunks, list) else []):
+            rows_by_doc.setdefault(c.get('document_id'), []).append(c)
+        for doc_id, index in indexes.items():
+            doc_rows = rows_by_doc.get(doc_id, [])
+            if index is None or len(doc_rows) != len(index):
+                continue
+            by_id = {c.get('id'): c for c in doc_rows}
+            rows = [by_id.get(chunk_id) for chunk_id in index.ids]
+            if all(rows):
+                loaded[doc_id] = (index.matrix, rows)
+
+    stale = [doc_id for doc_id in document_ids if doc_id not in loaded]
+    if stale:
+        stale_filter = f"in.({','.join(str(d) for d in stale)})"
+        chunks = supabase_get_all('pdf_chunks', {'select': CHUNK_COLUMNS + ',embedding', 'document_id': stale_filter})
+        grouped = {doc_id: [] for doc_id in stale}
+        for c in (chunks if isinstance(chunks, list) else []):
+            grouped.setdefault(c.get('document_id'), []).append(c)
+        for doc_id in stale:
+            matrix, rows = EmbeddingMatrix.from_rows(grouped.get(doc_id, []))
+            loaded[doc_id] = (matrix, rows)
+            expected = supabase_count('pdf_chunks', {'document_id': f'eq.{doc_id}'})
+            if expected != len(grouped.get(doc_id, [])):
+                # Incomplete fetch (or unknown count): use the rows for this request only
+                print(f"[RAG DEBUG] Not indexing {doc_id}: fetched {len(grouped.get(doc_id, []))} of {expected} chunks")
+                continue
+            try:
+                write_index(doc_id, rows)
+            except OSError as e:
+                print(f"[RAG DEBUG] Could not write embedding index for {doc_id}: {e}")
 
-    if filter_document_id:
-        params['document_id'] = f'eq.{filter_document_id}'
+    return [(doc_id, loaded[doc_id][0], loaded[doc_id][1]) for doc_id in document_ids]
 
-    chunks = supabase_get('pdf_chunks', params)
+def all_document_ids():
+    """Ids of every uploaded document, so corpus-wide searches go through the per-document indexes"""
+    docs = supabase_get_all('pdf_documents', {'select': 'id'})
+    return [d['id'] for d in docs if d.get('id') is not None] if isinstance(docs, list) else []
 
-    if not chunks or isinstance(chunks, dict):
+def search_chunks_fallback(query_embedding, match_count=8, filter_document_id=None):
+    """Fallback search using direct SQL via PostgREST when RPC function is missing.
+    This computes cosine similarity in Python as a fallback when pgvector RPC is unavailable."""
+    document_ids = [filter_document_id] if filter_document_id else all_document_ids()
+    if not document_ids:
         return []
 
-    def cosine_similarity(vec1, vec2):
-        if not vec1 or not vec2 or len(vec1) != len(vec2):
-            return 0
-        dot_product = sum(a * b for a, b in zip(vec1, vec2))
-        norm1 = math.sqrt(sum(a * a for a in vec1))
-        norm2 = math.sqrt(sum(b * b for b in vec2))
-        if norm1 == 0 or norm2 == 0:
-            return 0
-        return dot_product / (norm1 * norm2)
+    # Score every chunk with one matrix-vector product per document
+    rows, parts = [], []
+    for _, matrix, doc_rows in load_documents_chunks(document_ids):
+        if doc_rows:
+            parts.append(matrix.cosine(query_embedding))
+            rows.extend(doc_rows)
+    if not rows:
+        return []
+    similarities = np.concatenate(parts)
 
     results = []
-    for chunk in chunks:
-        chunk_embedding = chunk.get('embedding')
-        if not chunk_embedding:
-            continue
-
-        # Parse embedding if it's a string (PostgreSQL array format)
-        if isinstance(chunk_embedding, str):
-            try:
-                chunk_embedding = json.loads(chunk_embedding)
-            except:
-                continue
-
-        similarity = cosine_similarity(query_embedding, chunk_embedding)
+    for idx in top_k(similarities, match_count):
         # Remove embedding from result to reduce response size
-        chunk_result = {k: v for k, v in chunk.items() if k != 'embedding'}
-        chunk_result['similarity'] = similarity
+        chunk_result = {k: v for k, v in rows[idx].items() if k != 'embedding'}
+        chunk_result['similarity'] = float(similarities[idx])
         results.append(chunk_result)
-
-    # Sort by similarity and return top matches
-    results.sort(key=lambda x: x.get('similarity', 0), reverse=True)
-    return results[:match_count]
+    return results
 
 def extract_key_terms(query):
     """Extract meaningful terms from a query, filtering out common words."""
@@ -646,86 +1250,111 @@ def extract_key_terms(query):
     words = re.findall(r'\b[a-zA-Z]{3,}\b', query.lower())
     return [w for w in words if w not in stop_words]
 
+def load_document_keyword_index(document_id, rows):
+    """Return the stored BM25 index for a document, rebuilding it from `rows` if missing or stale.
+    Stale means its chunk ids differ from the rows' (re-processing assigns new ids)."""
+    index = load_keyword_index(document_id)
+    if index is not None and set(index.ids) == {r.get('id') for r in rows if r.get('id') is not None}:
+        return index
+    try:
+        return write_keyword_index(document_id, rows)
+    except OSError as e:
+        print(f"[RAG DEBUG] Could not write keyword index for {document_id}: {e}")
+        return KeywordIndex.build(rows)
+
+def keyword_scores(key_terms, rows, index):
+    """BM25 keyword scores (0-1) aligned to `rows`. Only chunks containing a query term
+    are touched; every other chunk scores 0."""
+    kw_scores = np.zeros(len(rows), dtype=np.float32)
+    if not key_terms or not rows:
+        return kw_scores
+    hits = index.score(key_terms)
+    if not hits:
+        return kw_scores
+    position = {row.get('id'): i for i, row in enumerate(rows)}
+    for row_num, score in hits.items():
+        i = position.get(index.ids[row_num])
+        if i is not None:
+            kw_scores[i] = score
+    return kw_scores
+
+def hybrid_scores(semantic, kw_scores):
+    """Hybrid score: weighted combination
+    If keywords match strongly, boost the result significantly
+    Weight: 60% semantic + 40% keyword, with bonus for keyword matches"""
+    return np.where(kw_scores > 0, (0.6 * semantic) + (0.4 * kw_scores) + (0.15 * kw_scores), semantic)
+
+def hybrid_result(row, hybrid, semantic, kw_scores, idx):
+    """Build the result dict for row `idx` (without its embedding)"""
+    chunk_result = {k: v for k, v in row.items() if k != 'embedding'}
+    chunk_result['similarity'] = float(hybrid[idx])
+    chunk_result['semantic_similarity'] = float(semantic[idx])
+    chunk_result['keyword_score'] = float(kw_scores[idx])
+    return chunk_result
+
 def hybrid_search_chunks(query, query_embedding, match_count=15, filter_document_id=None):
     """Hybrid search combining semantic similarity with keyword matching.
     This significantly improves retrieval for definition/terminology queries."""
-    import math
-
-    # Extract key terms from query for keyword boosting
-    key_terms = extract_key_terms(query)
-    print(f"[RAG DEBUG] Hybrid search - key terms: {key_terms}")
-
-    # Fetch all chunks with embeddings
-    params = {'select': 'id,document_id,chunk_index,page_number,content,token_count,embedding'}
     if filter_document_id:
-        params['document_id'] = f'eq.{filter_document_id}'
+        return hybrid_search_documents(query, query_embedding, [filter_document_id], match_count)
 
-    chunks = supabase_get('pdf_chunks', params)
-    if not chunks or isinstance(chunks, dict):
+    # Search the whole corpus through each document's cached indexes, keeping the global top k
+    document_ids = all_document_ids()
+    if not document_ids:
         return []
+    rows, hybrid, semantic, kw_scores = score_documents(query, query_embedding, document_ids)
+    return [hybrid_result(rows[idx], hybrid, semantic, kw_scores, idx) for idx in top_k(hybrid, match_count)]
 
-    def cosine_similarity(vec1, vec2):
-        if not vec1 or not vec2 or len(vec1) != len(vec2):
-            return 0
-        dot_product = sum(a * b for a, b in zip(vec1, vec2))
-        norm1 = math.sqrt(sum(a * a for a in vec1))
-        norm2 = math.sqrt(sum(b * b for b in vec2))
-        if norm1 == 0 or norm2 == 0:
-            return 0
-        return dot_product / (norm1 * norm2)
-
-    def keyword_score(content, terms):
-        """Calculate keyword match score based on term frequency."""
-        if not terms or not content:
-            return 0
-        content_lower = content.lower()
-        score = 0
-        for term in terms:
-            # Count occurrences of the term
-            count = content_lower.count(term)
-            if count > 0:
-                score += min(count, 3)  # Cap at 3 to avoid over-weighting
-        return score / (len(terms) * 3)  # Normalize to 0-1 range
+def score_documents(query, query_embedding, document_ids):
+    """Hybrid-score every chunk of several documents in one pass, using their memory-mapped
+    embedding indexes and stored keyword indexes. Returns (rows, hybrid, semantic, kw_scores)."""
+    key_terms = extract_key_terms(query)
+    print(f"[RAG DEBUG] Hybrid search over {len(document_ids)} document(s) - key terms: {key_terms}")
+
+    rows, semantic_parts, keyword_parts = [], [], []
+    for doc_id, matrix, doc_rows in load_documents_chunks(document_ids):
+        if doc_rows:
+            semantic_parts.append(matrix.cosine(query_embedding))
+            keyword_parts.append(keyword_scores(key_terms, doc_rows, load_document_keyword_index(doc_id, doc_rows)))
+            rows.extend(doc_rows)
+    if not rows:
+        empty = np.zeros(0, dtype=np.float32)
+        return rows, empty, empty, empty
+
+    semantic = np.concatenate(semantic_parts)
+    kw_scores = np.concatenate(keyword_parts)
+    return rows, hybrid_scores(semantic, kw_scores), semantic, kw_scores
+
+def hybrid_search_documents(query, query_embedding, document_ids, per_document_count=10):
+    """Hybrid search over several documents in a single pass.
+    Candidates for all documents are loaded together, scored once, and selected best-first
+    while applying a per-document quota of `per_document_count` chunks."""
+    rows, hybrid, semantic, kw_scores = score_documents(query, query_embedding, document_ids)
+    if not rows:
+        return []
 
+    # Best-first selection with a per-document quota
+    quota = {doc_id: per_document_count for doc_id in document_ids}
+    remaining = per_document_count * len(document_ids)
     results = []
-    for chunk in chunks:
-        chunk_embedding = chunk.get('embedding')
-        content = chunk.get('content', '')
-
-        if not chunk_embedding:
+    for idx in np.argsort(-hybrid, kind='stable'):
+        doc_id = rows[idx].get('document_id')
+        if quota.get(doc_id, 0) <= 0:
             continue
-
-        # Parse embedding if it's a string
-        if isinstance(chunk_embedding, str):
-            try:
-                chunk_embedding = json.loads(chunk_embedding)
-            except:
-                continue
-
-        # Calculate semantic similarity
-        semantic_sim = cosine_similarity(query_embedding, chunk_embedding)
-
-        # Calculate keyword score
-        kw_score = keyword_score(content, key_terms)
-
-        # Hybrid score: weighted combination
-        # If keywords match strongly, boost the result significantly
-        # Weight: 60% semantic + 40% keyword, with bonus for keyword matches
-        if kw_score > 0:
-            # Boost chunks that contain query keywords
-            hybrid_score = (0.6 * semantic_sim) + (0.4 * kw_score) + (0.15 * kw_score)
-        else:
-            hybrid_score = semantic_sim
-
-        chunk_result = {k: v for k, v in chunk.items() if k != 'embedding'}
-        chunk_result['similarity'] = hybrid_score
-        chunk_result['semantic_similarity'] = semantic_sim
-        chunk_result['keyword_score'] = kw_score
-        results.append(chunk_result)
-
-    # Sort by hybrid score
-    results.sort(key=lambda x: x.get('similarity', 0), reverse=True)
-    return results[:match_count]
+        quota[doc_id] -= 1
+        remaining -= 1
+        results.append(hybrid_result(rows[idx], hybrid, semantic, kw_scores, idx))
+        if remaining <= 0:
+            break
+    return results
+
+def document_fingerprint(docs, document_ids):
+    """Digest of the searched documents' ids and update times, so cached answers
+    stop matching once a document is reprocessed or deleted on any instance"""
+    wanted = set(document_ids) if document_ids else None
+    parts = sorted(f"{d.get('id')}:{d.get('updated_at')}" for d in (docs or [])
+                   if wanted is None or d.get('id') in wanted)
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
 
 def upload_to_supabase_storage(bucket, path, file_data, content_type='application/pdf'):
     """Upload file to Supabase storage"""
@@ -750,22 +1379,204 @@ def upload_to_supabase_storage(bucket, path, file_data, content_type='applicatio
     except Exception as e:
         return {"success": False, "error": f"Upload exception: {str(e)}"}
 
+def download_from_supabase_storage(bucket, path):
+    """Download a file from Supabase storage; None if it does not exist"""
+    url = f"{SUPABASE_URL}/storage/v1/object/{bucket}/{path}"
+    req = urllib.request.Request(url, headers={'Authorization': f'Bearer {SUPABASE_KEY}'})
+    try:
+        with pooled_urlopen(req, timeout=10) as response:
+            return response.read()
+    except urllib.error.HTTPError as e:
+        if e.code in (400, 404):
+            return None
+        raise
+
+# Synthesized TTS clips are shared between instances through a storage bucket, when configured
+if TTS_CACHE_BUCKET and SUPABASE_KEY and STORAGE_BACKEND != 'sqlite':
+    get_tts_cache().attach_blob_store(
+        lambda name: download_from_supabase_storage(TTS_CACHE_BUCKET, f"tts/{name}"),
+        lambda name, audio, content_type: upload_to_supabase_storage(TTS_CACHE_BUCKET, f"tts/{name}", audio, content_type))
+
 def get_public_url(bucket, path):
     """Get public URL for a file in Supabase storage"""
     return f"{SUPABASE_URL}/storage/v1/object/public/{bucket}/{path}"
 
+def edge_tts_stream(text):
+    """Yield Edge-TTS MP3 chunks as they arrive (runs on the shared engine loop, see api/edge_tts_engine.py)"""
+    return get_edge_tts_engine().stream(text, EDGE_TTS_VOICE)
+
+def edge_tts_synthesize(text):
+    """Synthesize text with Edge-TTS, returning MP3 bytes"""
+    return get_edge_tts_engine().synthesize(text, EDGE_TTS_VOICE)
+
+# Endpoints register themselves on this router with @routes.get / @routes.post
+routes = Router()
+
 class handler(BaseHTTPRequestHandler):
     def _cors_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
 
-    def _json_response(self, status, data):
+    def _json_response(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        static = getattr(self, '_static_response', False)
+        # A body built from a failed read must not be stored or served from shared caches
+        cacheable = static and status == 200 and not read_failed()
+        if cacheable:
+            etag = compute_etag(body)
+            get_etag_index().store(self.path, self._generation, etag)
+            if etag_matches(self.headers.get('If-None-Match'), etag):
+                get_etag_index().record('revalidated')
+                self._send_not_modified(etag)
+                return
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        payload, encoding = encode_body(body, self.headers.get('Accept-Encoding'), static=static)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        if cacheable:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', CURRICULUM_CACHE_CONTROL)
+        else:
+            self.send_header('Cache-Control', PRIVATE_CACHE_CONTROL)
+        # An explicit length lets HTTP/1.1 clients keep the connection open
+        self.send_header('Content-Length', str(len(payload)))
+        self._cors_headers()
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _wants_binary_audio(self):
+        """Binary audio is opted into with an audio/* Accept header or ?binary=1; JSON stays the default"""
+        return 'audio/' in self.headers.get('Accept', '') or self._get_query_param('binary') == '1'
+
+    def _audio_response(self, audio_bytes, audio_format, binary=None):
+        """Send TTS audio as raw bytes, or as base64 in JSON ({"audio", "format"}) for older clients"""
+        if not (self._wants_binary_audio() if binary is None else binary):
+            self._json_response(200, {"audio": base64.b64encode(audio_bytes).decode('utf-8'), "format": audio_format})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', AUDIO_MIME_TYPES.get(audio_format, 'application/octet-stream'))
+        self.send_header('Content-Length', str(len(audio_bytes)))
+        self.send_header('Cache-Control', PRIVATE_CACHE_CONTROL)
+        self.send_header('X-Audio-Format', audio_format)
+        self._cors_headers()
+        self.end_headers()
+        self.wfile.write(audio_bytes)
+
+    def _audio_stream_response(self, chunks, audio_format, prefix=b''):
+        """Relay audio chunks to the client as they arrive, with chunked transfer encoding on
+        HTTP/1.1 (HTTP/1.0 clients get the raw stream and a closed connection). The first chunk
+        is awaited before the headers go out, so an error before any audio raises normally.
+        Returns the chunks sent (without prefix) when the clip fits TTS_CACHE_MAX_CLIP_BYTES
+        and finished cleanly, else None."""
+        chunks = iter(chunks)
+        first = next(chunks, b'')
+        chunked = self.protocol_version >= 'HTTP/1.1' and self.request_version >= 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-Type', AUDIO_MIME_TYPES.get(audio_format, 'application/octet-stream'))
+        self.send_header('Cache-Control', PRIVATE_CACHE_CONTROL)
+        self.send_header('X-Audio-Format', audio_format)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.close_connection = True
+            self.send_header('Connection', 'close')
+        self._cors_headers()
+        self.end_headers()
+
+        def write(data):
+            self.wfile.write(b'%X\r\n%s\r\n' % (len(data), data) if chunked else data)
+
+        kept, kept_bytes = [], 0
+        try:
+            if prefix:
+                write(prefix)
+            for data in itertools.chain((first,), chunks):
+                if not data:
+                    continue
+                write(data)
+                if kept is not None:
+                    kept_bytes += len(data)
+                    if kept_bytes <= TTS_CACHE_MAX_CLIP_BYTES:
+                        kept.append(data)
+                    else:
+                        kept = None
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+            return kept
+        except (BrokenPipeError, ConnectionResetError):
+            print("[TTS Stream] Client disconnected")
+        except Exception as e:
+            # Headers are out; ending without the last chunk tells the client the clip is cut short
+            print(f"[TTS Stream] Stream failed after headers: {e}")
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        self.close_connection = True
+        return None
+
+    def _tts_stream(self, cache_key, audio_format, chunks):
+        """Stream a clip (raw PCM under a streaming WAV header for 'wav') and cache it if it fits"""
+        prefix = wav_stream_header(24000) if audio_format == 'wav' else b''
+        sent = self._audio_stream_response(chunks, audio_format, prefix)
+        if sent:
+            audio = pcm_to_wav(b''.join(sent), 24000) if audio_format == 'wav' else b''.join(sent)
+            get_tts_cache().put(cache_key, audio_format, audio, AUDIO_MIME_TYPES[audio_format])
+
+    def _send_not_modified(self, etag):
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', CURRICULUM_CACHE_CONTROL)
+        self.send_header('Vary', 'Accept-Encoding')
         self._cors_headers()
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+
+    def _not_modified(self):
+        """Answer 304 without running the endpoint when If-None-Match has the ETag last sent for
+        this URL and the curriculum content has not changed since"""
+        self._generation = content_generation()
+        etag = get_etag_index().lookup(self.path, self._generation)
+        if not etag_matches(self.headers.get('If-None-Match'), etag):
+            return False
+        get_etag_index().record('not_modified')
+        self._send_not_modified(etag)
+        return True
+
+    def _sse_start(self):
+        """Begin a Server-Sent Events response (the connection closes when the stream ends)"""
+        self.close_connection = True
+        self._sse_started = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.send_header('X-Accel-Buffering', 'no')
+        self._cors_headers()
+        self.end_headers()
+
+    def _sse_event(self, data, event=None):
+        message = f"event: {event}\n" if event else ''
+        message += f"data: {json.dumps(data)}\n\n"
+        self.wfile.write(message.encode())
+        self.wfile.flush()
+
+    def _sse_relay(self, stream):
+        """Relay text deltas as `data: {"delta": ...}` events; returns (text, error)"""
+        parts = []
+        try:
+            for delta in stream:
+                parts.append(delta)
+                self._sse_event({"delta": delta})
+        except (BrokenPipeError, ConnectionResetError):
+            return ''.join(parts), "Client disconnected"
+        except Exception as e:
+            self._sse_event({"error": str(e)}, event='error')
+            return ''.join(parts), str(e)
+        return ''.join(parts), None
 
     def _get_user_id(self):
         auth = self.headers.get('Authorization', '').replace('Bearer ', '')
@@ -781,823 +1592,866 @@ class handler(BaseHTTPRequestHandler):
 
     def do_OPTIONS(self):
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self._cors_headers()
         self.end_headers()
 
     def do_GET(self):
         path = self.path.replace('/api', '').split('?')[0]
-
-        if path in ['/', '/health']:
-            self._json_response(200, {"status": "healthy"})
-            return
-
-        if path == '/auth/me':
-            user_id = self._get_user_id()
-            if user_id:
-                users = supabase_get('users', {'id': f'eq.{user_id}', 'select': 'id,username,display_name'})
-                if users:
-                    self._json_response(200, users[0])
-                    return
-            self._json_response(401, {"error": "Not authenticated"})
+        route, params = routes.match('GET', path)
+        # Static (curriculum) responses get ETags and keep their compressed bodies cached
+        self._static_response = getattr(route, 'static', False)
+        if route is None:
+            self._json_response(404, {"error": "Not found"})
             return
-
-        if path == '/topics':
-            topics = supabase_get('topics', {'select': '*', 'order': 'theme_number,topic_number'})
-            themes = {}
-            for t in topics:
-                n = t['theme_number']
-                if n not in themes:
-                    themes[n] = {"theme_number": n, "theme_name": t['theme_name'], "topics": []}
-                themes[n]['topics'].append({"id": t['id'], "topic_number": t['topic_number'],
-                    "topic_name": t['topic_name'], "textbook_pages": t.get('textbook_pages')})
-            self._json_response(200, list(themes.values()))
+        if self._static_response and self._not_modified():
             return
+        reset_read_failures()
+        route(self, **params)
 
-        if path.startswith('/topics/') and not any(x in path for x in ['/flashcards', '/quiz', '/test', '/teacher']):
-            topic_id = path.split('/')[-1]
-            topics = supabase_get('topics', {'id': f'eq.{topic_id}'})
-            defs = supabase_get('definitions', {'topic_id': f'eq.{topic_id}'})
-            questions = supabase_get('questions', {'topic_id': f'eq.{topic_id}'})
-            topic = topics[0] if topics else None
-            self._json_response(200, {"topic": topic, "definitions": defs, "questions": questions, "content": {}})
+    def do_POST(self):
+        path = self.path.replace('/api', '').split('?')[0]
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(content_length).decode('utf-8')) if content_length > 0 else {}
+        route, params = routes.match('POST', path)
+        self._static_response = False
+        if route is None:
+            self._json_response(200, {"success": True})
             return
-
-        # Teacher's Terminology endpoints
-        if path == '/teacher-definitions':
-            # Get all teacher definitions grouped by topic
+        route(self, body, **params)
+
+    # ============================================
+    # GET ENDPOINTS
+    # ============================================
+
+    @routes.get('/')
+    @routes.get('/health')
+    def get_health(self):
+        self._json_response(200, {"status": "healthy"})
+
+    @routes.get('/auth/me')
+    def get_auth_me(self):
+        user_id = self._get_user_id()
+        if user_id:
+            users = supabase_get('users', {'id': f'eq.{user_id}', 'select': 'id,username,display_name'})
+            if users:
+                self._json_response(200, users[0])
+                return
+        self._json_response(401, {"error": "Not authenticated"})
+
+    @routes.get('/topics', static=True)
+    def get_topics(self):
+        topics = supabase_get('topics', {'select': '*', 'order': 'theme_number,topic_number'})
+        themes = {}
+        for t in topics:
+            n = t['theme_number']
+            if n not in themes:
+                themes[n] = {"theme_number": n, "theme_name": t['theme_name'], "topics": []}
+            themes[n]['topics'].append({"id": t['id'], "topic_number": t['topic_number'],
+                "topic_name": t['topic_name'], "textbook_pages": t.get('textbook_pages')})
+        self._json_response(200, list(themes.values()))
+
+    @routes.get('/topics/{topic_id}')
+    def get_topic(self, topic_id):
+        results = supabase_get_many({
+            'topics': ('topics', {'id': f'eq.{topic_id}'}),
+            'definitions': ('definitions', {'topic_id': f'eq.{topic_id}'}),
+            'questions': ('questions', {'topic_id': f'eq.{topic_id}'}),
+        })
+        topics = results['topics']
+        topic = topics[0] if topics else None
+        self._json_response(200, {"topic": topic, "definitions": results['definitions'], "questions": results['questions'], "content": {}})
+
+    # Teacher's Terminology endpoints
+    @routes.get('/teacher-definitions', static=True)
+    def get_teacher_definitions(self):
+        # Get all teacher definitions grouped by topic
+        teacher_defs, headers = curriculum_rows('teacher_definitions')
+        if teacher_defs is None:
             teacher_defs = supabase_get('teacher_definitions', {'select': '*', 'order': 'topic_id,term'})
-            self._json_response(200, teacher_defs)
-            return
-
-        if path.startswith('/teacher-definitions/'):
-            topic_id = path.split('/')[-1]
-            teacher_defs = supabase_get('teacher_definitions', {'topic_id': f'eq.{topic_id}', 'order': 'term'})
-            self._json_response(200, teacher_defs)
-            return
-
-        if '/teacher-flashcards' in path:
-            topic_id = path.split('/')[2]
+        self._json_response(200, teacher_defs, headers)
+
+    @routes.get('/teacher-definitions/{topic_id}', static=True)
+    @routes.get('/topics/{topic_id}/teacher-flashcards', static=True)
+    @routes.get('/teacher-flashcards/{topic_id}', static=True)
+    def get_topic_teacher_definitions(self, topic_id):
+        teacher_defs, headers = curriculum_rows('teacher_definitions', topic_id)
+        if teacher_defs is None:
             teacher_defs = supabase_get('teacher_definitions', {'topic_id': f'eq.{topic_id}', 'order': 'term'})
-            self._json_response(200, teacher_defs)
-            return
+        self._json_response(200, teacher_defs, headers)
 
-        if '/flashcards' in path:
-            topic_id = path.split('/')[2]
+    @routes.get('/topics/{topic_id}/flashcards', static=True)
+    @routes.get('/flashcards/{topic_id}', static=True)
+    def get_flashcards(self, topic_id):
+        defs, headers = curriculum_rows('definitions', topic_id)
+        if defs is None:
             defs = supabase_get('definitions', {'topic_id': f'eq.{topic_id}'})
-            self._json_response(200, defs)
-            return
-
-        if '/quiz' in path:
-            topic_id = path.split('/')[2]
-            questions = supabase_get('questions', {'topic_id': f'eq.{topic_id}'})
-            self._json_response(200, questions)
-            return
-
-        if '/test-yourself' in path:
-            parts = path.split('/')
-            if len(parts) > 2:
-                # Path could be /api/test-yourself/{topic_number} or /api/topics/{id}/test-yourself
-                topic_identifier = parts[-2] if parts[-1] == 'test-yourself' else parts[-1]
-
-                # If it looks like a topic_number (e.g., '1.1'), look up the topic_id
+        self._json_response(200, defs, headers)
+
+    @routes.get('/topics/{topic_id}/quiz')
+    @routes.get('/quiz/{topic_id}')
+    def get_quiz(self, topic_id):
+        questions = supabase_get('questions', {'topic_id': f'eq.{topic_id}'})
+        self._json_response(200, questions)
+
+    @routes.get('/test-yourself', static=True)
+    @routes.get('/test-yourself/{topic_id}', static=True)
+    @routes.get('/topics/{topic_id}/test-yourself', static=True)
+    def get_test_yourself(self, topic_id=None):
+        if topic_id:
+            # Path could be /api/test-yourself/{topic_number} or /api/topics/{id}/test-yourself
+            topic_identifier = topic_id
+
+            snapshot = get_curriculum_snapshot()
+            if snapshot and snapshot.has('test_yourself') and snapshot.has('topics'):
+                # Compiled snapshot: topic number lookup and questions come from memory
                 if '.' in str(topic_identifier):
-                    topic_lookup = supabase_get('topics', {
-                        'topic_number': f'eq.{topic_identifier}',
-                        'select': 'id'
-                    })
-                    topic_id = topic_lookup[0]['id'] if topic_lookup else None
+                    topic_id = snapshot.topic_id_for(topic_identifier)
                 else:
                     topic_id = topic_identifier
+                questions = snapshot.rows('test_yourself', topic_id) if topic_id else []
+                formatted = [{"number": q["question_number"], "question": q["question"], "answer": q["answer"]} for q in questions]
+                self._json_response(200, formatted, {'X-Curriculum-Version': snapshot.version})
+                return
 
-                if topic_id:
-                    # Fetch from Supabase
-                    questions = supabase_get('test_yourself', {
-                        'topic_id': f'eq.{topic_id}',
-                        'select': '*',
-                        'order': 'question_number'
-                    })
-                    # Format response
-                    formatted = [{"number": q["question_number"], "question": q["question"], "answer": q["answer"]} for q in questions]
-                    self._json_response(200, formatted)
-                else:
-                    self._json_response(200, [])
+            # If it looks like a topic_number (e.g., '1.1'), look up the topic_id
+            if '.' in str(topic_identifier):
+                topic_lookup = supabase_get('topics', {
+                    'topic_number': f'eq.{topic_identifier}',
+                    'select': 'id'
+                })
+                topic_id = topic_lookup[0]['id'] if topic_lookup else None
             else:
-                # Return all topics
-                questions = supabase_get('test_yourself', {'select': '*', 'order': 'topic_id,question_number'})
-                self._json_response(200, questions)
-            return
-
-        if '/ai/settings' in path:
-            user_id = self._get_user_id()
-            # Use default user_id for demo/single-user mode (must match PUT handler)
-            if not user_id:
-                user_id = '00000000-0000-0000-0000-000000000001'
-            settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}', 'order': 'id.desc', 'limit': '1'})
-            if not settings:
-                # Fallback: get most recent ai_settings record (for legacy data)
-                settings = supabase_get('ai_settings', {'select': '*', 'order': 'id.desc', 'limit': '1'})
-            s = settings[0] if settings else {}
-
-            # Use static model lists (updated Jan 2026) - skip dynamic fetching for faster loading
-            models = {"claude": CLAUDE_MODELS, "gemini": GEMINI_MODELS, "openai": OPENAI_MODELS, "alicloud": ALICLOUD_MODELS}
-
-            # Mask API keys for response
-            for k in ['claude_api_key', 'gemini_api_key', 'openai_api_key', 'alicloud_api_key']:
-                if s.get(k):
-                    s[k] = '•' * 20 + s[k][-4:]
+                topic_id = topic_identifier
+
+            if topic_id:
+                # Fetch from Supabase
+                questions = supabase_get('test_yourself', {
+                    'topic_id': f'eq.{topic_id}',
+                    'select': '*',
+                    'order': 'question_number'
+                })
+                # Format response
+                formatted = [{"number": q["question_number"], "question": q["question"], "answer": q["answer"]} for q in questions]
+                self._json_response(200, formatted)
+            else:
+                self._json_response(200, [])
+        else:
+            # Return all topics
+            questions = supabase_get('test_yourself', {'select': '*', 'order': 'topic_id,question_number'})
+            self._json_response(200, questions)
 
-            self._json_response(200, {
-                "settings": s,
-                "models": models
-            })
+    @routes.get('/ai/settings')
+    def get_ai_settings(self):
+        user_id = self._get_user_id()
+        # Use default user_id for demo/single-user mode (must match PUT handler)
+        if not user_id:
+            user_id = '00000000-0000-0000-0000-000000000001'
+        settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}', 'order': 'id.desc', 'limit': '1'})
+        if not settings:
+            # Fallback: get most recent ai_settings record (for legacy data)
+            settings = supabase_get('ai_settings', {'select': '*', 'order': 'id.desc', 'limit': '1'})
+        s = settings[0] if settings else {}
+
+        # Use static model lists (updated Jan 2026) - skip dynamic fetching for faster loading
+        models = {"claude": CLAUDE_MODELS, "gemini": GEMINI_MODELS, "openai": OPENAI_MODELS, "alicloud": ALICLOUD_MODELS}
+
+        # Mask API keys for response
+        for k in ['claude_api_key', 'gemini_api_key', 'openai_api_key', 'alicloud_api_key']:
+            if s.get(k):
+                s[k] = '•' * 20 + s[k][-4:]
+
+        self._json_response(200, {
+            "settings": s,
+            "models": models
+        })
+
+    # Fetch models dynamically for a provider
+    @routes.get('/ai/models/{provider}')
+    def get_ai_models(self, provider):
+        user_id = self._get_user_id()
+
+        if not user_id:
+            self._json_response(200, {"models": [], "error": "Not logged in"})
             return
 
-        # Fetch models dynamically for a provider
-        if '/ai/models/' in path:
-            provider = path.split('/')[-1]
-            user_id = self._get_user_id()
-
-            if not user_id:
-                self._json_response(200, {"models": [], "error": "Not logged in"})
-                return
-
-            settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
-            if not settings:
-                self._json_response(200, {"models": [], "error": "No settings found"})
-                return
+        settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
+        if not settings:
+            self._json_response(200, {"models": [], "error": "No settings found"})
+            return
 
-            s = settings[0]
-            api_key = s.get(f'{provider}_api_key')
-
-            if not api_key:
-                # Return static models if no API key
-                if provider == 'claude':
-                    self._json_response(200, {"models": CLAUDE_MODELS})
-                elif provider == 'gemini':
-                    self._json_response(200, {"models": GEMINI_MODELS})
-                elif provider == 'openai':
-                    self._json_response(200, {"models": OPENAI_MODELS})
-                elif provider == 'alicloud':
-                    self._json_response(200, {"models": ALICLOUD_MODELS})
-                else:
-                    self._json_response(200, {"models": []})
-                return
+        s = settings[0]
+        api_key = s.get(f'{provider}_api_key')
 
-            # Fetch models dynamically
+        if not api_key:
+            # Return static models if no API key
             if provider == 'claude':
-                # Claude doesn't have a models API, return static list
                 self._json_response(200, {"models": CLAUDE_MODELS})
             elif provider == 'gemini':
-                result = validate_gemini_key_with_models(api_key)
-                self._json_response(200, {"models": result.get('models', GEMINI_MODELS)})
+                self._json_response(200, {"models": GEMINI_MODELS})
             elif provider == 'openai':
-                result = validate_openai_key(api_key)
-                self._json_response(200, {"models": result.get('models', OPENAI_MODELS)})
+                self._json_response(200, {"models": OPENAI_MODELS})
             elif provider == 'alicloud':
-                # AliCloud doesn't have a public models API, return static list
                 self._json_response(200, {"models": ALICLOUD_MODELS})
             else:
                 self._json_response(200, {"models": []})
             return
 
-        # TTS Voices endpoint
-        if '/tts/voices' in path:
-            # Parse query string for API key
-            query_string = self.path.split('?')[1] if '?' in self.path else ''
-            params = dict(p.split('=') for p in query_string.split('&') if '=' in p) if query_string else {}
-            alicloud_key = urllib.parse.unquote(params.get('api_key', ''))
+        # Fetch models dynamically
+        if provider == 'claude':
+            # Claude doesn't have a models API, return static list
+            self._json_response(200, {"models": CLAUDE_MODELS})
+        elif provider == 'gemini':
+            result = validate_gemini_key_with_models(api_key)
+            self._json_response(200, {"models": result.get('models', GEMINI_MODELS)})
+        elif provider == 'openai':
+            result = validate_openai_key(api_key)
+            self._json_response(200, {"models": result.get('models', OPENAI_MODELS)})
+        elif provider == 'alicloud':
+            # AliCloud doesn't have a public models API, return static list
+            self._json_response(200, {"models": ALICLOUD_MODELS})
+        else:
+            self._json_response(200, {"models": []})
+
+    # TTS Voices endpoint
+    @routes.get('/tts/voices')
+    def get_tts_voices(self):
+        # Parse query string for API key
+        query_string = self.path.split('?')[1] if '?' in self.path else ''
+        params = dict(p.split('=') for p in query_string.split('&') if '=' in p) if query_string else {}
+        alicloud_key = urllib.parse.unquote(params.get('api_key', ''))
+
+        from api.qwen_tts import get_voices, list_custom_voices, QWEN_PRESET_VOICES
+
+        # Start with preset voices
+        all_voices = [{"voice_id": v["voice_id"], "name": v["name"], "description": v.get("description", ""),
+                      "language": v.get("language", "en"), "is_preset": True, "voice_type": "preset"}
+                     for v in QWEN_PRESET_VOICES]
+
+        # Add custom voices if API key is provided
+        if alicloud_key:
+            custom_result = list_custom_voices(alicloud_key)
+            if not custom_result.get("error"):
+                all_voices.extend(custom_result.get("voices", []))
+
+        self._json_response(200, {"voices": all_voices})
+
+    @routes.get('/progress')
+    def get_progress(self):
+        self._json_response(200, {"by_topic": [], "overall": {"questions_attempted": 0, "questions_correct": 0, "accuracy": 0}, "weak_points_count": 0})
+
+    # ============================================
+    # NEW ENDPOINTS FOR UPGRADED FEATURES
+    # ============================================
+    # Exam Questions with Model Answers
+    @routes.get('/exam-questions', static=True)
+    def get_exam_questions(self):
+        questions = supabase_get('exam_questions', {'select': '*', 'order': 'topic_id'})
+        self._json_response(200, questions)
+
+    @routes.get('/exam-questions/{topic_id}', static=True)
+    def get_topic_exam_questions(self, topic_id):
+        questions = supabase_get('exam_questions', {
+            'topic_id': f'eq.{topic_id}',
+            'select': '*',
+            'order': 'marks'
+        })
+        self._json_response(200, questions)
+
+    # Case Studies
+    @routes.get('/case-studies', static=True)
+    def get_case_studies(self):
+        case_studies = supabase_get('case_studies', {'select': '*', 'order': 'topic_id'})
+        self._json_response(200, case_studies)
+
+    @routes.get('/case-studies/topic/{topic_id}', static=True)
+    def get_topic_case_studies(self, topic_id):
+        case_studies = supabase_get('case_studies', {
+            'topic_id': f'eq.{topic_id}',
+            'select': '*'
+        })
+        self._json_response(200, case_studies)
+
+    @routes.get('/case-studies/{case_id}', static=True)
+    def get_case_study(self, case_id):
+        case_studies = supabase_get('case_studies', {'id': f'eq.{case_id}'})
+        self._json_response(200, case_studies[0] if case_studies else {})
+
+    # Tips
+    @routes.get('/tips', static=True)
+    def get_tips(self):
+        tips, headers = curriculum_rows('tips')
+        if tips is None:
+            tips = supabase_get('tips', {'select': '*', 'order': 'topic_id'})
+        self._json_response(200, tips, headers)
 
-            from api.qwen_tts import get_voices, list_custom_voices, QWEN_PRESET_VOICES
+    @routes.get('/tips/{topic_id}', static=True)
+    def get_topic_tips(self, topic_id):
+        tips, headers = curriculum_rows('tips', topic_id)
+        if tips is None:
+            tips = supabase_get('tips', {
+                'topic_id': f'eq.{topic_id}',
+                'select': '*'
+            })
+        self._json_response(200, tips, headers)
+
+    # Common Errors
+    @routes.get('/common-errors', static=True)
+    def get_common_errors(self):
+        errors = supabase_get('common_errors', {'select': '*', 'order': 'topic_id'})
+        self._json_response(200, errors)
+
+    @routes.get('/common-errors/{topic_id}', static=True)
+    def get_topic_common_errors(self, topic_id):
+        errors = supabase_get('common_errors', {
+            'topic_id': f'eq.{topic_id}',
+            'select': '*'
+        })
+        self._json_response(200, errors)
+
+    # Learning Objectives
+    @routes.get('/learning-objectives', static=True)
+    def get_learning_objectives(self):
+        objectives, headers = curriculum_rows('learning_objectives')
+        if objectives is None:
+            objectives = supabase_get('learning_objectives', {'select': '*', 'order': 'topic_id,order_num'})
+        self._json_response(200, objectives, headers)
 
-            # Start with preset voices
-            all_voices = [{"voice_id": v["voice_id"], "name": v["name"], "description": v.get("description", ""),
-                          "language": v.get("language", "en"), "is_preset": True, "voice_type": "preset"}
-                         for v in QWEN_PRESET_VOICES]
-
-            # Add custom voices if API key is provided
-            if alicloud_key:
-                custom_result = list_custom_voices(alicloud_key)
-                if not custom_result.get("error"):
-                    all_voices.extend(custom_result.get("voices", []))
-
-            self._json_response(200, {"voices": all_voices})
-            return
-
-        if path == '/progress':
-            self._json_response(200, {"by_topic": [], "overall": {"questions_attempted": 0, "questions_correct": 0, "accuracy": 0}, "weak_points_count": 0})
-            return
-
-        # ============================================
-        # NEW ENDPOINTS FOR UPGRADED FEATURES
-        # ============================================
-
-        # Exam Questions with Model Answers
-        if path == '/exam-questions':
-            questions = supabase_get('exam_questions', {'select': '*', 'order': 'topic_id'})
-            self._json_response(200, questions)
-            return
-
-        if path.startswith('/exam-questions/'):
-            topic_id = path.split('/')[-1]
-            questions = supabase_get('exam_questions', {
+    @routes.get('/learning-objectives/{topic_id}', static=True)
+    def get_topic_learning_objectives(self, topic_id):
+        objectives, headers = curriculum_rows('learning_objectives', topic_id)
+        if objectives is None:
+            objectives = supabase_get('learning_objectives', {
                 'topic_id': f'eq.{topic_id}',
                 'select': '*',
-                'order': 'marks'
-            })
-            self._json_response(200, questions)
-            return
-
-        # Case Studies
-        if path == '/case-studies':
-            case_studies = supabase_get('case_studies', {'select': '*', 'order': 'topic_id'})
-            self._json_response(200, case_studies)
-            return
-
-        if path.startswith('/case-studies/topic/'):
-            topic_id = path.split('/')[-1]
-            case_studies = supabase_get('case_studies', {
-                'topic_id': f'eq.{topic_id}',
-                'select': '*'
+                'order': 'order_num'
             })
-            self._json_response(200, case_studies)
+        self._json_response(200, objectives, headers)
+
+    # Sample Answers with Teacher Comments
+    @routes.get('/sample-answers', static=True)
+    def get_sample_answers(self):
+        answers = supabase_get('sample_answers', {'select': '*', 'order': 'topic_id'})
+        self._json_response(200, answers)
+
+    @routes.get('/sample-answers/{topic_id}', static=True)
+    def get_topic_sample_answers(self, topic_id):
+        answers = supabase_get('sample_answers', {
+            'topic_id': f'eq.{topic_id}',
+            'select': '*'
+        })
+        self._json_response(200, answers)
+
+    # Combined topic content (all new features for a topic)
+    @routes.get('/topic-content/{topic_id}', static=True)
+    def get_topic_content(self, topic_id):
+        # Independent reads run in parallel, bounded by the slowest one
+        content = supabase_get_many({
+            'exam_questions': ('exam_questions', {'topic_id': f'eq.{topic_id}', 'select': '*'}),
+            'case_studies': ('case_studies', {'topic_id': f'eq.{topic_id}', 'select': '*'}),
+            'tips': ('tips', {'topic_id': f'eq.{topic_id}', 'select': '*'}),
+            'common_errors': ('common_errors', {'topic_id': f'eq.{topic_id}', 'select': '*'}),
+            'learning_objectives': ('learning_objectives', {'topic_id': f'eq.{topic_id}', 'select': '*', 'order': 'order_num'}),
+            'sample_answers': ('sample_answers', {'topic_id': f'eq.{topic_id}', 'select': '*'})
+        })
+        self._json_response(200, content)
+
+    # Stats endpoint for dashboard
+    @routes.get('/stats')
+    def get_stats(self):
+        self._json_response(200, get_table_stats())
+
+    # ============================================
+    # RAG ENDPOINTS
+    # ============================================
+    # Get user's PDF documents
+    @routes.get('/pdf/documents')
+    def get_pdf_documents(self):
+        docs = supabase_get('pdf_documents', {'select': '*', 'order': 'created_at.desc'})
+        # Add public URLs
+        for doc in docs:
+            doc['public_url'] = get_public_url('documents', doc.get('storage_path', ''))
+        self._json_response(200, docs)
+
+    # Get single PDF document
+    @routes.get('/pdf/documents/{doc_id}')
+    def get_pdf_document(self, doc_id):
+        docs = supabase_get('pdf_documents', {'id': f'eq.{doc_id}'})
+        if docs:
+            doc = docs[0]
+            doc['public_url'] = get_public_url('documents', doc.get('storage_path', ''))
+            self._json_response(200, doc)
+        else:
+            self._json_response(404, {"error": "Document not found"})
+
+    # Get chunks for a document
+    @routes.get('/pdf/documents/{doc_id}/chunks')
+    def get_pdf_chunks(self, doc_id):
+        chunks = supabase_get('pdf_chunks', {
+            'document_id': f'eq.{doc_id}',
+            'select': 'id,chunk_index,page_number,content',
+            'order': 'chunk_index'
+        })
+        self._json_response(200, chunks)
+
+    # Debug endpoint to count all chunks
+    @routes.get('/debug/count')
+    def get_debug_count(self):
+        # Exact count of all chunks from the Content-Range header - no filters, no 1000-row cap
+        total = supabase_count('pdf_chunks')
+        chunks = supabase_get('pdf_chunks', {'select': 'id', 'limit': '5'})
+        self._json_response(200, {
+            'total_chunks_in_db': total or 0,
+            'sample_ids': [c.get('id') for c in (chunks or [])[:5]]
+        })
+
+    # Debug endpoint for keep-alive pool hit/miss counters (handshake savings)
+    @routes.get('/debug/pool')
+    def get_debug_pool(self):
+        self._json_response(200, get_pool().get_stats())
+
+    # Debug endpoint for query embedding cache hit rates
+    @routes.get('/debug/cache')
+    def get_debug_cache(self):
+        snapshot = get_curriculum_snapshot()
+        self._json_response(200, {
+            'embeddings': get_embedding_cache().get_stats(),
+            'answers': get_answer_cache().get_stats(),
+            'tables': get_table_cache().get_stats(),
+            'compression': get_compression_cache().get_stats(),
+            'etags': get_etag_index().get_stats(),
+            'tts': get_tts_cache().get_stats(),
+            'edge_tts': get_edge_tts_engine().get_stats(),
+            'qwen_sessions': get_qwen_session_pool().get_stats(),
+            'curriculum_snapshot': snapshot.get_stats() if snapshot else None
+        })
+
+    # Debug endpoint to test brute-force similarity (bypasses ivfflat index)
+    @routes.get('/debug/brute')
+    def get_debug_brute(self):
+        query = self._get_query_param('q')
+        doc_id = self._get_query_param('document_id')
+        if not query:
+            self._json_response(400, {"error": "Missing query parameter 'q'"})
             return
 
-        if path.startswith('/case-studies/') and '/topic/' not in path:
-            case_id = path.split('/')[-1]
-            case_studies = supabase_get('case_studies', {'id': f'eq.{case_id}'})
-            self._json_response(200, case_studies[0] if case_studies else {})
+        # Get embedding for query
+        settings = supabase_get('ai_settings', {'select': 'openai_api_key', 'limit': '1'})
+        if not settings or not settings[0].get('openai_api_key'):
+            self._json_response(400, {"error": "No OpenAI API key configured"})
             return
 
-        # Tips
-        if path == '/tips':
-            tips = supabase_get('tips', {'select': '*', 'order': 'topic_id'})
-            self._json_response(200, tips)
+        api_key = settings[0]['openai_api_key']
+        emb_result = get_query_embedding(api_key, query)
+        if not emb_result.get('success'):
+            self._json_response(500, {"error": f"Embedding failed: {emb_result.get('error')}"})
             return
 
-        if path.startswith('/tips/'):
-            topic_id = path.split('/')[-1]
-            tips = supabase_get('tips', {
-                'topic_id': f'eq.{topic_id}',
-                'select': '*'
-            })
-            self._json_response(200, tips)
-            return
+        query_embedding = emb_result['embedding']
 
-        # Common Errors
-        if path == '/common-errors':
-            errors = supabase_get('common_errors', {'select': '*', 'order': 'topic_id'})
-            self._json_response(200, errors)
-            return
+        # Use Python fallback which does brute-force cosine similarity
+        chunks = search_chunks_fallback(query_embedding, 10, doc_id)
 
-        if path.startswith('/common-errors/'):
-            topic_id = path.split('/')[-1]
-            errors = supabase_get('common_errors', {
-                'topic_id': f'eq.{topic_id}',
-                'select': '*'
+        results = []
+        for i, chunk in enumerate(chunks or []):
+            results.append({
+                'rank': i + 1,
+                'page_number': chunk.get('page_number'),
+                'similarity': round(chunk.get('similarity', 0), 4),
+                'content_preview': chunk.get('content', '')[:300],
+                'chunk_index': chunk.get('chunk_index')
             })
-            self._json_response(200, errors)
-            return
 
-        # Learning Objectives
-        if path == '/learning-objectives':
-            objectives = supabase_get('learning_objectives', {'select': '*', 'order': 'topic_id,order_num'})
-            self._json_response(200, objectives)
+        self._json_response(200, {
+            'query': query,
+            'method': 'brute_force_python',
+            'total_results': len(results),
+            'results': results
+        })
+
+    # Debug endpoint to test hybrid search (semantic + keyword)
+    @routes.get('/debug/hybrid')
+    def get_debug_hybrid(self):
+        query = self._get_query_param('q')
+        doc_id = self._get_query_param('document_id')
+        if not query:
+            self._json_response(400, {"error": "Missing query parameter 'q'"})
             return
 
-        if path.startswith('/learning-objectives/'):
-            topic_id = path.split('/')[-1]
-            objectives = supabase_get('learning_objectives', {
-                'topic_id': f'eq.{topic_id}',
-                'select': '*',
-                'order': 'order_num'
-            })
-            self._json_response(200, objectives)
+        # Get embedding for query
+        settings = supabase_get('ai_settings', {'select': 'openai_api_key', 'limit': '1'})
+        if not settings or not settings[0].get('openai_api_key'):
+            self._json_response(400, {"error": "No OpenAI API key configured"})
             return
 
-        # Sample Answers with Teacher Comments
-        if path == '/sample-answers':
-            answers = supabase_get('sample_answers', {'select': '*', 'order': 'topic_id'})
-            self._json_response(200, answers)
+        api_key = settings[0]['openai_api_key']
+        emb_result = get_query_embedding(api_key, query)
+        if not emb_result.get('success'):
+            self._json_response(500, {"error": f"Embedding failed: {emb_result.get('error')}"})
             return
 
-        if path.startswith('/sample-answers/'):
-            topic_id = path.split('/')[-1]
-            answers = supabase_get('sample_answers', {
-                'topic_id': f'eq.{topic_id}',
-                'select': '*'
+        query_embedding = emb_result['embedding']
+
+        # Use hybrid search
+        key_terms = extract_key_terms(query)
+        chunks = hybrid_search_chunks(query, query_embedding, 15, doc_id)
+
+        results = []
+        for i, chunk in enumerate(chunks or []):
+            results.append({
+                'rank': i + 1,
+                'page_number': chunk.get('page_number'),
+                'hybrid_similarity': round(chunk.get('similarity', 0), 4),
+                'semantic_similarity': round(chunk.get('semantic_similarity', 0), 4),
+                'keyword_score': round(chunk.get('keyword_score', 0), 4),
+                'content_preview': chunk.get('content', '')[:300],
+                'chunk_index': chunk.get('chunk_index')
             })
-            self._json_response(200, answers)
-            return
-
-        # Combined topic content (all new features for a topic)
-        if path.startswith('/topic-content/'):
-            topic_id = path.split('/')[-1]
-            content = {
-                'exam_questions': supabase_get('exam_questions', {'topic_id': f'eq.{topic_id}', 'select': '*'}),
-                'case_studies': supabase_get('case_studies', {'topic_id': f'eq.{topic_id}', 'select': '*'}),
-                'tips': supabase_get('tips', {'topic_id': f'eq.{topic_id}', 'select': '*'}),
-                'common_errors': supabase_get('common_errors', {'topic_id': f'eq.{topic_id}', 'select': '*'}),
-                'learning_objectives': supabase_get('learning_objectives', {'topic_id': f'eq.{topic_id}', 'select': '*', 'order': 'order_num'}),
-                'sample_answers': supabase_get('sample_answers', {'topic_id': f'eq.{topic_id}', 'select': '*'})
-            }
-            self._json_response(200, content)
-            return
-
-        # Stats endpoint for dashboard
-        if path == '/stats':
-            topics_count = len(supabase_get('topics', {'select': 'id'}))
-            definitions_count = len(supabase_get('definitions', {'select': 'id'}))
-            test_yourself_count = len(supabase_get('test_yourself', {'select': 'id'}))
-            exam_questions_count = len(supabase_get('exam_questions', {'select': 'id'}))
-            case_studies_count = len(supabase_get('case_studies', {'select': 'id'}))
-            tips_count = len(supabase_get('tips', {'select': 'id'}))
-            common_errors_count = len(supabase_get('common_errors', {'select': 'id'}))
-            self._json_response(200, {
-                'topics': topics_count,
-                'definitions': definitions_count,
-                'test_yourself': test_yourself_count,
-                'exam_questions': exam_questions_count,
-                'case_studies': case_studies_count,
-                'tips': tips_count,
-                'common_errors': common_errors_count
-            })
-            return
-
-        # ============================================
-        # RAG ENDPOINTS
-        # ============================================
-
-        # Get user's PDF documents
-        if path == '/pdf/documents':
-            docs = supabase_get('pdf_documents', {'select': '*', 'order': 'created_at.desc'})
-            # Add public URLs
-            for doc in docs:
-                doc['public_url'] = get_public_url('documents', doc.get('storage_path', ''))
-            self._json_response(200, docs)
-            return
 
-        # Get single PDF document
-        if path.startswith('/pdf/documents/') and not path.endswith('/chunks'):
-            doc_id = path.split('/')[-1]
-            docs = supabase_get('pdf_documents', {'id': f'eq.{doc_id}'})
-            if docs:
-                doc = docs[0]
-                doc['public_url'] = get_public_url('documents', doc.get('storage_path', ''))
-                self._json_response(200, doc)
+        self._json_response(200, {
+            'query': query,
+            'method': 'hybrid_search',
+            'key_terms': key_terms,
+            'total_results': len(results),
+            'results': results
+        })
+
+    # Debug endpoint to check embeddings status
+    @routes.get('/debug/embeddings')
+    def get_debug_embeddings(self):
+        # Check a sample of chunks to see if they have embeddings
+        chunks = supabase_get('pdf_chunks', {
+            'select': 'id,chunk_index,page_number,embedding',
+            'limit': '50',
+            'order': 'chunk_index'
+        })
+        has_embedding = 0
+        no_embedding = 0
+        sample_with = []
+        sample_without = []
+        for c in (chunks or []):
+            emb = c.get('embedding')
+            if emb and len(str(emb)) > 10:  # Has non-empty embedding
+                has_embedding += 1
+                if len(sample_with) < 3:
+                    sample_with.append({'chunk': c.get('chunk_index'), 'page': c.get('page_number'), 'emb_len': len(str(emb))})
             else:
-                self._json_response(404, {"error": "Document not found"})
-            return
-
-        # Get chunks for a document
-        if path.endswith('/chunks'):
-            doc_id = path.split('/')[-2]
-            chunks = supabase_get('pdf_chunks', {
-                'document_id': f'eq.{doc_id}',
-                'select': 'id,chunk_index,page_number,content',
-                'order': 'chunk_index'
-            })
-            self._json_response(200, chunks)
-            return
-
-        # Debug endpoint to count all chunks
-        if path == '/debug/count':
-            # Simple count of all chunks - no filters
-            chunks = supabase_get('pdf_chunks', {'select': 'id', 'limit': '1000'})
-            self._json_response(200, {
-                'total_chunks_in_db': len(chunks) if chunks else 0,
-                'sample_ids': [c.get('id') for c in (chunks or [])[:5]]
+                no_embedding += 1
+                if len(sample_without) < 3:
+                    sample_without.append({'chunk': c.get('chunk_index'), 'page': c.get('page_number')})
+        self._json_response(200, {
+            'checked': len(chunks) if chunks else 0,
+            'has_embedding': has_embedding,
+            'no_embedding': no_embedding,
+            'sample_with_embedding': sample_with,
+            'sample_without_embedding': sample_without
+        })
+
+    # Debug endpoint to check embedding status
+    @routes.get('/debug/chunks')
+    def get_debug_chunks(self):
+        doc_id = self._get_query_param('document_id')
+        # Get chunks WITHOUT embedding (too large to return via API)
+        params = {'select': 'id,document_id,chunk_index,page_number,content'}
+        if doc_id:
+            params['document_id'] = f'eq.{doc_id}'
+        params['limit'] = '20'
+        params['order'] = 'chunk_index'
+
+        chunks = supabase_get('pdf_chunks', params)
+        debug_info = []
+        for c in (chunks or []):
+            debug_info.append({
+                'id': c.get('id'),
+                'document_id': c.get('document_id'),
+                'chunk_index': c.get('chunk_index'),
+                'page_number': c.get('page_number'),
+                'content_preview': c.get('content', '')[:150]
             })
-            return
-
-        # Debug endpoint to test brute-force similarity (bypasses ivfflat index)
-        if path == '/debug/brute':
-            query = self._get_query_param('q')
-            doc_id = self._get_query_param('document_id')
-            if not query:
-                self._json_response(400, {"error": "Missing query parameter 'q'"})
-                return
 
-            # Get embedding for query
-            settings = supabase_get('ai_settings', {'select': 'openai_api_key', 'limit': '1'})
-            if not settings or not settings[0].get('openai_api_key'):
-                self._json_response(400, {"error": "No OpenAI API key configured"})
-                return
+        self._json_response(200, {
+            'total_chunks': len(debug_info),
+            'chunks': debug_info
+        })
 
-            api_key = settings[0]['openai_api_key']
-            emb_result = get_openai_embedding(api_key, query)
-            if not emb_result.get('success'):
-                self._json_response(500, {"error": f"Embedding failed: {emb_result.get('error')}"})
-                return
+    # Debug endpoint to test vector search
+    @routes.get('/debug/search')
+    def get_debug_search(self):
+        query = self._get_query_param('q')
+        doc_id = self._get_query_param('document_id')
+        limit = int(self._get_query_param('limit') or '10')
 
-            query_embedding = emb_result['embedding']
-
-            # Use Python fallback which does brute-force cosine similarity
-            chunks = search_chunks_fallback(query_embedding, 10, doc_id)
-
-            results = []
-            for i, chunk in enumerate(chunks or []):
-                results.append({
-                    'rank': i + 1,
-                    'page_number': chunk.get('page_number'),
-                    'similarity': round(chunk.get('similarity', 0), 4),
-                    'content_preview': chunk.get('content', '')[:300],
-                    'chunk_index': chunk.get('chunk_index')
-                })
-
-            self._json_response(200, {
-                'query': query,
-                'method': 'brute_force_python',
-                'total_results': len(results),
-                'results': results
-            })
+        if not query:
+            self._json_response(400, {"error": "Missing query parameter 'q'"})
             return
 
-        # Debug endpoint to test hybrid search (semantic + keyword)
-        if path == '/debug/hybrid':
-            query = self._get_query_param('q')
-            doc_id = self._get_query_param('document_id')
-            if not query:
-                self._json_response(400, {"error": "Missing query parameter 'q'"})
-                return
-
-            # Get embedding for query
-            settings = supabase_get('ai_settings', {'select': 'openai_api_key', 'limit': '1'})
-            if not settings or not settings[0].get('openai_api_key'):
-                self._json_response(400, {"error": "No OpenAI API key configured"})
-                return
-
-            api_key = settings[0]['openai_api_key']
-            emb_result = get_openai_embedding(api_key, query)
-            if not emb_result.get('success'):
-                self._json_response(500, {"error": f"Embedding failed: {emb_result.get('error')}"})
-                return
-
-            query_embedding = emb_result['embedding']
-
-            # Use hybrid search
-            key_terms = extract_key_terms(query)
-            chunks = hybrid_search_chunks(query, query_embedding, 15, doc_id)
-
-            results = []
-            for i, chunk in enumerate(chunks or []):
-                results.append({
-                    'rank': i + 1,
-                    'page_number': chunk.get('page_number'),
-                    'hybrid_similarity': round(chunk.get('similarity', 0), 4),
-                    'semantic_similarity': round(chunk.get('semantic_similarity', 0), 4),
-                    'keyword_score': round(chunk.get('keyword_score', 0), 4),
-                    'content_preview': chunk.get('content', '')[:300],
-                    'chunk_index': chunk.get('chunk_index')
-                })
-
-            self._json_response(200, {
-                'query': query,
-                'method': 'hybrid_search',
-                'key_terms': key_terms,
-                'total_results': len(results),
-                'results': results
-            })
+        # Get embedding for query
+        settings = supabase_get('ai_settings', {'select': 'openai_api_key', 'limit': '1'})
+        if not settings or not settings[0].get('openai_api_key'):
+            self._json_response(400, {"error": "No OpenAI API key configured"})
             return
 
-        # Debug endpoint to check embeddings status
-        if path == '/debug/embeddings':
-            # Check a sample of chunks to see if they have embeddings
-            chunks = supabase_get('pdf_chunks', {
-                'select': 'id,chunk_index,page_number,embedding',
-                'limit': '50',
-                'order': 'chunk_index'
-            })
-            has_embedding = 0
-            no_embedding = 0
-            sample_with = []
-            sample_without = []
-            for c in (chunks or []):
-                emb = c.get('embedding')
-                if emb and len(str(emb)) > 10:  # Has non-empty embedding
-                    has_embedding += 1
-                    if len(sample_with) < 3:
-                        sample_with.append({'chunk': c.get('chunk_index'), 'page': c.get('page_number'), 'emb_len': len(str(emb))})
-                else:
-                    no_embedding += 1
-                    if len(sample_without) < 3:
-                        sample_without.append({'chunk': c.get('chunk_index'), 'page': c.get('page_number')})
-            self._json_response(200, {
-                'checked': len(chunks) if chunks else 0,
-                'has_embedding': has_embedding,
-                'no_embedding': no_embedding,
-                'sample_with_embedding': sample_with,
-                'sample_without_embedding': sample_without
-            })
+        api_key = settings[0]['openai_api_key']
+        emb_result = get_query_embedding(api_key, query)
+        if not emb_result.get('success'):
+            self._json_response(500, {"error": f"Embedding failed: {emb_result.get('error')}"})
             return
 
-        # Debug endpoint to check embedding status
-        if path == '/debug/chunks':
-            doc_id = self._get_query_param('document_id')
-            # Get chunks WITHOUT embedding (too large to return via API)
-            params = {'select': 'id,document_id,chunk_index,page_number,content'}
-            if doc_id:
-                params['document_id'] = f'eq.{doc_id}'
-            params['limit'] = '20'
-            params['order'] = 'chunk_index'
-
-            chunks = supabase_get('pdf_chunks', params)
-            debug_info = []
-            for c in (chunks or []):
-                debug_info.append({
-                    'id': c.get('id'),
-                    'document_id': c.get('document_id'),
-                    'chunk_index': c.get('chunk_index'),
-                    'page_number': c.get('page_number'),
-                    'content_preview': c.get('content', '')[:150]
-                })
-
-            self._json_response(200, {
-                'total_chunks': len(debug_info),
-                'chunks': debug_info
+        query_embedding = emb_result['embedding']
+
+        # Search chunks - try RPC first
+        search_params = {
+            'query_embedding': query_embedding,
+            'match_count': limit
+        }
+        if doc_id:
+            search_params['filter_document_id'] = doc_id
+
+        rpc_result = supabase_rpc('search_pdf_chunks', search_params)
+        used_rpc = True
+        rpc_error = None
+
+        # If RPC fails, use fallback
+        if not rpc_result or isinstance(rpc_result, dict):
+            used_rpc = False
+            rpc_error = str(rpc_result) if isinstance(rpc_result, dict) else 'empty response'
+            # Try fallback - but first check how many chunks we can fetch
+            all_chunks_raw = supabase_get('pdf_chunks', {'select': 'id,embedding', 'limit': '1000'})
+            chunks_with_emb = len([c for c in (all_chunks_raw or []) if c.get('embedding')])
+            chunks = search_chunks_fallback(query_embedding, limit, doc_id)
+        else:
+            chunks = rpc_result
+            chunks_with_emb = None
+
+        # Format results with full debug info
+        results = []
+        for i, chunk in enumerate(chunks or []):
+            results.append({
+                'rank': i + 1,
+                'page_number': chunk.get('page_number'),
+                'similarity': round(chunk.get('similarity', 0), 4),
+                'content_preview': chunk.get('content', '')[:300],
+                'chunk_index': chunk.get('chunk_index'),
+                'document_id': chunk.get('document_id')
             })
-            return
-
-        # Debug endpoint to test vector search
-        if path == '/debug/search':
-            query = self._get_query_param('q')
-            doc_id = self._get_query_param('document_id')
-            limit = int(self._get_query_param('limit') or '10')
 
-            if not query:
-                self._json_response(400, {"error": "Missing query parameter 'q'"})
-                return
-
-            # Get embedding for query
-            settings = supabase_get('ai_settings', {'select': 'openai_api_key', 'limit': '1'})
-            if not settings or not settings[0].get('openai_api_key'):
-                self._json_response(400, {"error": "No OpenAI API key configured"})
-                return
-
-            api_key = settings[0]['openai_api_key']
-            emb_result = get_openai_embedding(api_key, query)
-            if not emb_result.get('success'):
-                self._json_response(500, {"error": f"Embedding failed: {emb_result.get('error')}"})
-                return
-
-            query_embedding = emb_result['embedding']
+        debug_info = {
+            'used_rpc': used_rpc,
+            'rpc_error': rpc_error,
+            'fallback_chunks_with_embedding': chunks_with_emb,
+            'embedding_length': len(query_embedding) if query_embedding else 0
+        }
+
+        self._json_response(200, {
+            'query': query,
+            'document_id': doc_id,
+            'total_results': len(results),
+            'debug': debug_info,
+            'results': results
+        })
+
+    # Debug endpoint to text-search chunks (find if content exists)
+    @routes.get('/debug/grep')
+    def get_debug_grep(self):
+        keyword = self._get_query_param('q')
+        doc_id = self._get_query_param('document_id')
+
+        if not keyword:
+            self._json_response(400, {"error": "Missing query parameter 'q'"})
+            return
 
-            # Search chunks - try RPC first
-            search_params = {
-                'query_embedding': query_embedding,
-                'match_count': limit
-            }
-            if doc_id:
-                search_params['filter_document_id'] = doc_id
-
-            rpc_result = supabase_rpc('search_pdf_chunks', search_params)
-            used_rpc = True
-            rpc_error = None
-
-            # If RPC fails, use fallback
-            if not rpc_result or isinstance(rpc_result, dict):
-                used_rpc = False
-                rpc_error = str(rpc_result) if isinstance(rpc_result, dict) else 'empty response'
-                # Try fallback - but first check how many chunks we can fetch
-                all_chunks_raw = supabase_get('pdf_chunks', {'select': 'id,embedding', 'limit': '1000'})
-                chunks_with_emb = len([c for c in (all_chunks_raw or []) if c.get('embedding')])
-                chunks = search_chunks_fallback(query_embedding, limit, doc_id)
-            else:
-                chunks = rpc_result
-                chunks_with_emb = None
-
-            # Format results with full debug info
-            results = []
-            for i, chunk in enumerate(chunks or []):
-                results.append({
-                    'rank': i + 1,
+        # Get all chunks for this document
+        params = {'select': 'id,chunk_index,page_number,content'}
+        if doc_id:
+            params['document_id'] = f'eq.{doc_id}'
+
+        chunks = supabase_get('pdf_chunks', params)
+
+        # Text search (case-insensitive)
+        keyword_lower = keyword.lower()
+        matches = []
+        for chunk in (chunks or []):
+            content = chunk.get('content', '')
+            if keyword_lower in content.lower():
+                # Find position of match
+                pos = content.lower().find(keyword_lower)
+                # Get context around match (100 chars before/after)
+                start = max(0, pos - 100)
+                end = min(len(content), pos + len(keyword) + 100)
+                context = content[start:end]
+
+                matches.append({
                     'page_number': chunk.get('page_number'),
-                    'similarity': round(chunk.get('similarity', 0), 4),
-                    'content_preview': chunk.get('content', '')[:300],
                     'chunk_index': chunk.get('chunk_index'),
-                    'document_id': chunk.get('document_id')
+                    'match_context': f"...{context}..." if start > 0 else context
                 })
 
-            debug_info = {
-                'used_rpc': used_rpc,
-                'rpc_error': rpc_error,
-                'fallback_chunks_with_embedding': chunks_with_emb,
-                'embedding_length': len(query_embedding) if query_embedding else 0
-            }
-
-            self._json_response(200, {
-                'query': query,
-                'document_id': doc_id,
-                'total_results': len(results),
-                'debug': debug_info,
-                'results': results
-            })
-            return
-
-        # Debug endpoint to text-search chunks (find if content exists)
-        if path == '/debug/grep':
-            keyword = self._get_query_param('q')
-            doc_id = self._get_query_param('document_id')
-
-            if not keyword:
-                self._json_response(400, {"error": "Missing query parameter 'q'"})
+        self._json_response(200, {
+            'keyword': keyword,
+            'document_id': doc_id,
+            'total_matches': len(matches),
+            'matches': matches
+        })
+
+    # Get user settings (for API keys)
+    @routes.get('/user-settings')
+    def get_user_settings(self):
+        settings = supabase_get('user_settings', {'select': '*', 'limit': '1'})
+        if settings:
+            s = settings[0]
+            # Mask API keys
+            if s.get('openai_api_key'):
+                s['openai_api_key'] = '•' * 20 + s['openai_api_key'][-4:]
+            if s.get('anthropic_api_key'):
+                s['anthropic_api_key'] = '•' * 20 + s['anthropic_api_key'][-4:]
+        self._json_response(200, settings[0] if settings else {})
+
+    # Get chat history
+    @routes.get('/rag/chat/history/{doc_id}')
+    def get_chat_history(self, doc_id):
+        messages = supabase_get('chat_messages', {
+            'document_id': f'eq.{doc_id}',
+            'select': '*',
+            'order': 'created_at'
+        })
+        self._json_response(200, messages)
+
+    # ============================================
+    # POST ENDPOINTS
+    # ============================================
+
+    @routes.post('/auth/login')
+    def post_auth_login(self, body):
+        username = body.get('username', '')
+        password = body.get('password', '')
+        users = supabase_get('users', {'username': f'eq.{username}', 'select': '*'})
+        if users and len(users) > 0:
+            user = users[0]
+            if user.get('password') == password:
+                token = str(uuid.uuid4())
+                sessions[token] = user['id']
+                self._json_response(200, {
+                    "token": token,
+                    "user": {"id": user['id'], "username": user['username'], "display_name": user.get('display_name')}
+                })
                 return
+        self._json_response(401, {"error": "Invalid credentials"})
 
-            # Get all chunks for this document
-            params = {'select': 'id,chunk_index,page_number,content'}
-            if doc_id:
-                params['document_id'] = f'eq.{doc_id}'
+    @routes.post('/auth/logout')
+    def post_auth_logout(self, body):
+        self._json_response(200, {"success": True})
 
-            chunks = supabase_get('pdf_chunks', params)
+    # Validate API key
+    @routes.post('/ai/validate-key')
+    def post_validate_key(self, body):
+        provider = body.get('provider', '')
+        api_key = body.get('api_key', '')
 
-            # Text search (case-insensitive)
-            keyword_lower = keyword.lower()
-            matches = []
-            for chunk in (chunks or []):
-                content = chunk.get('content', '')
-                if keyword_lower in content.lower():
-                    # Find position of match
-                    pos = content.lower().find(keyword_lower)
-                    # Get context around match (100 chars before/after)
-                    start = max(0, pos - 100)
-                    end = min(len(content), pos + len(keyword) + 100)
-                    context = content[start:end]
-
-                    matches.append({
-                        'page_number': chunk.get('page_number'),
-                        'chunk_index': chunk.get('chunk_index'),
-                        'match_context': f"...{context}..." if start > 0 else context
-                    })
-
-            self._json_response(200, {
-                'keyword': keyword,
-                'document_id': doc_id,
-                'total_matches': len(matches),
-                'matches': matches
-            })
+        if not provider or not api_key:
+            self._json_response(400, {"valid": False, "error": "Missing provider or API key"})
             return
 
-        # Get user settings (for API keys)
-        if path == '/user-settings':
-            settings = supabase_get('user_settings', {'select': '*', 'limit': '1'})
-            if settings:
-                s = settings[0]
-                # Mask API keys
-                if s.get('openai_api_key'):
-                    s['openai_api_key'] = '•' * 20 + s['openai_api_key'][-4:]
-                if s.get('anthropic_api_key'):
-                    s['anthropic_api_key'] = '•' * 20 + s['anthropic_api_key'][-4:]
-            self._json_response(200, settings[0] if settings else {})
-            return
-
-        # Get chat history
-        if path.startswith('/rag/chat/history/'):
-            doc_id = path.split('/')[-1]
-            messages = supabase_get('chat_messages', {
-                'document_id': f'eq.{doc_id}',
-                'select': '*',
-                'order': 'created_at'
-            })
-            self._json_response(200, messages)
-            return
+        if provider == 'claude':
+            result = validate_claude_key(api_key)
+        elif provider == 'gemini':
+            result = validate_gemini_key(api_key)
+        elif provider == 'openai':
+            result = validate_openai_key(api_key)
+        elif provider == 'alicloud':
+            result = validate_alicloud_key(api_key)
+        else:
+            result = {"valid": False, "error": "Unknown provider"}
 
-        self._json_response(404, {"error": "Not found"})
+        # If valid, save to database
+        if result.get('valid'):
+            user_id = self._get_user_id()
+            # Use a default user_id for demo/single-user mode if no session
+            if not user_id:
+                user_id = '00000000-0000-0000-0000-000000000001'
 
-    def do_POST(self):
-        path = self.path.replace('/api', '').split('?')[0]
-        content_length = int(self.headers.get('Content-Length', 0))
-        body = json.loads(self.rfile.read(content_length).decode('utf-8')) if content_length > 0 else {}
+            # Check if settings already exist for this user
+            existing = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
+            data = {
+                'user_id': user_id,
+                f'{provider}_api_key': api_key,
+                f'{provider}_validated': True
+            }
+            if existing:
+                # Update existing record
+                supabase_patch('ai_settings', data, {'user_id': f'eq.{user_id}'})
+            else:
+                # Insert new record
+                supabase_post('ai_settings', data)
+
+        self._json_response(200, result)
+
+    # Update AI settings
+    @routes.post('/ai/settings')
+    def post_ai_settings(self, body):
+        user_id = self._get_user_id()
+        # Find existing settings record to update (order by id desc to get most recent)
+        settings = None
+        if user_id:
+            settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}', 'order': 'id.desc', 'limit': '1'})
+        if not settings:
+            # Fallback: get most recent record (for demo/single-user/legacy mode)
+            settings = supabase_get('ai_settings', {'select': '*', 'order': 'id.desc', 'limit': '1'})
+
+        data = {}
+        for key in ['default_provider', 'claude_model', 'gemini_model', 'openai_model', 'alicloud_model', 'tts_provider', 'tts_voice']:
+            if key in body:
+                data[key] = body[key]
+
+        if settings and settings[0].get('id'):
+            # Update existing record by ID
+            supabase_patch('ai_settings', data, {'id': f"eq.{settings[0]['id']}"})
+        else:
+            # No existing record, create new one
+            data['user_id'] = user_id or '00000000-0000-0000-0000-000000000001'
+            supabase_upsert('ai_settings', data)
+        self._json_response(200, {"success": True})
 
-        if '/auth/login' in path:
-            username = body.get('username', '')
-            password = body.get('password', '')
-            users = supabase_get('users', {'username': f'eq.{username}', 'select': '*'})
-            if users and len(users) > 0:
-                user = users[0]
-                if user.get('password') == password:
-                    token = str(uuid.uuid4())
-                    sessions[token] = user['id']
-                    self._json_response(200, {
-                        "token": token,
-                        "user": {"id": user['id'], "username": user['username'], "display_name": user.get('display_name')}
-                    })
-                    return
-            self._json_response(401, {"error": "Invalid credentials"})
+    # AI Generate Questions
+    @routes.post('/ai/generate-questions')
+    def post_generate_questions(self, body):
+        user_id = self._get_user_id()
+        if not user_id:
+            self._json_response(401, {"error": "Please log in to use AI features"})
             return
 
-        if '/auth/logout' in path:
-            self._json_response(200, {"success": True})
+        # Get user's AI settings
+        settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
+        if not settings:
+            self._json_response(400, {"error": "Please configure AI settings first"})
             return
 
-        # Validate API key
-        if '/ai/validate-key' in path:
-            provider = body.get('provider', '')
-            api_key = body.get('api_key', '')
-
-            if not provider or not api_key:
-                self._json_response(400, {"valid": False, "error": "Missing provider or API key"})
-                return
-
-            if provider == 'claude':
-                result = validate_claude_key(api_key)
-            elif provider == 'gemini':
-                result = validate_gemini_key(api_key)
-            elif provider == 'openai':
-                result = validate_openai_key(api_key)
-            elif provider == 'alicloud':
-                result = validate_alicloud_key(api_key)
-            else:
-                result = {"valid": False, "error": "Unknown provider"}
-
-            # If valid, save to database
-            if result.get('valid'):
-                user_id = self._get_user_id()
-                # Use a default user_id for demo/single-user mode if no session
-                if not user_id:
-                    user_id = '00000000-0000-0000-0000-000000000001'
-
-                # Check if settings already exist for this user
-                existing = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
-                data = {
-                    'user_id': user_id,
-                    f'{provider}_api_key': api_key,
-                    f'{provider}_validated': True
-                }
-                if existing:
-                    # Update existing record
-                    supabase_patch('ai_settings', data, {'user_id': f'eq.{user_id}'})
-                else:
-                    # Insert new record
-                    supabase_post('ai_settings', data)
+        s = settings[0]
+        provider = s.get('default_provider', 'claude')
+        api_key = s.get(f'{provider}_api_key')
+        model = s.get(f'{provider}_model')
 
-            self._json_response(200, result)
+        if not api_key:
+            self._json_response(400, {"error": f"Please add your {provider.title()} API key in Settings"})
             return
 
-        # Update AI settings
-        if '/ai/settings' in path:
-            user_id = self._get_user_id()
-            # Find existing settings record to update (order by id desc to get most recent)
-            settings = None
-            if user_id:
-                settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}', 'order': 'id.desc', 'limit': '1'})
-            if not settings:
-                # Fallback: get most recent record (for demo/single-user/legacy mode)
-                settings = supabase_get('ai_settings', {'select': '*', 'order': 'id.desc', 'limit': '1'})
+        # Get the source question
+        question_id = body.get('question_id')
+        num_questions = body.get('num_questions', 3)
 
-            data = {}
-            for key in ['default_provider', 'claude_model', 'gemini_model', 'openai_model', 'alicloud_model', 'tts_provider', 'tts_voice']:
-                if key in body:
-                    data[key] = body[key]
-
-            if settings and settings[0].get('id'):
-                # Update existing record by ID
-                supabase_patch('ai_settings', data, {'id': f"eq.{settings[0]['id']}"})
-            else:
-                # No existing record, create new one
-                data['user_id'] = user_id or '00000000-0000-0000-0000-000000000001'
-                supabase_upsert('ai_settings', data)
-            self._json_response(200, {"success": True})
+        if not question_id:
+            self._json_response(400, {"error": "Missing question_id"})
             return
 
-        # AI Generate Questions
-        if '/ai/generate-questions' in path:
-            user_id = self._get_user_id()
-            if not user_id:
-                self._json_response(401, {"error": "Please log in to use AI features"})
-                return
-
-            # Get user's AI settings
-            settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
-            if not settings:
-                self._json_response(400, {"error": "Please configure AI settings first"})
-                return
-
-            s = settings[0]
-            provider = s.get('default_provider', 'claude')
-            api_key = s.get(f'{provider}_api_key')
-            model = s.get(f'{provider}_model')
-
-            if not api_key:
-                self._json_response(400, {"error": f"Please add your {provider.title()} API key in Settings"})
-                return
-
-            # Get the source question
-            question_id = body.get('question_id')
-            num_questions = body.get('num_questions', 3)
-
-            if not question_id:
-                self._json_response(400, {"error": "Missing question_id"})
-                return
-
-            # Fetch the original question
-            questions = supabase_get('questions', {'id': f'eq.{question_id}'})
-            if not questions:
-                self._json_response(404, {"error": "Question not found"})
-                return
+        # Fetch the original question
+        questions = supabase_get('questions', {'id': f'eq.{question_id}'})
+        if not questions:
+            self._json_response(404, {"error": "Question not found"})
+            return
 
-            original = questions[0]
+        original = questions[0]
 
-            # Build the prompt
-            prompt = f"""Generate {num_questions} similar IGCSE Geography exam questions based on this question:
+        # Build the prompt
+        prompt = f"""Generate {num_questions} similar IGCSE Geography exam questions based on this question:
 
 Original Question: {original.get('question_text', '')}
 Command Word: {original.get('command_word', '')}
@@ -1615,634 +2469,723 @@ Return ONLY a JSON array with this format:
   {{"question_text": "...", "command_word": "{original.get('command_word', 'describe')}", "marks": {original.get('marks', 2)}, "mark_scheme": "..."}}
 ]"""
 
-            # Call the appropriate AI provider
-            if provider == 'claude':
-                result = call_claude(api_key, model or 'claude-haiku-4-5-20251001', prompt)
-            elif provider == 'openai':
-                result = call_openai(api_key, model or 'gpt-4o-mini', prompt)
-            elif provider == 'gemini':
-                result = call_gemini(api_key, model or 'gemini-2.5-flash', prompt)
-            elif provider == 'alicloud':
-                result = call_alicloud(api_key, model or 'qwen-flash', prompt)
-            else:
-                self._json_response(400, {"error": f"Unknown provider: {provider}"})
-                return
-
-            if not result.get('success'):
-                self._json_response(500, {"error": result.get('error', 'AI generation failed')})
-                return
+        # Call the appropriate AI provider
+        if provider == 'claude':
+            result = call_claude(api_key, model or 'claude-haiku-4-5-20251001', prompt)
+        elif provider == 'openai':
+            result = call_openai(api_key, model or 'gpt-4o-mini', prompt)
+        elif provider == 'gemini':
+            result = call_gemini(api_key, model or 'gemini-2.5-flash', prompt)
+        elif provider == 'alicloud':
+            result = call_alicloud(api_key, model or 'qwen-flash', prompt)
+        else:
+            self._json_response(400, {"error": f"Unknown provider: {provider}"})
+            return
 
-            # Parse the AI response
-            content = result.get('content', '')
-            try:
-                # Extract JSON from response
-                json_match = re.search(r'\[[\s\S]*\]', content)
-                if json_match:
-                    generated = json.loads(json_match.group())
-                    # Add topic_id and save to database
-                    saved_questions = []
-                    for q in generated:
-                        q['topic_id'] = original.get('topic_id')
-                        q['ai_generated'] = True
-                        saved = supabase_upsert('questions', q)
-                        if saved and not saved.get('error'):
-                            saved_questions.append(saved[0] if isinstance(saved, list) else saved)
-
-                    self._json_response(200, {"questions": saved_questions, "generated": len(saved_questions)})
-                    return
-                else:
-                    self._json_response(500, {"error": "Could not parse AI response"})
-                    return
-            except json.JSONDecodeError as e:
-                self._json_response(500, {"error": f"Invalid JSON from AI: {str(e)}"})
-                return
+        if not result.get('success'):
+            self._json_response(500, {"error": result.get('error', 'AI generation failed')})
+            return
 
-        # AI Chat (general)
-        if '/ai/chat' in path:
-            user_id = self._get_user_id()
-            if not user_id:
-                self._json_response(401, {"error": "Please log in to use AI features"})
+        # Parse the AI response
+        content = result.get('content', '')
+        try:
+            # Extract JSON from response
+            json_match = re.search(r'\[[\s\S]*\]', content)
+            if json_match:
+                generated = json.loads(json_match.group())
+                # Add topic_id and save to database
+                saved_questions = []
+                for q in generated:
+                    q['topic_id'] = original.get('topic_id')
+                    q['ai_generated'] = True
+                    saved = supabase_upsert('questions', q)
+                    if saved and not saved.get('error'):
+                        saved_questions.append(saved[0] if isinstance(saved, list) else saved)
+
+                self._json_response(200, {"questions": saved_questions, "generated": len(saved_questions)})
                 return
-
-            settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
-            if not settings:
-                self._json_response(400, {"error": "Please configure AI settings first"})
+            else:
+                self._json_response(500, {"error": "Could not parse AI response"})
                 return
+        except json.JSONDecodeError as e:
+            self._json_response(500, {"error": f"Invalid JSON from AI: {str(e)}"})
+            return
 
-            s = settings[0]
-            provider = s.get('default_provider', 'claude')
-            api_key = s.get(f'{provider}_api_key')
-            model = s.get(f'{provider}_model')
+    # AI Chat (general)
+    @routes.post('/ai/chat')
+    def post_ai_chat(self, body):
+        user_id = self._get_user_id()
+        if not user_id:
+            self._json_response(401, {"error": "Please log in to use AI features"})
+            return
 
-            if not api_key:
-                self._json_response(400, {"error": f"Please add your {provider.title()} API key in Settings"})
-                return
+        settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
+        if not settings:
+            self._json_response(400, {"error": "Please configure AI settings first"})
+            return
 
-            prompt = body.get('message', '')
-            if not prompt:
-                self._json_response(400, {"error": "Missing message"})
-                return
+        s = settings[0]
+        provider = s.get('default_provider', 'claude')
+        api_key = s.get(f'{provider}_api_key')
+        model = s.get(f'{provider}_model')
 
-            if provider == 'claude':
-                result = call_claude(api_key, model or 'claude-haiku-4-5-20251001', prompt)
-            elif provider == 'openai':
-                result = call_openai(api_key, model or 'gpt-4o-mini', prompt)
-            elif provider == 'gemini':
-                result = call_gemini(api_key, model or 'gemini-2.5-flash', prompt)
-            elif provider == 'alicloud':
-                result = call_alicloud(api_key, model or 'qwen-flash', prompt)
-            else:
-                self._json_response(400, {"error": f"Unknown provider: {provider}"})
-                return
+        if not api_key:
+            self._json_response(400, {"error": f"Please add your {provider.title()} API key in Settings"})
+            return
 
-            if result.get('success'):
-                self._json_response(200, {"response": result.get('content', '')})
-            else:
-                self._json_response(500, {"error": result.get('error', 'AI request failed')})
+        prompt = body.get('message', '')
+        if not prompt:
+            self._json_response(400, {"error": "Missing message"})
             return
 
-        # ============================================
-        # TTS ENDPOINT (Edge-TTS or Qwen-TTS)
-        # ============================================
-        if '/tts/speak' in path:
-            text = body.get('text', '')
-            if not text:
-                self._json_response(400, {"error": "Missing text"})
+        # Streaming mode: relay provider token deltas as Server-Sent Events
+        if body.get('stream'):
+            stream_fn = STREAM_PROVIDERS.get(provider)
+            if not stream_fn:
+                self._json_response(400, {"error": f"Unknown provider: {provider}"})
                 return
+            self._sse_start()
+            text, error = self._sse_relay(stream_fn(api_key, model or DEFAULT_CHAT_MODELS[provider], prompt))
+            if not error:
+                self._sse_event({"response": text}, event='done')
+            return
 
-            # Get TTS provider from request or user settings
-            tts_provider = body.get('provider', 'edge')
-            tts_voice = body.get('voice', '')
+        if provider == 'claude':
+            result = call_claude(api_key, model or 'claude-haiku-4-5-20251001', prompt)
+        elif provider == 'openai':
+            result = call_openai(api_key, model or 'gpt-4o-mini', prompt)
+        elif provider == 'gemini':
+            result = call_gemini(api_key, model or 'gemini-2.5-flash', prompt)
+        elif provider == 'alicloud':
+            result = call_alicloud(api_key, model or 'qwen-flash', prompt)
+        else:
+            self._json_response(400, {"error": f"Unknown provider: {provider}"})
+            return
 
-            # If not specified in request, check user settings
-            if tts_provider == 'edge' and not tts_voice:
-                user_id = self._get_user_id()
-                if not user_id:
-                    user_id = '00000000-0000-0000-0000-000000000001'
-                settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
-                if settings:
-                    s = settings[0]
-                    tts_provider = s.get('tts_provider', 'edge')
-                    tts_voice = s.get('tts_voice', '')
+        if result.get('success'):
+            self._json_response(200, {"response": result.get('content', '')})
+        else:
+            self._json_response(500, {"error": result.get('error', 'AI request failed')})
+
+    # ============================================
+    # TTS ENDPOINT (Edge-TTS or Qwen-TTS)
+    # ============================================
+    @routes.post('/tts/speak')
+    def post_tts_speak(self, body):
+        text = body.get('text', '')
+        if not text:
+            self._json_response(400, {"error": "Missing text"})
+            return
 
-            # Limit text length to prevent Vercel timeout (max ~500 chars for safe execution)
-            MAX_TTS_LENGTH = 500
-            if len(text) > MAX_TTS_LENGTH:
-                text = text[:MAX_TTS_LENGTH]
+        # Get TTS provider from request or user settings
+        tts_provider = body.get('provider', 'edge')
+        tts_voice = body.get('voice', '')
 
-            try:
-                if tts_provider == 'qwen':
-                    # Use Qwen3-TTS via AliCloud DashScope (using qwen_tts module)
-                    from api.qwen_tts import generate_tts as qwen_generate_tts, generate_tts_custom_voice, QWEN_PRESET_VOICES
+        # If not specified in request, check user settings
+        if tts_provider == 'edge' and not tts_voice:
+            user_id = self._get_user_id()
+            if not user_id:
+                user_id = '00000000-0000-0000-0000-000000000001'
+            settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
+            if settings:
+                s = settings[0]
+                tts_provider = s.get('tts_provider', 'edge')
+                tts_voice = s.get('tts_voice', '')
+
+        # Long text is synthesized as parallel sentence segments (see api/tts_segments.py)
+        if len(text) > TTS_MAX_CHARS:
+            text = text[:TTS_MAX_CHARS]
+        segments = split_segments(text)
+        if not segments:
+            self._json_response(400, {"error": "Missing text"})
+            return
+        # Streaming mode relays audio as it is synthesized, one segment after another
+        stream = bool(body.get('stream')) or self._get_query_param('stream') == '1'
 
-                    # Get AliCloud API key from request body (localStorage) or Supabase settings
-                    alicloud_key = body.get('alicloud_api_key')
+        try:
+            if tts_provider == 'qwen':
+                # Use Qwen3-TTS via AliCloud DashScope (using qwen_tts module)
+                from api.qwen_tts import (generate_tts_audio, generate_tts_custom_voice_audio, QWEN_PRESET_VOICES,
+                                          stream_tts, stream_tts_custom_voice, TTSError)
+
+                voice = tts_voice or 'Cherry'
+
+                # Check if this is a preset voice or custom voice
+                preset_voice_ids = [v['voice_id'] for v in QWEN_PRESET_VOICES]
+                is_preset = voice in preset_voice_ids
+                voice_type = 'preset' if is_preset else body.get('voice_type', 'designed')
+
+                # Replayed text costs one cache lookup instead of a synthesis
+                cache_key = tts_cache_key('qwen', voice, voice_type, text)
+                cached = get_tts_cache().get(cache_key, 'wav')
+                if cached is not None:
+                    self._audio_response(cached, 'wav', binary=stream or None)
+                    return
 
-                    if not alicloud_key:
-                        # Try to get from Supabase settings as fallback
-                        user_id = self._get_user_id()
-                        if not user_id:
-                            user_id = '00000000-0000-0000-0000-000000000001'
-                        settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
-                        if settings:
-                            alicloud_key = settings[0].get('alicloud_api_key')
+                # Get AliCloud API key from request body (localStorage) or Supabase settings
+                alicloud_key = body.get('alicloud_api_key')
 
-                    if not alicloud_key:
-                        self._json_response(400, {"error": "Please add your AliCloud API key in Settings to use Qwen TTS"})
-                        return
+                if not alicloud_key:
+                    # Try to get from Supabase settings as fallback
+                    user_id = self._get_user_id()
+                    if not user_id:
+                        user_id = '00000000-0000-0000-0000-000000000001'
+                    settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
+                    if settings:
+                        alicloud_key = settings[0].get('alicloud_api_key')
 
-                    voice = tts_voice or 'Cherry'
+                if not alicloud_key:
+                    self._json_response(400, {"error": "Please add your AliCloud API key in Settings to use Qwen TTS"})
+                    return
 
-                    # Check if this is a preset voice or custom voice
-                    preset_voice_ids = [v['voice_id'] for v in QWEN_PRESET_VOICES]
-                    is_preset = voice in preset_voice_ids
+                if not is_preset:
+                    # Custom voice - voice_type comes from the request body
+                    print(f"[TTS Debug] Custom voice TTS: voice={voice}, voice_type={voice_type}, segments={len(segments)}")
+
+                if stream:
+                    def pcm_chunks():
+                        for segment in segments:
+                            if is_preset:
+                                yield from stream_tts(segment, voice, alicloud_key)
+                            else:
+                                yield from stream_tts_custom_voice(segment, voice, voice_type, alicloud_key)
+                    try:
+                        self._tts_stream(cache_key, 'wav', pcm_chunks())
+                    except TTSError as e:
+                        self._json_response(500, {"error": str(e)})
+                    return
 
+                def synthesize(segment):
                     if is_preset:
-                        # Generate TTS using preset voice
-                        result = qwen_generate_tts(text, voice, alicloud_key)
+                        result = generate_tts_audio(segment, voice, alicloud_key)
                     else:
-                        # Custom voice - get voice_type from request body
-                        voice_type = body.get('voice_type', 'designed')
-                        print(f"[TTS Debug] Custom voice TTS: voice={voice}, voice_type={voice_type}")
-                        result = generate_tts_custom_voice(text, voice, voice_type, alicloud_key)
-                        print(f"[TTS Debug] Custom voice result: {'audio' in result and 'has audio' or result.get('error', 'unknown')}")
-
+                        result = generate_tts_custom_voice_audio(segment, voice, voice_type, alicloud_key)
                     if "error" in result:
-                        self._json_response(500, {"error": result["error"]})
-                        return
+                        raise SegmentError(result["error"])
+                    return result["audio"]
 
-                    self._json_response(200, {"audio": result["audio_base64"], "format": result["format"]})
+                try:
+                    audio_bytes = stitch_wav(synthesize_segments(segments, synthesize))
+                except SegmentError as e:
+                    self._json_response(500, {"error": str(e)})
                     return
 
-                else:
-                    # Default: Use Edge-TTS
-                    import asyncio
-                    import edge_tts
-
-                    async def generate_audio():
-                        voice = "en-US-EmmaMultilingualNeural"
-                        communicate = edge_tts.Communicate(text, voice)
-                        audio_data = b""
-                        async for chunk in communicate.stream():
-                            if chunk["type"] == "audio":
-                                audio_data += chunk["data"]
-                        return audio_data
-
-                    # Run async function
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    try:
-                        audio_bytes = loop.run_until_complete(generate_audio())
-                    finally:
-                        loop.close()
+                self._audio_response(audio_bytes, "wav")
+                get_tts_cache().put(cache_key, "wav", audio_bytes, AUDIO_MIME_TYPES["wav"])
+                return
+
+            else:
+                # Default: Use Edge-TTS
+                cache_key = tts_cache_key('edge', EDGE_TTS_VOICE, 'preset', text)
+                cached = get_tts_cache().get(cache_key, 'mp3')
+                if cached is not None:
+                    self._audio_response(cached, 'mp3', binary=stream or None)
+                    return
 
-                    # Return audio as base64
-                    audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
-                    self._json_response(200, {"audio": audio_base64, "format": "mp3"})
+                if stream:
+                    self._tts_stream(cache_key, 'mp3', (chunk for segment in segments for chunk in edge_tts_stream(segment)))
                     return
 
-            except Exception as e:
-                import traceback
-                print(f"TTS Error: {traceback.format_exc()}")
-                self._json_response(500, {"error": f"TTS generation failed: {str(e)}"})
+                audio_bytes = stitch_mp3(synthesize_segments(segments, edge_tts_synthesize))
+                self._audio_response(audio_bytes, "mp3")
+                get_tts_cache().put(cache_key, "mp3", audio_bytes, AUDIO_MIME_TYPES["mp3"])
                 return
 
-        # ============================================
-        # VOICE CUSTOMIZATION ENDPOINTS (Qwen TTS)
-        # ============================================
+        except Exception as e:
+            import traceback
+            print(f"TTS Error: {traceback.format_exc()}")
+            self._json_response(500, {"error": f"TTS generation failed: {str(e)}"})
+            return
 
-        # Design a custom voice from text description
-        if '/tts/design-voice' in path:
-            from api.qwen_tts import design_voice
+    # ============================================
+    # VOICE CUSTOMIZATION ENDPOINTS (Qwen TTS)
+    # ============================================
+    # Design a custom voice from text description
+    @routes.post('/tts/design-voice')
+    def post_design_voice(self, body):
+        from api.qwen_tts import design_voice
+
+        voice_prompt = body.get('voice_prompt', '')
+        preferred_name = body.get('preferred_name', 'custom_voice')
+        language = body.get('language', 'en')
+        preview_text = body.get('preview_text', 'Hello, this is a preview of my new custom voice.')
+        api_key = body.get('api_key', '')
+
+        if not api_key:
+            self._json_response(400, {"error": "API key is required"})
+            return
 
-            voice_prompt = body.get('voice_prompt', '')
-            preferred_name = body.get('preferred_name', 'custom_voice')
-            language = body.get('language', 'en')
-            preview_text = body.get('preview_text', 'Hello, this is a preview of my new custom voice.')
-            api_key = body.get('api_key', '')
+        if not voice_prompt:
+            self._json_response(400, {"error": "Voice description is required"})
+            return
 
-            if not api_key:
-                self._json_response(400, {"error": "API key is required"})
-                return
+        result = design_voice(voice_prompt, preferred_name, language, preview_text, api_key)
 
-            if not voice_prompt:
-                self._json_response(400, {"error": "Voice description is required"})
-                return
+        if result.get("error"):
+            self._json_response(500, {"error": result["error"]})
+            return
 
-            result = design_voice(voice_prompt, preferred_name, language, preview_text, api_key)
+        self._json_response(200, result)
 
-            if result.get("error"):
-                self._json_response(500, {"error": result["error"]})
-                return
+    # Clone a voice from audio sample
+    @routes.post('/tts/clone-voice')
+    def post_clone_voice(self, body):
+        from api.qwen_tts import clone_voice
 
-            self._json_response(200, result)
+        audio_base64 = body.get('audio_base64', '')
+        audio_format = body.get('audio_format', 'wav')
+        preferred_name = body.get('preferred_name', 'cloned_voice')
+        language = body.get('language', 'en')
+        api_key = body.get('api_key', '')
+
+        if not api_key:
+            self._json_response(400, {"error": "API key is required"})
             return
 
-        # Clone a voice from audio sample
-        if '/tts/clone-voice' in path:
-            from api.qwen_tts import clone_voice
+        if not audio_base64:
+            self._json_response(400, {"error": "Audio data is required"})
+            return
 
-            audio_base64 = body.get('audio_base64', '')
-            audio_format = body.get('audio_format', 'wav')
-            preferred_name = body.get('preferred_name', 'cloned_voice')
-            language = body.get('language', 'en')
-            api_key = body.get('api_key', '')
+        result = clone_voice(audio_base64, audio_format, preferred_name, language, api_key)
 
-            if not api_key:
-                self._json_response(400, {"error": "API key is required"})
-                return
+        if result.get("error"):
+            self._json_response(500, {"error": result["error"]})
+            return
 
-            if not audio_base64:
-                self._json_response(400, {"error": "Audio data is required"})
-                return
+        self._json_response(200, result)
 
-            result = clone_voice(audio_base64, audio_format, preferred_name, language, api_key)
+    # Delete a custom voice
+    @routes.post('/tts/delete-voice')
+    def post_delete_voice(self, body):
+        from api.qwen_tts import delete_voice
 
-            if result.get("error"):
-                self._json_response(500, {"error": result["error"]})
-                return
+        voice_id = body.get('voice_id', '')
+        voice_type = body.get('voice_type', 'designed')
+        api_key = body.get('api_key', '')
 
-            self._json_response(200, result)
+        if not api_key:
+            self._json_response(400, {"error": "API key is required"})
             return
 
-        # Delete a custom voice
-        if '/tts/delete-voice' in path:
-            from api.qwen_tts import delete_voice
+        if not voice_id:
+            self._json_response(400, {"error": "Voice ID is required"})
+            return
 
-            voice_id = body.get('voice_id', '')
-            voice_type = body.get('voice_type', 'designed')
-            api_key = body.get('api_key', '')
+        result = delete_voice(voice_id, voice_type, api_key)
 
-            if not api_key:
-                self._json_response(400, {"error": "API key is required"})
-                return
+        if result.get("error"):
+            self._json_response(500, {"error": result["error"]})
+            return
 
-            if not voice_id:
-                self._json_response(400, {"error": "Voice ID is required"})
-                return
+        self._json_response(200, {"success": True})
 
-            result = delete_voice(voice_id, voice_type, api_key)
+    # Drop cached curriculum tables (call after running a migrate_*.sql script)
+    @routes.post('/cache/invalidate')
+    def post_cache_invalidate(self, body):
+        # Disabled unless CACHE_ADMIN_TOKEN is configured
+        admin_token = os.environ.get('CACHE_ADMIN_TOKEN', '')
+        if not admin_token:
+            self._json_response(403, {"error": "Cache invalidation is disabled (CACHE_ADMIN_TOKEN not set)"})
+            return
+        if not hmac.compare_digest(self.headers.get('X-Admin-Token', ''), admin_token):
+            self._json_response(403, {"error": "Invalid admin token"})
+            return
+        tables = body.get('tables') or None
+        dropped = get_table_cache().invalidate(tables)
+        # Also pick up a rebuilt curriculum snapshot
+        snapshot = reload_curriculum_snapshot()
+        self._json_response(200, {"success": True, "entries_dropped": dropped, "tables": tables or 'all',
+                                  "curriculum_version": snapshot.version if snapshot else None})
+
+    # ============================================
+    # RAG POST ENDPOINTS
+    # ============================================
+    # Save user settings (API keys)
+    @routes.post('/user-settings')
+    def post_user_settings(self, body):
+        data = {
+            'id': body.get('id') or str(uuid.uuid4()),
+        }
+        if 'openai_api_key' in body:
+            data['openai_api_key'] = body['openai_api_key']
+        if 'anthropic_api_key' in body:
+            data['anthropic_api_key'] = body['anthropic_api_key']
+        if 'default_llm' in body:
+            data['default_llm'] = body['default_llm']
+
+        # Check if settings exist
+        existing = supabase_get('user_settings', {'select': 'id', 'limit': '1'})
+        if existing:
+            result = supabase_patch('user_settings', data, {'id': f'eq.{existing[0]["id"]}'})
+        else:
+            result = supabase_post('user_settings', data)
 
-            if result.get("error"):
-                self._json_response(500, {"error": result["error"]})
-                return
+        self._json_response(200, {"success": True, "data": result})
 
-            self._json_response(200, {"success": True})
-            return
+    # Create document record only (file uploaded directly to Supabase from browser)
+    @routes.post('/pdf/create-record')
+    def post_pdf_create_record(self, body):
+        doc_id = body.get('id')
+        filename = body.get('filename', 'document.pdf')
+        original_filename = body.get('original_filename', filename)
+        storage_path = body.get('storage_path', '')
+        file_size = body.get('file_size', 0)
 
-        # ============================================
-        # RAG POST ENDPOINTS
-        # ============================================
+        if not doc_id:
+            self._json_response(400, {"error": "Missing document id"})
+            return
 
-        # Save user settings (API keys)
-        if '/user-settings' in path:
-            data = {
-                'id': body.get('id') or str(uuid.uuid4()),
+        try:
+            doc_data = {
+                'id': doc_id,
+                'filename': filename,
+                'original_filename': original_filename,
+                'storage_path': storage_path,
+                'file_size': file_size,
+                'status': 'pending'
             }
-            if 'openai_api_key' in body:
-                data['openai_api_key'] = body['openai_api_key']
-            if 'anthropic_api_key' in body:
-                data['anthropic_api_key'] = body['anthropic_api_key']
-            if 'default_llm' in body:
-                data['default_llm'] = body['default_llm']
-
-            # Check if settings exist
-            existing = supabase_get('user_settings', {'select': 'id', 'limit': '1'})
-            if existing:
-                result = supabase_patch('user_settings', data, {'id': f'eq.{existing[0]["id"]}'})
-            else:
-                result = supabase_post('user_settings', data)
+            doc_result = supabase_post('pdf_documents', doc_data)
 
-            self._json_response(200, {"success": True, "data": result})
+            # Check for errors - doc_result is a list on success, dict on error
+            if isinstance(doc_result, list) and len(doc_result) > 0:
+                doc = doc_result[0]
+                doc['public_url'] = get_public_url('documents', storage_path) if storage_path else ''
+                self._json_response(200, doc)
+            elif isinstance(doc_result, dict) and doc_result.get('error'):
+                self._json_response(500, {"error": f"Failed to create document record: {doc_result.get('error')}"})
+            else:
+                self._json_response(500, {"error": "Failed to create document record: Unknown error"})
+            return
+        except Exception as e:
+            self._json_response(500, {"error": f"Create record error: {str(e)}"})
             return
 
-        # Create document record only (file uploaded directly to Supabase from browser)
-        if '/pdf/create-record' in path:
-            doc_id = body.get('id')
-            filename = body.get('filename', 'document.pdf')
-            original_filename = body.get('original_filename', filename)
-            storage_path = body.get('storage_path', '')
-            file_size = body.get('file_size', 0)
+    # Upload PDF and create document record (legacy - for small files via base64)
+    @routes.post('/pdf/upload')
+    def post_pdf_upload(self, body):
+        # Expect base64-encoded PDF data
+        pdf_base64 = body.get('file_data', '')
+        filename = body.get('filename', 'document.pdf')
 
-            if not doc_id:
-                self._json_response(400, {"error": "Missing document id"})
-                return
+        if not pdf_base64:
+            self._json_response(400, {"error": "No file data provided"})
+            return
 
+        try:
+            # Decode base64
+            pdf_data = base64.b64decode(pdf_base64)
+
+            # Generate unique document ID
+            doc_id = str(uuid.uuid4())
+            # Sanitize filename for storage path (remove special chars)
+            safe_filename = re.sub(r'[^\w\-_.]', '_', filename)
+            storage_path = f"{doc_id}/{safe_filename}"
+
+            # Try to upload to Supabase storage (optional - don't fail if storage unavailable)
+            storage_success = False
+            storage_error = None
             try:
-                doc_data = {
-                    'id': doc_id,
-                    'filename': filename,
-                    'original_filename': original_filename,
-                    'storage_path': storage_path,
-                    'file_size': file_size,
-                    'status': 'pending'
-                }
-                doc_result = supabase_post('pdf_documents', doc_data)
-
-                # Check for errors - doc_result is a list on success, dict on error
-                if isinstance(doc_result, list) and len(doc_result) > 0:
-                    doc = doc_result[0]
-                    doc['public_url'] = get_public_url('documents', storage_path) if storage_path else ''
-                    self._json_response(200, doc)
-                elif isinstance(doc_result, dict) and doc_result.get('error'):
-                    self._json_response(500, {"error": f"Failed to create document record: {doc_result.get('error')}"})
-                else:
-                    self._json_response(500, {"error": "Failed to create document record: Unknown error"})
-                return
-            except Exception as e:
-                self._json_response(500, {"error": f"Create record error: {str(e)}"})
-                return
+                upload_result = upload_to_supabase_storage('documents', storage_path, pdf_data)
+                storage_success = upload_result.get('success', False)
+                if not storage_success:
+                    storage_error = upload_result.get('error', 'Unknown storage error')
+            except Exception as storage_exc:
+                storage_error = str(storage_exc)
+
+            # Create document record even if storage fails
+            # (We can still process text extracted client-side)
+            doc_data = {
+                'id': doc_id,
+                'filename': safe_filename,
+                'original_filename': filename,
+                'storage_path': storage_path if storage_success else '',
+                'file_size': len(pdf_data),
+                'status': 'pending'
+            }
+            doc_result = supabase_post('pdf_documents', doc_data)
 
-        # Upload PDF and create document record (legacy - for small files via base64)
-        if '/pdf/upload' in path:
-            # Expect base64-encoded PDF data
-            pdf_base64 = body.get('file_data', '')
-            filename = body.get('filename', 'document.pdf')
+            if doc_result and not doc_result.get('error'):
+                doc = doc_result[0] if isinstance(doc_result, list) else doc_result
+                doc['public_url'] = get_public_url('documents', storage_path) if storage_success else ''
+                doc['storage_warning'] = storage_error if storage_error else None
+                self._json_response(200, doc)
+            else:
+                db_error = doc_result.get('error') if doc_result else 'Unknown DB error'
+                self._json_response(500, {"error": f"Failed to create document record: {db_error}"})
+            return
 
-            if not pdf_base64:
-                self._json_response(400, {"error": "No file data provided"})
-                return
+        except base64.binascii.Error as e:
+            self._json_response(400, {"error": f"Invalid file data (base64 decode failed): {str(e)}"})
+            return
+        except Exception as e:
+            self._json_response(500, {"error": f"Upload error: {str(e)}"})
+            return
 
-            try:
-                # Decode base64
-                pdf_data = base64.b64decode(pdf_base64)
-
-                # Generate unique document ID
-                doc_id = str(uuid.uuid4())
-                # Sanitize filename for storage path (remove special chars)
-                safe_filename = re.sub(r'[^\w\-_.]', '_', filename)
-                storage_path = f"{doc_id}/{safe_filename}"
-
-                # Try to upload to Supabase storage (optional - don't fail if storage unavailable)
-                storage_success = False
-                storage_error = None
-                try:
-                    upload_result = upload_to_supabase_storage('documents', storage_path, pdf_data)
-                    storage_success = upload_result.get('success', False)
-                    if not storage_success:
-                        storage_error = upload_result.get('error', 'Unknown storage error')
-                except Exception as storage_exc:
-                    storage_error = str(storage_exc)
-
-                # Create document record even if storage fails
-                # (We can still process text extracted client-side)
-                doc_data = {
-                    'id': doc_id,
-                    'filename': safe_filename,
-                    'original_filename': filename,
-                    'storage_path': storage_path if storage_success else '',
-                    'file_size': len(pdf_data),
-                    'status': 'pending'
-                }
-                doc_result = supabase_post('pdf_documents', doc_data)
+    # Process PDF - extract text and generate embeddings
+    @routes.post('/pdf/process')
+    def post_pdf_process(self, body):
+        doc_id = body.get('document_id')
+        openai_api_key = body.get('openai_api_key')
+        use_stored_key = body.get('use_stored_key', False)
+        pages_text = body.get('pages_text', [])  # Array of {page_number, text}
 
-                if doc_result and not doc_result.get('error'):
-                    doc = doc_result[0] if isinstance(doc_result, list) else doc_result
-                    doc['public_url'] = get_public_url('documents', storage_path) if storage_success else ''
-                    doc['storage_warning'] = storage_error if storage_error else None
-                    self._json_response(200, doc)
-                else:
-                    db_error = doc_result.get('error') if doc_result else 'Unknown DB error'
-                    self._json_response(500, {"error": f"Failed to create document record: {db_error}"})
-                return
+        if not doc_id:
+            self._json_response(400, {"error": "Missing document_id"})
+            return
 
-            except base64.binascii.Error as e:
-                self._json_response(400, {"error": f"Invalid file data (base64 decode failed): {str(e)}"})
-                return
-            except Exception as e:
-                self._json_response(500, {"error": f"Upload error: {str(e)}"})
-                return
+        # If use_stored_key is True, get key from ai_settings
+        if use_stored_key or not openai_api_key:
+            # Try user-specific settings first, then fall back to any settings
+            user_id = self._get_user_id()
+            settings = None
+            if user_id:
+                settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
+            if not settings:
+                # Fallback: get first ai_settings record (for single-user/demo mode)
+                settings = supabase_get('ai_settings', {'select': '*', 'limit': '1'})
+            if settings and settings[0].get('openai_api_key'):
+                openai_api_key = settings[0]['openai_api_key']
 
-        # Process PDF - extract text and generate embeddings
-        if '/pdf/process' in path:
-            doc_id = body.get('document_id')
-            openai_api_key = body.get('openai_api_key')
-            use_stored_key = body.get('use_stored_key', False)
-            pages_text = body.get('pages_text', [])  # Array of {page_number, text}
+        if not openai_api_key:
+            self._json_response(400, {"error": "Missing OpenAI API key. Please configure it in Settings first."})
+            return
 
-            if not doc_id:
-                self._json_response(400, {"error": "Missing document_id"})
-                return
+        if not pages_text:
+            self._json_response(400, {"error": "Missing pages_text"})
+            return
 
-            # If use_stored_key is True, get key from ai_settings
-            if use_stored_key or not openai_api_key:
-                # Try user-specific settings first, then fall back to any settings
-                user_id = self._get_user_id()
-                settings = None
-                if user_id:
-                    settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
-                if not settings:
-                    # Fallback: get first ai_settings record (for single-user/demo mode)
-                    settings = supabase_get('ai_settings', {'select': '*', 'limit': '1'})
-                if settings and settings[0].get('openai_api_key'):
-                    openai_api_key = settings[0]['openai_api_key']
-
-            if not openai_api_key:
-                self._json_response(400, {"error": "Missing OpenAI API key. Please configure it in Settings first."})
-                return
+        # Rows per PostgREST array insert (request body overrides the env default)
+        batch_size = body.get('batch_size') or os.environ.get('PDF_CHUNK_BATCH_SIZE', 100)
 
-            if not pages_text:
-                self._json_response(400, {"error": "Missing pages_text"})
-                return
+        try:
+            # Update document status
+            supabase_patch('pdf_documents', {'status': 'processing'}, {'id': f'eq.{doc_id}'})
 
-            try:
-                # Update document status
-                supabase_patch('pdf_documents', {'status': 'processing'}, {'id': f'eq.{doc_id}'})
+            # Process each page and collect chunks
+            pending = []
+            for page_data in pages_text:
+                page_number = page_data.get('page_number', 1)
+                text = page_data.get('text', '')
 
-                # Process each page and create chunks
-                all_chunks = []
-                chunk_index = 0
+                if not text.strip():
+                    continue
 
-                for page_data in pages_text:
-                    page_number = page_data.get('page_number', 1)
-                    text = page_data.get('text', '')
+                # Chunk the page text
+                page_chunks = chunk_text(text, chunk_size=400, overlap=50)
 
-                    if not text.strip():
+                for chunk_content in page_chunks:
+                    if len(chunk_content.strip()) < 20:
                         continue
+                    pending.append((page_number, chunk_content))
+
+            # Generate embeddings in batched, concurrent requests
+            embeddings, embed_errors = embed_texts(openai_api_key, [c for _, c in pending])
+            if embed_errors:
+                print(f"Embedding errors: {len(embed_errors)} chunks skipped, first: {embed_errors[0]['error']}")
+
+            all_chunks = []
+            index_rows = []
+            chunk_index = 0
+            writer = SupabaseBatchWriter('pdf_chunks', batch_size=batch_size, key_field='chunk_index')
+            for (page_number, chunk_content), embedding in zip(pending, embeddings):
+                if not embedding:
+                    continue
+
+                # Store chunk
+                chunk_data = {
+                    'document_id': doc_id,
+                    'chunk_index': chunk_index,
+                    'page_number': page_number,
+                    'content': chunk_content,
+                    'token_count': len(chunk_content.split()),
+                    'embedding': embedding
+                }
 
-                    # Chunk the page text
-                    page_chunks = chunk_text(text, chunk_size=400, overlap=50)
-
-                    for chunk_content in page_chunks:
-                        if len(chunk_content.strip()) < 20:
-                            continue
-
-                        # Generate embedding
-                        embed_result = get_openai_embedding(openai_api_key, chunk_content)
-
-                        if not embed_result.get('success'):
-                            continue
-
-                        embedding = embed_result.get('embedding', [])
-
-                        # Store chunk
-                        chunk_data = {
-                            'document_id': doc_id,
-                            'chunk_index': chunk_index,
-                            'page_number': page_number,
-                            'content': chunk_content,
-                            'token_count': len(chunk_content.split()),
-                            'embedding': embedding
-                        }
-
-                        insert_result = supabase_post('pdf_chunks', chunk_data)
-                        if isinstance(insert_result, dict) and insert_result.get('error'):
-                            # Log first error and continue - don't fail entire process
-                            if chunk_index == 0:
-                                print(f"Chunk insert error: {insert_result.get('error')}")
-                        all_chunks.append({'chunk_index': chunk_index, 'page_number': page_number})
-                        chunk_index += 1
-
-                # Update document status
-                supabase_patch('pdf_documents', {
-                    'status': 'ready',
-                    'page_count': len(pages_text)
-                }, {'id': f'eq.{doc_id}'})
+                writer.add(chunk_data)
+                index_rows.append({'chunk_index': chunk_index, 'page_number': page_number,
+                                   'content': chunk_content, 'embedding': embedding})
+                all_chunks.append({'chunk_index': chunk_index, 'page_number': page_number})
+                chunk_index += 1
 
-                self._json_response(200, {
-                    "success": True,
-                    "chunks_created": len(all_chunks),
-                    "pages_processed": len(pages_text)
-                })
-                return
+            writer.flush()
+            if writer.failures:
+                # Log first error and continue - don't fail entire process
+                print(f"Chunk insert errors: {len(writer.failures)} failed, first: {writer.failures[0]['error']}")
 
-            except Exception as e:
-                supabase_patch('pdf_documents', {
-                    'status': 'error',
-                    'error_message': str(e)
-                }, {'id': f'eq.{doc_id}'})
-                self._json_response(500, {"error": f"Processing error: {str(e)}"})
-                return
+            # Build the local embedding + BM25 indexes so searches skip embedding JSON entirely
+            build_document_index(doc_id, index_rows)
 
-        # RAG Chat - query documents and generate response (supports multi-doc)
-        if '/rag/chat' in path:
-            question = body.get('question', '')
-            document_ids = body.get('document_ids', [])  # Array of doc IDs for multi-doc RAG
-            document_id = body.get('document_id')  # Legacy single doc support
-            openai_api_key = body.get('openai_api_key')
-            use_stored_key = body.get('use_stored_key', False)
-            llm_provider = body.get('llm_provider', 'openai')
-            llm_api_key = body.get('llm_api_key')
-            llm_model = body.get('llm_model', 'gpt-4o-mini')
-
-            # Support both old (document_id) and new (document_ids) params
-            if document_id and not document_ids:
-                document_ids = [document_id]
-
-            if not question:
-                self._json_response(400, {"error": "Missing question"})
-                return
+            # Update document status
+            supabase_patch('pdf_documents', {
+                'status': 'ready',
+                'page_count': len(pages_text),
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }, {'id': f'eq.{doc_id}'})
+            get_answer_cache().invalidate_documents([doc_id])
 
-            # If use_stored_key is True, get key from ai_settings
-            if use_stored_key or not openai_api_key:
-                # Try user-specific settings first, then fall back to any settings
-                user_id = self._get_user_id()
-                settings = None
-                if user_id:
-                    settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
-                if not settings:
-                    # Fallback: get first ai_settings record (for single-user/demo mode)
-                    settings = supabase_get('ai_settings', {'select': '*', 'limit': '1'})
-                if settings:
-                    s = settings[0]
-                    if not openai_api_key and s.get('openai_api_key'):
-                        openai_api_key = s['openai_api_key']
-                    if not llm_api_key:
-                        # Use appropriate LLM key based on provider
-                        llm_api_key = s.get(f'{llm_provider}_api_key') or openai_api_key
-                        llm_model = s.get(f'{llm_provider}_model') or llm_model
-
-            if not openai_api_key:
-                self._json_response(400, {"error": "Missing OpenAI API key. Please configure it in Settings first."})
-                return
+            self._json_response(200, {
+                "success": True,
+                "chunks_created": writer.inserted,
+                "chunks_failed": len(writer.failures),
+                "failed_chunks": writer.failures,
+                "insert_requests": writer.requests,
+                "embedding_failures": len(embed_errors),
+                "pages_processed": len(pages_text)
+            })
+            return
 
-            if not llm_api_key:
-                llm_api_key = openai_api_key  # Use OpenAI key if no separate LLM key
+        except Exception as e:
+            supabase_patch('pdf_documents', {
+                'status': 'error',
+                'error_message': str(e)
+            }, {'id': f'eq.{doc_id}'})
+            self._json_response(500, {"error": f"Processing error: {str(e)}"})
+            return
 
-            try:
-                # Generate embedding for question
-                print(f"[RAG DEBUG] Generating embedding for question: {question[:50]}...")
-                embed_result = get_openai_embedding(openai_api_key, question)
+    # RAG Chat - query documents and generate response (supports multi-doc)
+    @routes.post('/rag/chat')
+    def post_rag_chat(self, body):
+        question = body.get('question', '')
+        document_ids = body.get('document_ids', [])  # Array of doc IDs for multi-doc RAG
+        document_id = body.get('document_id')  # Legacy single doc support
+        openai_api_key = body.get('openai_api_key')
+        use_stored_key = body.get('use_stored_key', False)
+        llm_provider = body.get('llm_provider', 'openai')
+        llm_api_key = body.get('llm_api_key')
+        llm_model = body.get('llm_model', 'gpt-4o-mini')
+
+        # Support both old (document_id) and new (document_ids) params
+        if document_id and not document_ids:
+            document_ids = [document_id]
+
+        if not question:
+            self._json_response(400, {"error": "Missing question"})
+            return
 
-                if not embed_result.get('success'):
-                    print(f"[RAG DEBUG] Embedding failed: {embed_result.get('error')}")
-                    self._json_response(500, {"error": f"Embedding error: {embed_result.get('error')}"})
-                    return
+        # If use_stored_key is True, get key from ai_settings
+        if use_stored_key or not openai_api_key:
+            # Try user-specific settings first, then fall back to any settings
+            user_id = self._get_user_id()
+            settings = None
+            if user_id:
+                settings = supabase_get('ai_settings', {'user_id': f'eq.{user_id}'})
+            if not settings:
+                # Fallback: get first ai_settings record (for single-user/demo mode)
+                settings = supabase_get('ai_settings', {'select': '*', 'limit': '1'})
+            if settings:
+                s = settings[0]
+                if not openai_api_key and s.get('openai_api_key'):
+                    openai_api_key = s['openai_api_key']
+                if not llm_api_key:
+                    # Use appropriate LLM key based on provider
+                    llm_api_key = s.get(f'{llm_provider}_api_key') or openai_api_key
+                    llm_model = s.get(f'{llm_provider}_model') or llm_model
+
+        if not openai_api_key:
+            self._json_response(400, {"error": "Missing OpenAI API key. Please configure it in Settings first."})
+            return
 
-                query_embedding = embed_result.get('embedding', [])
-                print(f"[RAG DEBUG] Embedding generated, length: {len(query_embedding)}")
-
-                # Get document info for filenames (for multi-doc context)
-                doc_info = {}
-                if document_ids:
-                    docs = supabase_get('pdf_documents', {'select': 'id,original_filename'})
-                    doc_info = {d['id']: d.get('original_filename', 'Document') for d in (docs or [])}
-
-                # Search for similar chunks using hybrid search (semantic + keyword)
-                all_chunks = []
-                debug_info = {'search_method': 'hybrid', 'document_ids': document_ids}
-
-                if document_ids:
-                    # Multi-doc: search each document and combine results
-                    chunks_per_doc = max(10, 20 // len(document_ids))  # More chunks per doc for better coverage
-                    for doc_id in document_ids:
-                        print(f"[RAG DEBUG] Hybrid search for doc {doc_id}")
-                        chunks = hybrid_search_chunks(question, query_embedding, chunks_per_doc, doc_id)
-                        print(f"[RAG DEBUG] Found {len(chunks)} chunks")
-                        if chunks:
-                            top = chunks[0]
-                            print(f"[RAG DEBUG] Top result - similarity: {top.get('similarity', 0):.4f}, "
-                                  f"semantic: {top.get('semantic_similarity', 0):.4f}, "
-                                  f"keyword: {top.get('keyword_score', 0):.4f}, "
-                                  f"page: {top.get('page_number')}")
-                        debug_info[f'doc_{doc_id}_count'] = len(chunks) if chunks else 0
-
-                        if chunks:
-                            for c in chunks:
-                                c['doc_filename'] = doc_info.get(doc_id, 'Document')
-                            all_chunks.extend(chunks)
-                else:
-                    # Search all documents
-                    print(f"[RAG DEBUG] Hybrid search across all documents")
-                    all_chunks = hybrid_search_chunks(question, query_embedding, 15)
-                    print(f"[RAG DEBUG] Found {len(all_chunks)} chunks total")
-                    if all_chunks:
-                        top = all_chunks[0]
-                        print(f"[RAG DEBUG] Top result - similarity: {top.get('similarity', 0):.4f}, "
-                              f"semantic: {top.get('semantic_similarity', 0):.4f}, "
-                              f"keyword: {top.get('keyword_score', 0):.4f}, "
-                              f"page: {top.get('page_number')}")
-                    debug_info['total_chunks'] = len(all_chunks)
-
-                # Sort by hybrid similarity and take top results
-                all_chunks = sorted(all_chunks, key=lambda x: x.get('similarity', 0), reverse=True)[:10]
-
-                # Build context from similar chunks
-                context_parts = []
-                sources = []
-                for chunk in all_chunks:
-                    doc_name = chunk.get('doc_filename', 'Document')
-                    page_num = chunk.get('page_number', '?')
-                    content = chunk.get('content', '')
-
-                    if len(document_ids) > 1:
-                        context_parts.append(f"[{doc_name} - Page {page_num}]: {content}")
+        if not llm_api_key:
+            llm_api_key = openai_api_key  # Use OpenAI key if no separate LLM key
+
+        stream = bool(body.get('stream'))
+        try:
+            # Generate embedding for question
+            print(f"[RAG DEBUG] Generating embedding for question: {question[:50]}...")
+            embed_result = get_query_embedding(openai_api_key, question)
+
+            if not embed_result.get('success'):
+                print(f"[RAG DEBUG] Embedding failed: {embed_result.get('error')}")
+                self._json_response(500, {"error": f"Embedding error: {embed_result.get('error')}"})
+                return
+
+            query_embedding = embed_result.get('embedding', [])
+            print(f"[RAG DEBUG] Embedding generated, length: {len(query_embedding)}")
+
+            # Get document info for filenames (for multi-doc context) and the answer cache
+            docs = supabase_get('pdf_documents', {'select': 'id,original_filename,updated_at'})
+            if isinstance(docs, dict):
+                docs = []
+            doc_info = {d['id']: d.get('original_filename', 'Document') for d in (docs or [])}
+
+            # Reuse the answer to a near-identical question on the same, unchanged documents
+            answer_cache = get_answer_cache()
+            cache_scope = (llm_provider, llm_model, document_fingerprint(docs, document_ids))
+            if not body.get('no_cache'):
+                cached, cached_similarity = answer_cache.lookup(cache_scope, document_ids, query_embedding)
+                if cached is not None:
+                    print(f"[RAG DEBUG] Answer cache hit (similarity {cached_similarity:.4f})")
+                    cached = dict(cached, cached=True, cache_similarity=round(cached_similarity, 4))
+                    if stream:
+                        self._sse_start()
+                        self._sse_event({"delta": cached['answer']})
+                        self._sse_event(cached, event='done')
                     else:
-                        context_parts.append(f"[Page {page_num}]: {content}")
+                        self._json_response(200, cached)
+                    return
 
-                    sources.append({
-                        'page_number': page_num,
-                        'document_id': chunk.get('document_id'),
-                        'document_name': doc_name,
-                        'content': content[:200] + '...' if len(content) > 200 else content,
-                        'similarity': chunk.get('similarity', 0)
-                    })
+            # Search for similar chunks using hybrid search (semantic + keyword)
+            all_chunks = []
+            debug_info = {'search_method': 'hybrid', 'document_ids': document_ids}
+
+            if document_ids:
+                # Multi-doc: one candidate load and scoring pass, with a per-document quota
+                chunks_per_doc = max(10, 20 // len(document_ids))  # More chunks per doc for better coverage
+                print(f"[RAG DEBUG] Hybrid search for docs {document_ids}")
+                all_chunks = hybrid_search_documents(question, query_embedding, document_ids, chunks_per_doc)
+                print(f"[RAG DEBUG] Found {len(all_chunks)} chunks")
+                if all_chunks:
+                    top = all_chunks[0]
+                    print(f"[RAG DEBUG] Top result - similarity: {top.get('similarity', 0):.4f}, "
+                          f"semantic: {top.get('semantic_similarity', 0):.4f}, "
+                          f"keyword: {top.get('keyword_score', 0):.4f}, "
+                          f"page: {top.get('page_number')}")
+                for doc_id in document_ids:
+                    debug_info[f'doc_{doc_id}_count'] = sum(1 for c in all_chunks if c.get('document_id') == doc_id)
+                for c in all_chunks:
+                    c['doc_filename'] = doc_info.get(c.get('document_id'), 'Document')
+            else:
+                # Search all documents
+                print(f"[RAG DEBUG] Hybrid search across all documents")
+                all_chunks = hybrid_search_chunks(question, query_embedding, 15)
+                print(f"[RAG DEBUG] Found {len(all_chunks)} chunks total")
+                if all_chunks:
+                    top = all_chunks[0]
+                    print(f"[RAG DEBUG] Top result - similarity: {top.get('similarity', 0):.4f}, "
+                          f"semantic: {top.get('semantic_similarity', 0):.4f}, "
+                          f"keyword: {top.get('keyword_score', 0):.4f}, "
+                          f"page: {top.get('page_number')}")
+                debug_info['total_chunks'] = len(all_chunks)
+
+            # Sort by hybrid similarity and take top results
+            all_chunks = sorted(all_chunks, key=lambda x: x.get('similarity', 0), reverse=True)[:10]
+
+            # Build context from similar chunks
+            context_parts = []
+            sources = []
+            for chunk in all_chunks:
+                doc_name = chunk.get('doc_filename', 'Document')
+                page_num = chunk.get('page_number', '?')
+                content = chunk.get('content', '')
 
-                context = '\n\n'.join(context_parts)
+                if len(document_ids) > 1:
+                    context_parts.append(f"[{doc_name} - Page {page_num}]: {content}")
+                else:
+                    context_parts.append(f"[Page {page_num}]: {content}")
+
+                sources.append({
+                    'page_number': page_num,
+                    'document_id': chunk.get('document_id'),
+                    'document_name': doc_name,
+                    'content': content[:200] + '...' if len(content) > 200 else content,
+                    'similarity': chunk.get('similarity', 0)
+                })
+
+            context = '\n\n'.join(context_parts)
 
-                # Build prompt for LLM
-                multi_doc_note = "from multiple documents" if len(document_ids) > 1 else "from the study guide"
-                prompt = f"""You are an IGCSE Geography study assistant. Answer the question based on the following context {multi_doc_note}.
+            # Build prompt for LLM
+            multi_doc_note = "from multiple documents" if len(document_ids) > 1 else "from the study guide"
+            prompt = f"""You are an IGCSE Geography study assistant. Answer the question based on the following context {multi_doc_note}.
 
 CONTEXT:
 {context}
@@ -2257,12 +3200,23 @@ INSTRUCTIONS:
 
 ANSWER:"""
 
-                # Check if we have any context
-                if not all_chunks:
-                    self._json_response(500, {"error": "No relevant content found in documents"})
-                    return
+            # Check if we have any context
+            if not all_chunks:
+                self._json_response(500, {"error": "No relevant content found in documents"})
+                return
 
-                # Call LLM with higher token limit for comprehensive answers
+            # Call LLM with higher token limit for comprehensive answers
+            if stream:
+                # Streaming mode: token deltas go out as they arrive, sources with the final event
+                self._sse_start()
+                stream_fn = STREAM_PROVIDERS.get(llm_provider, stream_openai)
+                answer, error = self._sse_relay(stream_fn(llm_api_key, llm_model, prompt, max_tokens=4096))
+                if error:
+                    return
+                if not answer.strip():
+                    self._sse_event({"error": "AI returned empty response. Please try a different question or check your API key quota."}, event='error')
+                    return
+            else:
                 if llm_provider == 'openai':
                     result = call_openai(llm_api_key, llm_model, prompt, max_tokens=4096)
                 elif llm_provider == 'claude':
@@ -2285,49 +3239,58 @@ ANSWER:"""
                     self._json_response(500, {"error": "AI returned empty response. Please try a different question or check your API key quota."})
                     return
 
-                response_data = {
-                    "answer": answer,
-                    "sources": sources,
-                    # Always include debug summary for troubleshooting
-                    "debug_summary": {
-                        "document_ids_searched": document_ids,
-                        "chunks_found": len(all_chunks),
-                        "used_fallback": len(debug_info.get('fallback_results', [])) > 0,
-                        "top_similarities": [round(c.get('similarity', 0), 4) for c in all_chunks[:3]] if all_chunks else []
-                    }
+            response_data = {
+                "answer": answer,
+                "sources": sources,
+                # Always include debug summary for troubleshooting
+                "debug_summary": {
+                    "document_ids_searched": document_ids,
+                    "chunks_found": len(all_chunks),
+                    "used_fallback": len(debug_info.get('fallback_results', [])) > 0,
+                    "top_similarities": [round(c.get('similarity', 0), 4) for c in all_chunks[:3]] if all_chunks else []
                 }
+            }
 
-                # Include full debug info if no sources found
-                if not sources:
-                    response_data["debug"] = debug_info
+            # Include full debug info if no sources found
+            if not sources:
+                response_data["debug"] = debug_info
+            else:
+                answer_cache.store(cache_scope, document_ids, query_embedding, response_data)
 
+            if stream:
+                self._sse_event(response_data, event='done')
+            else:
                 self._json_response(200, response_data)
-                return
+            return
 
-            except Exception as e:
-                import traceback
-                error_detail = f"Chat error: {str(e)}"
-                # Log full traceback for debugging (visible in Vercel logs)
-                print(f"RAG Chat Exception: {traceback.format_exc()}")
+        except Exception as e:
+            import traceback
+            error_detail = f"Chat error: {str(e)}"
+            # Log full traceback for debugging (visible in Vercel logs)
+            print(f"RAG Chat Exception: {traceback.format_exc()}")
+            if getattr(self, '_sse_started', False):
+                self._sse_event({"error": error_detail}, event='error')
+            else:
                 self._json_response(500, {"error": error_detail})
-                return
-
-        # Delete PDF document
-        if '/pdf/delete' in path:
-            doc_id = body.get('document_id')
-            if not doc_id:
-                self._json_response(400, {"error": "Missing document_id"})
-                return
-
-            # Delete chunks first
-            supabase_delete('pdf_chunks', {'document_id': f'eq.{doc_id}'})
-            # Delete document record
-            supabase_delete('pdf_documents', {'id': f'eq.{doc_id}'})
-            # Note: Storage file cleanup would need additional implementation
+            return
 
-            self._json_response(200, {"success": True})
+    # Delete PDF document
+    @routes.post('/pdf/delete')
+    def post_pdf_delete(self, body):
+        doc_id = body.get('document_id')
+        if not doc_id:
+            self._json_response(400, {"error": "Missing document_id"})
             return
 
+        # Delete chunks first
+        supabase_delete('pdf_chunks', {'document_id': f'eq.{doc_id}'})
+        delete_index(doc_id)
+        delete_keyword_index(doc_id)
+        get_answer_cache().invalidate_documents([doc_id])
+        # Delete document record
+        supabase_delete('pdf_documents', {'id': f'eq.{doc_id}'})
+        # Note: Storage file cleanup would need additional implementation
+
         self._json_response(200, {"success": True})
 
     def do_PUT(self):
@@ -0,0 +1,146 @@
+"""
+BM25 inverted keyword index for IGCSE Geography Guru RAG search
+Built per document at ingestion and stored next to the embedding index as
+<doc_id>.bm25.json. Scoring only touches the postings of the query terms, and
+terms match whole words ("rain" no longer matches "drainage").
+"""
+
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+
+from api.embedding_index import INDEX_DIR
+
+INDEX_VERSION = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r'\b[a-z]{3,}\b')
+
+_cache = {}  # document_id -> (mtime, KeywordIndex)
+_cache_lock = threading.Lock()
+
+
+def tokenize(text):
+    """Lowercase word tokens, using the same word rule as extract_key_terms."""
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+class KeywordIndex:
+    """Token postings ({term: [[row, tf], ...]}) plus per-row lengths for BM25."""
+
+    def __init__(self, ids, lengths, postings):
+        self.ids = ids
+        self.lengths = lengths
+        self.postings = postings
+        self.avg_length = (sum(lengths) / len(lengths)) if lengths else 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, rows, field='content'):
+        ids, lengths, postings = [], [], {}
+        for row_num, row in enumerate(rows):
+            tokens = tokenize(row.get(field, ''))
+            ids.append(row.get('id'))
+            lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append([row_num, tf])
+        return cls(ids, lengths, postings)
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        n = len(self.ids)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def score(self, terms):
+        """BM25 scores normalised to 0-1, as {row: score} for rows containing any term.
+        The normaliser is the score ceiling sum(idf * (k1 + 1)) over the query terms that
+        occur in the index; terms with no postings (misspellings, words absent from the
+        document) would add the largest idf of all and push real matches towards 0."""
+        terms = list(dict.fromkeys(terms))
+        if not terms or not self.ids:
+            return {}
+        avg = self.avg_length or 1
+        scores = {}
+        ceiling = 0.0
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            ceiling += idf * (BM25_K1 + 1)
+            for row, tf in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[row] / avg)
+                scores[row] = scores.get(row, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        if ceiling <= 0:
+            return {}
+        return {row: min(score / ceiling, 1.0) for row, score in scores.items()}
+
+    def to_dict(self, document_id):
+        return {
+            'version': INDEX_VERSION,
+            'document_id': document_id,
+            'ids': self.ids,
+            'lengths': self.lengths,
+            'postings': self.postings,
+        }
+
+
+def _path(document_id):
+    safe = re.sub(r'[^\w\-]', '_', str(document_id))
+    return os.path.join(INDEX_DIR, safe + '.bm25.json')
+
+
+def write_keyword_index(document_id, rows):
+    """Build and persist the keyword index for a document from rows with id and content."""
+    index = KeywordIndex.build([r for r in rows if r.get('id') is not None])
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=INDEX_DIR, suffix='.bm25.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(index.to_dict(document_id), f, separators=(',', ':'))
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, _path(document_id))
+    with _cache_lock:
+        _cache.pop(document_id, None)
+    return index
+
+
+def load_keyword_index(document_id):
+    """Return the stored KeywordIndex for a document, or None if absent/invalid."""
+    path = _path(document_id)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _cache_lock:
+        cached = _cache.get(document_id)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            return None
+        index = KeywordIndex(data['ids'], data['lengths'], data['postings'])
+    except (OSError, ValueError, KeyError):
+        return None
+    with _cache_lock:
+        _cache[document_id] = (mtime, index)
+    return index
+
+
+def delete_keyword_index(document_id):
+    with _cache_lock:
+        _cache.pop(document_id, None)
+    try:
+        os.remove(_path(document_id))
+    except OSError:
+        pass
@@ -0,0 +1,233 @@
+"""
+Pooled Qwen realtime TTS sessions for IGCSE Geography Guru
+Custom-voice synthesis goes through DashScope's realtime WebSocket. Opening a
+session costs a TLS handshake plus the session.created -> session.update ->
+session.updated exchange, so sessions are kept warm per (api key, model, voice)
+and reused for later utterances until they sit idle past
+QWEN_SESSION_IDLE_TIMEOUT. Utterances are read synchronously on the calling
+thread, so no thread or event is created per sentence.
+"""
+
+import base64
+import json
+import os
+import ssl
+import threading
+import time
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+QWEN_REALTIME_URL = "wss://dashscope-intl.aliyuncs.com/api-ws/v1/realtime"
+QWEN_SESSION_IDLE_TIMEOUT = float(os.environ.get('QWEN_SESSION_IDLE_TIMEOUT', 60))
+QWEN_SESSIONS_PER_KEY = int(os.environ.get('QWEN_SESSIONS_PER_KEY', 4))
+QWEN_UTTERANCE_TIMEOUT = float(os.environ.get('QWEN_UTTERANCE_TIMEOUT', 60))
+
+
+class RealtimeSessionError(Exception):
+    """A realtime session failed. `transport` is True for socket failures (a reused session
+    may simply have been closed by the server) and False for an error event from DashScope."""
+
+    def __init__(self, message, transport=False):
+        super().__init__(message)
+        self.transport = transport
+
+
+class RealtimeSession:
+    """One authenticated realtime WebSocket with its voice settings applied."""
+
+    def __init__(self, key, ws):
+        self.key = key
+        self.ws = ws
+        self.last_used = time.monotonic()
+        self.utterances = 0
+        self.broken = False
+
+    @classmethod
+    def open(cls, key, deadline):
+        api_key, model, voice = key
+        try:
+            ws = websocket.create_connection(
+                f"{QWEN_REALTIME_URL}?model={model}",
+                header=[f"Authorization: Bearer {api_key}"],
+                timeout=max(deadline - time.monotonic(), 1),
+                sslopt={"cert_reqs": ssl.CERT_NONE})
+        except (OSError, websocket.WebSocketException) as e:
+            raise RealtimeSessionError(str(e), transport=True)
+        session = cls(key, ws)
+        try:
+            session._expect("session.created", deadline)
+            session._send({
+                "type": "session.update",
+                "session": {
+                    "voice": voice,
+                    "response_format": "pcm",
+                    "sample_rate": 24000,
+                    "mode": "server_commit"
+                }
+            })
+            session._expect("session.updated", deadline)
+        except RealtimeSessionError:
+            session.close()
+            raise
+        print(f"[Qwen Realtime] Opened session model={model} voice={voice}")
+        return session
+
+    def _send(self, event):
+        try:
+            self.ws.send(json.dumps(event))
+        except (OSError, websocket.WebSocketException) as e:
+            self.broken = True
+            raise RealtimeSessionError(str(e), transport=True)
+
+    def _recv(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self.broken = True
+            raise RealtimeSessionError("Timed out waiting for audio")
+        try:
+            self.ws.settimeout(remaining)
+            message = self.ws.recv()
+        except websocket.WebSocketTimeoutException:
+            self.broken = True
+            raise RealtimeSessionError("Timed out waiting for audio")
+        except (OSError, websocket.WebSocketException) as e:
+            self.broken = True
+            raise RealtimeSessionError(str(e) or "Connection closed", transport=True)
+        try:
+            data = json.loads(message)
+        except ValueError as e:
+            self.broken = True
+            raise RealtimeSessionError(f"Message parse error: {str(e)}")
+        if data.get("type") == "error":
+            self.broken = True
+            error_info = data.get("error", {})
+            raise RealtimeSessionError(error_info.get("message", f"Unknown error: {data}"))
+        return data
+
+    def _expect(self, event_type, deadline):
+        while True:
+            if self._recv(deadline).get("type") == event_type:
+                return
+
+    def speak(self, text, deadline):
+        """Yield PCM chunks for one utterance; the session is reusable once this completes."""
+        self._send({"type": "input_text_buffer.append", "text": text})
+        self._send({"type": "input_text_buffer.commit"})
+        while True:
+            data = self._recv(deadline)
+            event_type = data.get("type", "")
+            if event_type == "response.audio.delta":
+                audio_data = data.get("delta", "")
+                if audio_data:
+                    yield base64.b64decode(audio_data)
+            elif event_type == "response.audio.done":
+                break
+            elif event_type == "session.finished":
+                self.broken = True
+                break
+        self.utterances += 1
+        self.last_used = time.monotonic()
+
+    def close(self):
+        self.broken = True
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+
+class SessionPool:
+    """Thread-safe pool of idle realtime sessions keyed by (api key, model, voice).
+
+    A session serves one utterance at a time; concurrent utterances for the same key
+    open extra sessions, and up to max_idle_per_key of them are kept afterwards.
+    """
+
+    def __init__(self, idle_timeout=QWEN_SESSION_IDLE_TIMEOUT, max_idle_per_key=QWEN_SESSIONS_PER_KEY):
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_key = max_idle_per_key
+        self._lock = threading.Lock()
+        self._idle = {}  # key -> [RealtimeSession, ...]
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "discarded": 0, "stale_retries": 0, "utterances": 0}
+
+    def _evict_idle_locked(self, now):
+        """Close sessions that have been idle longer than idle_timeout (lock held)."""
+        for key in list(self._idle):
+            fresh = []
+            for session in self._idle[key]:
+                if now - session.last_used > self.idle_timeout:
+                    session.close()
+                    self.stats["evictions"] += 1
+                else:
+                    fresh.append(session)
+            if fresh:
+                self._idle[key] = fresh
+            else:
+                del self._idle[key]
+
+    def _acquire(self, key, deadline):
+        """Return (session, reused) - an idle session for key, or a newly opened one."""
+        with self._lock:
+            self._evict_idle_locked(time.monotonic())
+            idle = self._idle.get(key)
+            if idle:
+                self.stats["hits"] += 1
+                return idle.pop(), True
+            self.stats["misses"] += 1
+        return RealtimeSession.open(key, deadline), False
+
+    def _release(self, session):
+        with self._lock:
+            idle = self._idle.setdefault(session.key, [])
+            if not session.broken and len(idle) < self.max_idle_per_key:
+                idle.append(session)
+                return
+            if not idle:
+                del self._idle[session.key]
+        session.close()
+
+    def utterance(self, api_key, model, voice, text, timeout=QWEN_UTTERANCE_TIMEOUT):
+        """Yield PCM chunks for text on a warm session. A reused session that turns out to
+        be closed before any audio arrives is replaced by a fresh one once."""
+        key = (api_key, model, voice)
+        deadline = time.monotonic() + timeout
+        while True:
+            session, reused = self._acquire(key, deadline)
+            received = False
+            try:
+                for chunk in session.speak(text, deadline):
+                    received = True
+                    yield chunk
+            except RealtimeSessionError as e:
+                session.close()
+                with self._lock:
+                    self.stats["discarded"] += 1
+                if reused and e.transport and not received:
+                    with self._lock:
+                        self.stats["stale_retries"] += 1
+                    continue
+                raise
+            except GeneratorExit:
+                # Abandoned mid-utterance: the rest of the response is still in flight
+                session.close()
+                raise
+            with self._lock:
+                self.stats["utterances"] += 1
+            self._release(session)
+            return
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["idle_sessions"] = sum(len(v) for v in self._idle.values())
+        return stats
+
+
+_pool = SessionPool()
+
+
+def get_session_pool():
+    return _pool
@@ -20,15 +20,17 @@ QWEN_PRESET_VOICES = [
 ]
 
 
-def pcm_to_wav(pcm_data: bytes, sample_rate: int = 24000) -> bytes:
-    """Convert raw PCM audio data to WAV format."""
+class TTSError(Exception):
+    """Raised by the streaming generators; the message matches the 'error' of the dict-returning functions."""
+
+
+def _wav_header(data_size: int, sample_rate: int) -> bytes:
     wav_buffer = io.BytesIO()
     num_channels = 1
     sample_width = 2  # 16-bit
 
-    # Write WAV header
     wav_buffer.write(b'RIFF')
-    wav_buffer.write(struct.pack('<I', 36 + len(pcm_data)))
+    wav_buffer.write(struct.pack('<I', min(36 + data_size, 0xFFFFFFFF)))
     wav_buffer.write(b'WAVE')
     wav_buffer.write(b'fmt ')
     wav_buffer.write(struct.pack('<I', 16))  # Subchunk1Size
@@ -39,12 +41,37 @@ def pcm_to_wav(pcm_data: bytes, sample_rate: int = 24000) -> bytes:
     wav_buffer.write(struct.pack('<H', num_channels * sample_width))  # BlockAlign
     wav_buffer.write(struct.pack('<H', sample_width * 8))  # BitsPerSample
     wav_buffer.write(b'data')
-    wav_buffer.write(struct.pack('<I', len(pcm_data)))
-    wav_buffer.write(pcm_data)
-
+    wav_buffer.write(struct.pack('<I', data_size))
     return wav_buffer.getvalue()
 
 
+def pcm_to_wav(pcm_data: bytes, sample_rate: int = 24000) -> bytes:
+    """Convert raw PCM audio data to WAV format."""
+    return _wav_header(len(pcm_data), sample_rate) + pcm_data
+
+
+def wav_stream_header(sample_rate: int = 24000) -> bytes:
+    """WAV header for PCM of unknown length, sent ahead of streamed samples.
+    The sizes are set to the maximum, which players read as 'until end of stream'."""
+    return _wav_header(0xFFFFFFFF, sample_rate)
+
+
+def wav_pcm(wav: bytes):
+    """(pcm bytes, sample rate) from a PCM WAV file, walking its RIFF chunks."""
+    if wav[:4] != b'RIFF' or wav[8:12] != b'WAVE':
+        raise ValueError("Not a WAV file")
+    sample_rate, offset = 24000, 12
+    while offset + 8 <= len(wav):
+        chunk_id, size = wav[offset:offset + 4], struct.unpack('<I', wav[offset + 4:offset + 8])[0]
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            sample_rate = struct.unpack('<I', wav[body + 4:body + 8])[0]
+        elif chunk_id == b'data':
+            return wav[body:body + size], sample_rate
+        offset = body + size + (size & 1)
+    raise ValueError("WAV file has no data chunk")
+
+
 def validate_api_key(api_key: str) -> dict:
     """
     Validate an AliCloud API key by making a test request.
@@ -85,6 +112,13 @@ def validate_api_key(api_key: str) -> dict:
         return {"valid": False, "error": str(e)}
 
 
+def _with_base64(result: dict) -> dict:
+    """Convert an {'audio': bytes} result to the {'audio_base64': str} shape used by JSON responses."""
+    if "audio" not in result:
+        return result
+    return {"audio_base64": base64.b64encode(result["audio"]).decode('utf-8'), "format": result["format"]}
+
+
 def generate_tts(text: str, voice_id: str, api_key: str) -> dict:
     """
     Generate TTS audio using Qwen3-TTS.
@@ -97,6 +131,16 @@ def generate_tts(text: str, voice_id: str, api_key: str) -> dict:
     Returns:
         dict with 'audio_base64' and 'format' on success, or 'error' on failure
     """
+    return _with_base64(generate_tts_audio(text, voice_id, api_key))
+
+
+def generate_tts_audio(text: str, voice_id: str, api_key: str) -> dict:
+    """
+    Generate TTS audio using Qwen3-TTS, as raw bytes.
+
+    Returns:
+        dict with 'audio' (WAV bytes) and 'format' on success, or 'error' on failure
+    """
     if not text or not text.strip():
         return {"error": "No text provided"}
 
@@ -139,21 +183,13 @@ def generate_tts(text: str, voice_id: str, api_key: str) -> dict:
                 # Fetch audio from URL
                 audio_req = urllib.request.Request(audio_url)
                 with urllib.request.urlopen(audio_req, timeout=60) as audio_resp:
-                    audio_bytes = audio_resp.read()
-                    # Return as base64 (already in WAV/MP3 format from URL)
-                    return {
-                        "audio_base64": base64.b64encode(audio_bytes).decode('utf-8'),
-                        "format": "wav"
-                    }
+                    # Already in WAV format from URL
+                    return {"audio": audio_resp.read(), "format": "wav"}
             elif audio_data_b64:
                 # Decode base64 PCM audio
                 pcm_data = base64.b64decode(audio_data_b64)
                 # Convert PCM to WAV
-                wav_data = pcm_to_wav(pcm_data, sample_rate=24000)
-                return {
-                    "audio_base64": base64.b64encode(wav_data).decode('utf-8'),
-                    "format": "wav"
-                }
+                return {"audio": pcm_to_wav(pcm_data, sample_rate=24000), "format": "wav"}
             else:
                 return {"error": f"No audio in response: {json.dumps(result)[:500]}"}
 
@@ -174,6 +210,71 @@ def generate_tts(text: str, voice_id: str, api_key: str) -> dict:
         return {"error": f"TTS generation failed: {str(e)}"}
 
 
+def stream_tts(text: str, voice_id: str, api_key: str):
+    """
+    Generate TTS with a preset voice as a stream of raw 24 kHz 16-bit mono PCM chunks.
+    Uses the same endpoint as generate_tts_audio with server-sent events enabled, so
+    chunks are yielded as DashScope produces them. Raises TTSError on failure.
+    """
+    if not text or not text.strip():
+        raise TTSError("No text provided")
+
+    if not api_key or not api_key.strip():
+        raise TTSError("No API key provided")
+
+    url = "https://dashscope-intl.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation"
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json',
+        'X-DashScope-SSE': 'enable'
+    }
+    payload = {
+        "model": "qwen3-tts-flash",
+        "input": {
+            "text": text,
+            "voice": voice_id,
+            "language_type": "English"
+        }
+    }
+
+    streamed = False
+    audio_url = ""
+    try:
+        req = urllib.request.Request(url, data=json.dumps(payload).encode(), headers=headers, method='POST')
+        with urllib.request.urlopen(req, timeout=60) as response:
+            for raw_line in response:
+                line = raw_line.decode('utf-8').strip()
+                if not line.startswith('data:'):
+                    continue
+                event = json.loads(line[5:])
+                if event.get("code"):
+                    raise TTSError(f"API error ({event.get('code')}): {event.get('message', '')}")
+                audio_obj = event.get("output", {}).get("audio", {})
+                if audio_obj.get("data"):
+                    streamed = True
+                    yield base64.b64decode(audio_obj["data"])
+                audio_url = audio_obj.get("url") or audio_url
+
+        if not streamed:
+            if not audio_url:
+                raise TTSError("No audio in response")
+            # No incremental data: fall back to the finished file
+            with urllib.request.urlopen(urllib.request.Request(audio_url), timeout=60) as audio_resp:
+                yield wav_pcm(audio_resp.read())[0]
+
+    except urllib.error.HTTPError as e:
+        error_body = ""
+        try:
+            error_body = e.read().decode('utf-8')[:500]
+        except:
+            error_body = f"HTTP {e.code}"
+        raise TTSError(f"API error ({e.code}): {error_body}")
+    except urllib.error.URLError as e:
+        raise TTSError(f"Connection error: {str(e)}")
+    except json.JSONDecodeError as e:
+        raise TTSError(f"Invalid JSON response: {str(e)}")
+
+
 def get_voices() -> list:
     """Get list of available preset voices."""
     return QWEN_PRESET_VOICES
@@ -491,18 +592,37 @@ def generate_tts_custom_voice(text: str, voice_id: str, voice_type: str, api_key
     Uses WebSocket Realtime API (OpenAI-compatible protocol).
     Based on vibevoice implementation.
     """
+    return _with_base64(generate_tts_custom_voice_audio(text, voice_id, voice_type, api_key))
+
+
+def generate_tts_custom_voice_audio(text: str, voice_id: str, voice_type: str, api_key: str) -> dict:
+    """Custom-voice TTS as raw bytes: {'audio': WAV bytes, 'format': 'wav'} or {'error': ...}."""
+    try:
+        pcm_data = b"".join(stream_tts_custom_voice(text, voice_id, voice_type, api_key))
+    except TTSError as e:
+        print(f"[WS TTS] Returning error: {e}")
+        return {"error": str(e)}
+
+    # Convert PCM to WAV
+    return {"audio": pcm_to_wav(pcm_data, sample_rate=24000), "format": "wav"}
+
+
+def stream_tts_custom_voice(text: str, voice_id: str, voice_type: str, api_key: str):
+    """
+    Custom-voice TTS as a stream of raw 24 kHz 16-bit mono PCM chunks, yielded as the
+    realtime API's response.audio.delta events arrive. Sessions are reused across
+    utterances (see api/qwen_realtime.py). Raises TTSError on failure.
+    """
+    from api.qwen_realtime import get_session_pool, RealtimeSessionError, websocket
+
     if not text or not text.strip():
-        return {"error": "No text provided"}
+        raise TTSError("No text provided")
 
     if not api_key or not api_key.strip():
-        return {"error": "No API key provided"}
+        raise TTSError("No API key provided")
 
-    try:
-        import websocket
-        import ssl
-        import threading
-    except ImportError:
-        return {"error": "websocket-client not installed. Run: pip install websocket-client"}
+    if websocket is None:
+        raise TTSError("websocket-client not installed. Run: pip install websocket-client")
 
     # Choose model based on voice type
     if voice_type == "cloned":
@@ -510,122 +630,19 @@ def generate_tts_custom_voice(text: str, voice_id: str, voice_type: str, api_key
     else:
         model = "qwen3-tts-vd-realtime-2025-12-16"
 
-    # WebSocket URL with model as query param (vibevoice format)
-    ws_url = f"wss://dashscope-intl.aliyuncs.com/api-ws/v1/realtime?model={model}"
-    print(f"[WS TTS] Connecting to {ws_url} with voice_id={voice_id}")
+    print(f"[WS TTS] Speaking with model={model} voice_id={voice_id}")
 
-    audio_chunks = []
-    error_msg = [None]
-    done_event = threading.Event()
-    state = {"phase": "connecting"}
-
-    def on_message(ws, message):
-        try:
-            data = json.loads(message)
-            event_type = data.get("type", "")
-            print(f"[WS TTS] Received event: {event_type}")
-
-            if event_type == "session.created":
-                state["phase"] = "session_created"
-                print(f"[WS TTS] Session created, sending voice settings for: {voice_id}")
-                # Send session.update with voice settings
-                ws.send(json.dumps({
-                    "type": "session.update",
-                    "session": {
-                        "voice": voice_id,
-                        "response_format": "pcm",
-                        "sample_rate": 24000,
-                        "mode": "server_commit"
-                    }
-                }))
-
-            elif event_type == "session.updated":
-                state["phase"] = "session_updated"
-                # Send the text input
-                ws.send(json.dumps({
-                    "type": "input_text_buffer.append",
-                    "text": text
-                }))
-                # Commit the input
-                ws.send(json.dumps({
-                    "type": "input_text_buffer.commit"
-                }))
-
-            elif event_type == "response.audio.delta":
-                # Decode and collect audio chunk
-                audio_data = data.get("delta", "")
-                if audio_data:
-                    audio_chunks.append(base64.b64decode(audio_data))
-
-            elif event_type == "response.audio.done":
-                done_event.set()
-
-            elif event_type == "session.finished":
-                done_event.set()
-
-            elif event_type == "error":
-                error_info = data.get("error", {})
-                error_msg[0] = error_info.get("message", f"Unknown error: {data}")
-                done_event.set()
-
-        except Exception as e:
-            error_msg[0] = f"Message parse error: {str(e)}"
-            done_event.set()
-
-    def on_error(ws, error):
-        print(f"[WS TTS] Error: {error}")
-        error_msg[0] = str(error)
-        done_event.set()
-
-    def on_close(ws, close_status_code, close_msg):
-        print(f"[WS TTS] Connection closed: status={close_status_code}, msg={close_msg}")
-        done_event.set()
-
-    def on_open(ws):
-        print(f"[WS TTS] Connection opened")
-        state["phase"] = "connected"
-        # Wait for session.created message from server
-
-    # Create WebSocket with auth header
-    ws = websocket.WebSocketApp(
-        ws_url,
-        header=[f"Authorization: Bearer {api_key}"],
-        on_open=on_open,
-        on_message=on_message,
-        on_error=on_error,
-        on_close=on_close
-    )
-
-    # Run in thread with timeout
-    ws_thread = threading.Thread(
-        target=lambda: ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
-    )
-    ws_thread.daemon = True
-    ws_thread.start()
-
-    # Wait for completion (max 60 seconds)
-    done_event.wait(timeout=60)
-    print(f"[WS TTS] Wait completed. State: {state['phase']}, chunks: {len(audio_chunks)}, error: {error_msg[0]}")
-    ws.close()
-
-    if error_msg[0]:
-        print(f"[WS TTS] Returning error: {error_msg[0]}")
-        return {"error": f"TTS error: {error_msg[0]}"}
-
-    if not audio_chunks:
-        print(f"[WS TTS] No audio chunks received. State: {state['phase']}")
-        return {"error": f"No audio received. State: {state['phase']}"}
-
-    # Combine audio chunks (PCM data)
-    pcm_data = b"".join(audio_chunks)
-
-    # Convert PCM to WAV
-    wav_data = pcm_to_wav(pcm_data, sample_rate=24000)
-
-    return {
-        "audio_base64": base64.b64encode(wav_data).decode('utf-8'),
-        "format": "wav"
-    }
+    chunks = 0
+    try:
+        for pcm in get_session_pool().utterance(api_key, model, voice_id, text):
+            chunks += 1
+            yield pcm
+    except RealtimeSessionError as e:
+        raise TTSError(f"TTS error: {e}")
+
+    if not chunks:
+        print("[WS TTS] No audio chunks received")
+        raise TTSError("No audio received")
 
 
 # For testing
@@ -0,0 +1,107 @@
+"""
+Table-driven request router for IGCSE Geography Guru
+Routes are registered per HTTP method. Static paths resolve with one dict lookup.
+Paths with {param} segments are compiled into a segment trie, so a request is
+matched by walking its segments once and the parameters come out extracted.
+"""
+
+
+class _Node:
+    __slots__ = ('children', 'param', 'param_node', 'target')
+
+    def __init__(self):
+        self.children = {}      # literal segment -> _Node
+        self.param = None       # parameter name for a {param} segment
+        self.param_node = None  # _Node after a {param} segment
+        self.target = None
+
+
+class Router:
+    """Method-aware router: a static-path dict plus a segment trie for parameterized paths.
+
+    Literal segments win over parameters at every level, so '/case-studies/topic/{topic_id}'
+    and '/case-studies/{case_id}' can be registered in any order.
+    """
+
+    def __init__(self):
+        self._static = {}  # method -> {path: target}
+        self._tries = {}   # method -> root _Node
+
+    def add(self, method, pattern, target):
+        if '{' not in pattern:
+            self._static.setdefault(method, {})[pattern] = target
+            return
+        node = self._tries.setdefault(method, _Node())
+        for segment in pattern.strip('/').split('/'):
+            if segment.startswith('{') and segment.endswith('}'):
+                name = segment[1:-1]
+                if node.param_node is None:
+                    node.param, node.param_node = name, _Node()
+                elif node.param != name:
+                    raise ValueError(f"Conflicting parameter names {{{node.param}}} and {{{name}}} in {pattern}")
+                node = node.param_node
+            else:
+                node = node.children.setdefault(segment, _Node())
+        node.target = target
+
+    def route(self, pattern, methods=('GET',), static=False):
+        """Decorator registering a function for one path pattern and one or more methods.
+        static=True marks responses that only change with the curriculum data."""
+        def register(fn):
+            for method in methods:
+                self.add(method, pattern, fn)
+            if static:
+                fn.static = True
+            return fn
+        return register
+
+    def get(self, pattern, static=False):
+        return self.route(pattern, ('GET',), static)
+
+    def post(self, pattern):
+        return self.route(pattern, ('POST',))
+
+    def match(self, method, path):
+        """Return (target, params) for a request path, or (None, None) if nothing matches."""
+        target = self._static.get(method, {}).get(path)
+        if target is not None:
+            return target, {}
+        root = self._tries.get(method)
+        if root is None:
+            return None, None
+        params = {}
+        node = self._walk(root, path.strip('/').split('/'), 0, params)
+        return (node.target, params) if node is not None else (None, None)
+
+    def _walk(self, node, segments, i, params):
+        if i == len(segments):
+            return node if node.target is not None else None
+        segment = segments[i]
+        child = node.children.get(segment)
+        if child is not None:
+            found = self._walk(child, segments, i + 1, params)
+            if found is not None:
+                return found
+        if node.param_node is not None and segment:
+            params[node.param] = segment
+            found = self._walk(node.param_node, segments, i + 1, params)
+            if found is not None:
+                return found
+            del params[node.param]
+        return None
+
+    def routes(self):
+        """Registered (method, pattern-or-path) pairs, for diagnostics and benchmarks."""
+        listed = [(method, path) for method, paths in self._static.items() for path in paths]
+
+        def collect(method, node, prefix):
+            if node.target is not None:
+                listed.append((method, prefix or '/'))
+            for segment, child in node.children.items():
+                collect(method, child, f"{prefix}/{segment}")
+            if node.param_node is not None:
+                collect(method, node.param_node, f"{prefix}/{{{node.param}}}")
+
+        for method, root in self._tries.items():
+            collect(method, root, '')
+        return listed
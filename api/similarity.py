@@ -0,0 +1,84 @@
+"""
+Vectorized similarity engine for IGCSE Geography Guru RAG search
+Embeddings are held as one contiguous float32 matrix with precomputed norms,
+so scoring a corpus is a single matrix-vector product.
+"""
+
+import json
+
+import numpy as np
+
+
+def parse_embedding(value):
+    """Return an embedding as a list/array, parsing PostgREST's string form if needed."""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+    return value
+
+
+class EmbeddingMatrix:
+    """Row-major float32 matrix of embeddings with cached L2 norms."""
+
+    def __init__(self, vectors, dim=None):
+        if isinstance(vectors, np.ndarray):
+            matrix = vectors
+        elif vectors:
+            matrix = np.asarray(vectors, dtype=np.float32)
+        else:
+            matrix = np.zeros((0, dim or 0), dtype=np.float32)
+        if matrix.dtype != np.float32:
+            matrix = matrix.astype(np.float32)
+        self.matrix = matrix
+        self.norms = np.linalg.norm(matrix, axis=1) if len(matrix) else np.zeros(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    def cosine(self, query):
+        """Cosine similarity of `query` against every row (0 where either norm is 0)."""
+        if not len(self.matrix):
+            return np.zeros(0, dtype=np.float32)
+        q = np.asarray(query, dtype=np.float32)
+        if q.shape != (self.dim,):
+            return np.zeros(len(self.matrix), dtype=np.float32)
+        q_norm = float(np.linalg.norm(q))
+        if q_norm == 0:
+            return np.zeros(len(self.matrix), dtype=np.float32)
+        dots = self.matrix @ q
+        denom = self.norms * q_norm
+        return np.divide(dots, denom, out=np.zeros_like(dots), where=denom > 0)
+
+    @classmethod
+    def from_rows(cls, rows, field='embedding', dim=None):
+        """Build a matrix from row dicts, skipping rows with missing or malformed embeddings.
+        Returns (matrix, kept_rows) where kept_rows[i] is the row behind matrix row i."""
+        vectors, kept = [], []
+        for row in rows:
+            emb = parse_embedding(row.get(field))
+            if not emb:
+                continue
+            if dim is None:
+                dim = len(emb)
+            if len(emb) != dim:
+                continue
+            vectors.append(emb)
+            kept.append(row)
+        return cls(vectors, dim=dim), kept
+
+
+def top_k(scores, k):
+    """Indexes of the k highest scores, best first, using a partial sort."""
+    n = len(scores)
+    if n == 0 or k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind='stable')
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind='stable')]
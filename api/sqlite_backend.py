@@ -0,0 +1,473 @@
+"""
+Local SQLite storage backend for IGCSE Geography Guru
+Stands in for Supabase PostgREST so the API can run offline and be load tested
+without network latency. Enable it with STORAGE_BACKEND=sqlite. The database
+(SQLITE_DB_PATH, in memory by default) is bootstrapped from the repo's migrate_*.sql
+files, which are translated from Postgres on the fly. Tables that the migrations
+never create (topics, users, ai_settings, ...) are created from the first INSERT.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import urllib.parse
+import uuid
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SQLITE_DB_PATH = os.environ.get('SQLITE_DB_PATH', ':memory:')
+SQLITE_MAX_ROWS = int(os.environ.get('SQLITE_MAX_ROWS', 1000))  # PostgREST's default max-rows
+
+# Migrations that produce the current schema, in order. The older migrate_*.sql
+# files (v1-v3, migrate_test_yourself, the first v5) are superseded by these.
+DEFAULT_MIGRATIONS = [
+    'migrate_rag_setup.sql',
+    'migrate_full_content_v4.sql',
+    'migrate_teacher_definitions.sql',
+    'migrate_upgrade_v5_fixed.sql',
+]
+SQLITE_MIGRATIONS = [name.strip() for name in os.environ.get('SQLITE_MIGRATIONS', '').split(',') if name.strip()] \
+    or DEFAULT_MIGRATIONS
+
+IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Postgres-only statements with no local equivalent
+SKIPPED_STATEMENT_RE = re.compile(
+    r'^(CREATE\s+EXTENSION|CREATE\s+POLICY|DROP\s+POLICY|CREATE\s+(OR\s+REPLACE\s+)?FUNCTION|'
+    r'ALTER\s+SEQUENCE|ALTER\s+TABLE\s+\S+\s+(ENABLE|DISABLE)\s+ROW\s+LEVEL\s+SECURITY|'
+    r'CREATE\s+INDEX\s+.*\bUSING\b|SELECT|GRANT|REVOKE|COMMENT|BEGIN|COMMIT|DO)\b',
+    re.IGNORECASE | re.DOTALL)
+
+# Column type rewrites applied to CREATE TABLE bodies
+TYPE_REWRITES = [
+    (re.compile(r'\bSERIAL\s+PRIMARY\s+KEY\b', re.I), 'INTEGER PRIMARY KEY'),
+    (re.compile(r'\bREFERENCES\s+[\w.]+\s*(\([^)]*\))?(\s+ON\s+DELETE\s+(CASCADE|SET\s+NULL|RESTRICT))?', re.I), ''),
+    (re.compile(r'\b\w+\[\]', re.I), 'JSON'),
+    (re.compile(r'\bJSONB\b', re.I), 'JSON'),
+    (re.compile(r'\bUUID\b', re.I), 'TEXT'),
+    (re.compile(r'\bvector\s*\(\d+\)', re.I), 'TEXT'),  # PostgREST returns vectors as text too
+    (re.compile(r'\bDEFAULT\s+(gen_random_uuid|now)\(\)', re.I), r'DEFAULT (\1())'),
+]
+
+INSERT_COLUMNS_RE = re.compile(r'^INSERT\s+INTO\s+(\w+)\s*\(([^)]*)\)', re.I)
+TRUNCATE_RE = re.compile(r'^TRUNCATE\s+(TABLE\s+)?(.+?)(\s+RESTART\s+IDENTITY)?(\s+CASCADE)?$', re.I | re.S)
+
+FILTER_OPERATORS = {'eq': '=', 'neq': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+
+class BackendError(Exception):
+    """A request the local backend rejects; `status` mirrors the PostgREST HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+def split_statements(sql):
+    """Split a SQL script on top-level semicolons, dropping comments.
+    Quoted strings, quoted identifiers and $$ function bodies are kept intact."""
+    statements, current = [], []
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch == '-' and sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = n if end == -1 else end
+            continue
+        if ch == '/' and sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            continue
+        if ch in ("'", '"'):
+            end = i + 1
+            while end < n:
+                if sql[end] == ch:
+                    if end + 1 < n and sql[end + 1] == ch:  # doubled quote escape
+                        end += 2
+                        continue
+                    break
+                end += 1
+            current.append(sql[i:end + 1])
+            i = end + 1
+            continue
+        if ch == '$' and sql.startswith('$$', i):
+            end = sql.find('$$', i + 2)
+            end = n if end == -1 else end + 2
+            current.append(sql[i:end])
+            i = end
+            continue
+        if ch == ';':
+            statement = ''.join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+        else:
+            current.append(ch)
+        i += 1
+    statement = ''.join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def rewrite_arrays(sql):
+    """Rewrite Postgres ARRAY[...] literals (outside strings) as SQLite json_array(...)."""
+    out, i, n, depth = [], 0, len(sql), []
+    while i < n:
+        ch = sql[i]
+        if ch == "'":
+            end = i + 1
+            while end < n:
+                if sql[end] == "'":
+                    if end + 1 < n and sql[end + 1] == "'":
+                        end += 2
+                        continue
+                    break
+                end += 1
+            out.append(sql[i:end + 1])
+            i = end + 1
+            continue
+        if sql[i:i + 6].upper() == 'ARRAY[' and (i == 0 or not (sql[i - 1].isalnum() or sql[i - 1] == '_')):
+            out.append('json_array(')
+            depth.append(True)
+            i += 6
+            continue
+        if ch == '[':
+            depth.append(False)
+        elif ch == ']' and depth:
+            if depth.pop():
+                out.append(')')
+                i += 1
+                continue
+        out.append(ch)
+        i += 1
+    return ''.join(out)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _quote(name):
+    if not IDENTIFIER_RE.match(name or ''):
+        raise BackendError(400, f"invalid identifier: {name!r}")
+    return f'"{name}"'
+
+
+def _infer_type(value):
+    if isinstance(value, bool):
+        return 'BOOLEAN'
+    if isinstance(value, int):
+        return 'INTEGER'
+    if isinstance(value, float):
+        return 'REAL'
+    if isinstance(value, (list, dict)):
+        return 'JSON'
+    if isinstance(value, str):
+        return 'TEXT'
+    return ''
+
+
+class SQLiteBackend:
+    """PostgREST-shaped data access on a single SQLite connection.
+
+    Filters follow the grammar the handler uses: column=eq.value (also neq, gt,
+    gte, lt, lte, is.null and in.(a,b)), select=col1,col2, order=col[.desc],...,
+    limit and offset. Writes return the same shapes as the supabase_* helpers.
+    """
+
+    def __init__(self, path=SQLITE_DB_PATH, migrations=None, max_rows=SQLITE_MAX_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.create_function('now', 0, _now)
+        self._db.create_function('gen_random_uuid', 0, lambda: str(uuid.uuid4()))
+        if path != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+        self._lock = threading.RLock()
+        self._columns = {}  # table -> {column: declared type}
+        self.bootstrap(SQLITE_MIGRATIONS if migrations is None else migrations)
+
+    # Schema
+
+    def columns(self, table):
+        """Declared column types for a table ({} if it does not exist)."""
+        cols = self._columns.get(table)
+        if cols is None:
+            rows = self._db.execute(f'PRAGMA table_info({_quote(table)})').fetchall()
+            cols = {row[1]: (row[2] or '').upper() for row in rows}
+            if cols:
+                self._columns[table] = cols
+        return cols
+
+    def _primary_key(self, table):
+        rows = self._db.execute(f'PRAGMA table_info({_quote(table)})').fetchall()
+        keys = [row[1] for row in rows if row[5]]
+        return keys[0] if len(keys) == 1 else None
+
+    def _ensure_columns(self, table, types):
+        """Create the table, or add missing columns, for {column: type}."""
+        cols = self.columns(table)
+        if not cols:
+            defs = ['"id" INTEGER PRIMARY KEY'] + [f'{_quote(c)} {t}'.strip() for c, t in types.items() if c != 'id']
+            self._db.execute(f'CREATE TABLE {_quote(table)} ({", ".join(defs)})')
+        else:
+            for column, col_type in types.items():
+                if column not in cols:
+                    self._db.execute(f'ALTER TABLE {_quote(table)} ADD COLUMN {_quote(column)} {col_type}'.strip())
+        self._columns.pop(table, None)
+
+    # Migrations
+
+    def bootstrap(self, migrations):
+        """Apply each migration file once; applied names are recorded in _migrations."""
+        with self._lock:
+            self._db.execute('CREATE TABLE IF NOT EXISTS _migrations (name TEXT PRIMARY KEY, applied_at TEXT)')
+            applied = {row[0] for row in self._db.execute('SELECT name FROM _migrations')}
+            for name in migrations:
+                if name in applied:
+                    continue
+                path = name if os.path.isabs(name) else os.path.join(REPO_ROOT, name)
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        script = f.read()
+                except OSError as e:
+                    print(f"[SQLite Backend] Migration {name} not found: {e}")
+                    continue
+                executed, skipped, failed = self.run_script(script, name)
+                self._db.execute('INSERT INTO _migrations (name, applied_at) VALUES (?, ?)', (name, _now()))
+                self._db.commit()
+                print(f"[SQLite Backend] Applied {name}: {executed} statements, {skipped} skipped, {failed} failed")
+
+    def translate(self, statement):
+        """Translate one Postgres statement into zero or more SQLite statements."""
+        if SKIPPED_STATEMENT_RE.match(statement):
+            return []
+        upper = statement[:32].upper()
+        if upper.startswith('TRUNCATE'):
+            match = TRUNCATE_RE.match(statement)
+            tables = [t.strip() for t in match.group(2).split(',')] if match else []
+            return [f'DELETE FROM {_quote(t)}' for t in tables if self.columns(t)]
+        if upper.startswith('DROP TABLE'):
+            return [re.sub(r'\s+CASCADE\s*$', '', statement, flags=re.I)]
+        if upper.startswith('CREATE TABLE'):
+            for pattern, replacement in TYPE_REWRITES:
+                statement = pattern.sub(replacement, statement)
+            return [statement]
+        if upper.startswith('INSERT'):
+            match = INSERT_COLUMNS_RE.match(statement)
+            if match and not self.columns(match.group(1)):
+                self._ensure_columns(match.group(1), {c.strip(): '' for c in match.group(2).split(',')})
+            return [rewrite_arrays(statement)]
+        return [statement]
+
+    def run_script(self, script, name='script'):
+        executed = skipped = failed = 0
+        for statement in split_statements(script):
+            translated = self.translate(statement)
+            if not translated:
+                skipped += 1
+            for sql in translated:
+                try:
+                    self._db.execute(sql)
+                    executed += 1
+                except sqlite3.Error as e:
+                    failed += 1
+                    print(f"[SQLite Backend] {name}: {e} in: {sql[:80]}")
+                if sql.lstrip().upper().startswith(('CREATE', 'DROP', 'ALTER')):
+                    self._columns.clear()
+        self._db.commit()
+        return executed, skipped, failed
+
+    # Query building
+
+    def _bind(self, table, column, value):
+        """Adapt a filter value. Untyped (inferred) columns have no affinity, so numeric
+        strings are bound as integers to match rows inserted with integer literals."""
+        if self.columns(table).get(column, '') == '' and re.fullmatch(r'-?\d+', value):
+            return int(value)
+        return value
+
+    def _where(self, table, filters):
+        clauses, args = [], []
+        cols = self.columns(table)
+        for column, expr in (filters or {}).items():
+            if column in ('select', 'order', 'limit', 'offset'):
+                continue
+            if column not in cols:
+                raise BackendError(400, f"column {table}.{column} does not exist")
+            op, _, value = str(expr).partition('.')
+            value = urllib.parse.unquote(value)
+            if op in FILTER_OPERATORS:
+                clauses.append(f'{_quote(column)} {FILTER_OPERATORS[op]} ?')
+                args.append(self._bind(table, column, value))
+            elif op == 'is':
+                keyword = {'null': 'NULL', 'true': '1', 'false': '0'}.get(value.lower())
+                if keyword is None:
+                    raise BackendError(400, f"unsupported is value: {value}")
+                clauses.append(f'{_quote(column)} IS {keyword}')
+            elif op == 'in':
+                items = [v.strip().strip('"') for v in value.strip('()').split(',') if v.strip()]
+                if not items:
+                    clauses.append('0')
+                    continue
+                clauses.append(f'{_quote(column)} IN ({", ".join("?" * len(items))})')
+                args.extend(self._bind(table, column, v) for v in items)
+            else:
+                raise BackendError(400, f"unsupported filter operator: {op}")
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', args
+
+    def _order(self, order):
+        terms = []
+        for term in order.split(','):
+            parts = term.strip().split('.')
+            direction = 'DESC' if 'desc' in parts[1:] else 'ASC'
+            nulls = 'FIRST' if direction == 'DESC' else 'LAST'  # Postgres defaults
+            if 'nullsfirst' in parts[1:]:
+                nulls = 'FIRST'
+            elif 'nullslast' in parts[1:]:
+                nulls = 'LAST'
+            terms.append(f'{_quote(parts[0])} {direction} NULLS {nulls}')
+        return ' ORDER BY ' + ', '.join(terms)
+
+    def _decode(self, table, cursor):
+        names = [d[0] for d in cursor.description]
+        types = self.columns(table)
+        rows = []
+        for values in cursor.fetchall():
+            row = {}
+            for name, value in zip(names, values):
+                col_type = types.get(name, '')
+                if value is not None and col_type == 'JSON' and isinstance(value, str):
+                    try:
+                        value = json.loads(value)
+                    except ValueError:
+                        pass
+                elif value is not None and col_type == 'BOOLEAN':
+                    value = bool(value)
+                row[name] = value
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, (list, dict)):
+            return json.dumps(value)
+        if isinstance(value, bool):
+            return int(value)
+        return value
+
+    # PostgREST operations
+
+    def get(self, table, params=None):
+        """Rows matching PostgREST-style params; raises BackendError or sqlite3.Error."""
+        params = params or {}
+        with self._lock:
+            if not self.columns(table):
+                raise BackendError(404, f"relation {table} does not exist")
+            select = params.get('select', '*')
+            columns = '*' if select == '*' else ', '.join(_quote(c.strip()) for c in select.split(','))
+            where, args = self._where(table, params)
+            sql = f'SELECT {columns} FROM {_quote(table)}{where}'
+            if params.get('order'):
+                sql += self._order(params['order'])
+            limit = min(int(params.get('limit', self.max_rows)), self.max_rows)
+            sql += ' LIMIT ? OFFSET ?'
+            args += [limit, int(params.get('offset', 0))]
+            return self._decode(table, self._db.execute(sql, args))
+
+    def count(self, table, filters=None):
+        with self._lock:
+            if not self.columns(table):
+                raise BackendError(404, f"relation {table} does not exist")
+            where, args = self._where(table, filters)
+            return self._db.execute(f'SELECT COUNT(*) FROM {_quote(table)}{where}', args).fetchone()[0]
+
+    def _write(self, fn):
+        """Run a write in a transaction, mapping errors to the PostgREST error dicts."""
+        with self._lock:
+            try:
+                with self._db:
+                    return fn()
+            except BackendError as e:
+                return {"error": str(e)}
+            except sqlite3.IntegrityError as e:
+                return {"error": f"HTTP 409: {e}"}
+            except sqlite3.Error as e:
+                return {"error": f"HTTP 400: {e}"}
+
+    def _insert(self, table, data, returning, conflict_update):
+        rows = data if isinstance(data, list) else [data]
+        types = {}
+        for row in rows:
+            for column, value in row.items():
+                if types.get(column, '') == '':
+                    types[column] = _infer_type(value)
+        cols = self.columns(table)
+        if not cols or any(c not in cols for c in types):
+            self._ensure_columns(table, types)
+        pk = self._primary_key(table)
+        inserted = []
+        for row in rows:
+            names = list(row)
+            sql = (f'INSERT INTO {_quote(table)} ({", ".join(_quote(c) for c in names)}) '
+                   f'VALUES ({", ".join("?" * len(names))})')
+            updates = [c for c in names if c != pk]
+            if conflict_update and pk in row and updates:
+                sql += f' ON CONFLICT({_quote(pk)}) DO UPDATE SET ' + \
+                       ', '.join(f'{_quote(c)} = excluded.{_quote(c)}' for c in updates)
+            cursor = self._db.execute(sql + ' RETURNING *', [self._encode(row[c]) for c in names])
+            if returning == 'representation':
+                inserted.extend(self._decode(table, cursor))
+            else:
+                cursor.fetchall()
+        return inserted
+
+    def post(self, table, data, returning='representation'):
+        return self._write(lambda: self._insert(table, data, returning, conflict_update=False))
+
+    def upsert(self, table, data):
+        return self._write(lambda: self._insert(table, data, 'representation', conflict_update=True))
+
+    def patch(self, table, data, filters):
+        def update():
+            types = {c: _infer_type(v) for c, v in data.items()}
+            if any(c not in self.columns(table) for c in types):
+                self._ensure_columns(table, types)
+            where, args = self._where(table, filters)
+            assignments = ', '.join(f'{_quote(c)} = ?' for c in data)
+            cursor = self._db.execute(f'UPDATE {_quote(table)} SET {assignments}{where} RETURNING *',
+                                      [self._encode(v) for v in data.values()] + args)
+            return self._decode(table, cursor)
+        return self._write(update)
+
+    def delete(self, table, filters):
+        def remove():
+            if not self.columns(table):
+                raise BackendError(404, f"relation {table} does not exist")
+            where, args = self._where(table, filters)
+            self._db.execute(f'DELETE FROM {_quote(table)}{where}', args)
+            return {"success": True}
+        return self._write(remove)
+
+    def rpc(self, function_name, params):
+        """Postgres functions are not translated; callers fall back to local search."""
+        return {"error": f"HTTP 404: function {function_name} is not available in the SQLite backend"}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_sqlite_backend():
+    """Shared backend, created (and bootstrapped) on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = SQLiteBackend()
+        return _backend
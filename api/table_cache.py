@@ -0,0 +1,118 @@
+"""
+Read-through TTL cache for static curriculum tables
+The curriculum tables are loaded by the migrate_*.sql scripts and rarely change,
+so supabase_get serves them from memory for a per-table TTL. The cache is capped
+by the approximate JSON size of its entries. Call POST /cache/invalidate (with the
+X-Admin-Token header matching CACHE_ADMIN_TOKEN) after running a migration.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = float(os.environ.get('TABLE_CACHE_TTL', 600))
+
+# Allowlist of cacheable tables -> TTL in seconds
+CACHED_TABLE_TTLS = {
+    'topics': DEFAULT_TTL,
+    'definitions': DEFAULT_TTL,
+    'teacher_definitions': DEFAULT_TTL,
+    'test_yourself': DEFAULT_TTL,
+    'tips': DEFAULT_TTL,
+    'common_errors': DEFAULT_TTL,
+    'learning_objectives': DEFAULT_TTL,
+    'sample_answers': DEFAULT_TTL,
+    'case_studies': DEFAULT_TTL,
+    'exam_questions': DEFAULT_TTL,
+}
+
+TABLE_CACHE_MAX_BYTES = int(os.environ.get('TABLE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+MISS = object()
+
+
+def _key(table, params):
+    return (table, tuple(sorted((params or {}).items())))
+
+
+class TableCache:
+    """LRU of query results for allowlisted tables, bounded by approximate size.
+
+    Cached rows are shared between requests - callers must not mutate them.
+    """
+
+    def __init__(self, ttls=None, max_bytes=TABLE_CACHE_MAX_BYTES):
+        self.ttls = dict(CACHED_TABLE_TTLS if ttls is None else ttls)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires, size, rows)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        self.generation = 0  # bumped on every invalidation, so derived caches can tell
+
+    def is_cached_table(self, table):
+        return table in self.ttls
+
+    def get(self, table, params):
+        key = _key(table, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self._drop_locked(key)
+                self.stats["misses"] += 1
+                return MISS
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[2]
+
+    def put(self, table, params, rows):
+        size = len(json.dumps(rows, separators=(',', ':')))
+        if size > self.max_bytes:
+            return
+        key = _key(table, params)
+        with self._lock:
+            if key in self._entries:
+                self._drop_locked(key)
+            self._entries[key] = (time.monotonic() + self.ttls[table], size, rows)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop_locked(oldest)
+                self.stats["evictions"] += 1
+
+    def _drop_locked(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, tables=None):
+        """Drop cached results for the given tables (all tables if None); returns entries dropped."""
+        if tables is not None and not any(t in self.ttls for t in tables):
+            return 0
+        with self._lock:
+            keys = [k for k in self._entries if tables is None or k[0] in tables]
+            for key in keys:
+                self._drop_locked(key)
+            self.stats["invalidations"] += 1
+            self.generation += 1
+            return len(keys)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["max_bytes"] = self.max_bytes
+            stats["generation"] = self.generation
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0
+        return stats
+
+
+_cache = TableCache()
+
+
+def get_table_cache():
+    return _cache
@@ -0,0 +1,214 @@
+"""
+Content-addressed TTS audio cache for IGCSE Geography Guru
+Synthesized clips are keyed by (provider, voice, voice_type, normalized text) and
+kept in three tiers: an in-memory LRU, a size-capped directory on local disk
+(/tmp survives between warm invocations on Vercel), and optionally a Supabase
+storage bucket shared by every instance. A hit in a lower tier is promoted to
+the tiers above it. Clips never go stale - the same text in the same voice
+always sounds the same - so there is no TTL, only size-based eviction.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+
+TTS_CACHE_MEMORY_BYTES = int(os.environ.get('TTS_CACHE_MEMORY_BYTES', 32 * 1024 * 1024))
+TTS_CACHE_DIR = os.environ.get('TTS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'igcse-tts-cache'))
+TTS_CACHE_DISK_BYTES = int(os.environ.get('TTS_CACHE_DISK_BYTES', 256 * 1024 * 1024))
+# Streamed clips longer than this are relayed but not cached, keeping stream memory bounded
+TTS_CACHE_MAX_CLIP_BYTES = int(os.environ.get('TTS_CACHE_MAX_CLIP_BYTES', 8 * 1024 * 1024))
+# Supabase storage bucket for the shared tier; empty disables it
+TTS_CACHE_BUCKET = os.environ.get('TTS_CACHE_BUCKET', '')
+
+
+def normalize_text(text):
+    """Unicode NFC with whitespace runs collapsed, so trivially different strings share a clip."""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def tts_cache_key(provider, voice, voice_type, text):
+    identity = json.dumps([provider, voice, voice_type or '', normalize_text(text)], ensure_ascii=False)
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    """Memory LRU -> disk directory -> optional blob store, all keyed by tts_cache_key()."""
+
+    def __init__(self, memory_bytes=TTS_CACHE_MEMORY_BYTES, directory=TTS_CACHE_DIR,
+                 disk_bytes=TTS_CACHE_DISK_BYTES):
+        self.memory_bytes = memory_bytes
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()  # (key, format) -> audio bytes
+        self._memory_used = 0
+        self._disk_used = None  # scanned on first disk write
+        self._blob_get = None
+        self._blob_put = None
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "blob_hits": 0, "misses": 0,
+                      "stores": 0, "disk_evictions": 0, "errors": 0}
+
+    def attach_blob_store(self, get, put):
+        """Enable the shared tier: get(name) -> bytes or None, put(name, audio, content_type)."""
+        self._blob_get, self._blob_put = get, put
+
+    def get(self, key, audio_format):
+        """Cached audio bytes for a key, or None."""
+        audio = self._memory_get(key, audio_format)
+        if audio is not None:
+            self._count("memory_hits")
+            return audio
+        audio = self._disk_get(key, audio_format)
+        if audio is not None:
+            self._count("disk_hits")
+            self._memory_put(key, audio_format, audio)
+            return audio
+        if self._blob_get is not None:
+            try:
+                audio = self._blob_get(f"{key}.{audio_format}")
+            except Exception as e:
+                print(f"[TTS Cache] Blob read failed: {e}")
+                self._count("errors")
+                audio = None
+            if audio:
+                self._count("blob_hits")
+                self._memory_put(key, audio_format, audio)
+                self._disk_put(key, audio_format, audio)
+                return audio
+        self._count("misses")
+        return None
+
+    def put(self, key, audio_format, audio, content_type=None):
+        """Store a freshly synthesized clip in every tier (the blob upload runs in the background)."""
+        if not audio:
+            return
+        self._count("stores")
+        self._memory_put(key, audio_format, audio)
+        self._disk_put(key, audio_format, audio)
+        if self._blob_put is not None:
+            threading.Thread(target=self._blob_upload, daemon=True,
+                             args=(f"{key}.{audio_format}", audio, content_type)).start()
+
+    def _blob_upload(self, name, audio, content_type):
+        try:
+            self._blob_put(name, audio, content_type or 'application/octet-stream')
+        except Exception as e:
+            print(f"[TTS Cache] Blob upload failed: {e}")
+            self._count("errors")
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    # Memory tier
+
+    def _memory_get(self, key, audio_format):
+        with self._lock:
+            audio = self._memory.get((key, audio_format))
+            if audio is not None:
+                self._memory.move_to_end((key, audio_format))
+            return audio
+
+    def _memory_put(self, key, audio_format, audio):
+        if len(audio) > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop((key, audio_format), None)
+            if previous is not None:
+                self._memory_used -= len(previous)
+            self._memory[(key, audio_format)] = audio
+            self._memory_used += len(audio)
+            while self._memory_used > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted)
+
+    # Disk tier - one file per clip, sharded by key prefix; mtime doubles as LRU recency
+
+    def _path(self, key, audio_format):
+        return os.path.join(self.directory, key[:2], f"{key}.{audio_format}")
+
+    def _disk_get(self, key, audio_format):
+        path = self._path(key, audio_format)
+        try:
+            with open(path, 'rb') as f:
+                audio = f.read()
+            os.utime(path)
+            return audio
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"[TTS Cache] Disk read failed: {e}")
+            self._count("errors")
+            return None
+
+    def _disk_files(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def _disk_put(self, key, audio_format, audio):
+        if len(audio) > self.disk_bytes:
+            return
+        path = self._path(key, audio_format)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(audio)
+            with self._disk_lock:
+                if self._disk_used is None:
+                    self._disk_used = sum(size for _, size, p in self._disk_files() if p != tmp_path)
+                existed = os.path.exists(path)
+                os.replace(tmp_path, path)
+                if not existed:
+                    self._disk_used += len(audio)
+                if self._disk_used > self.disk_bytes:
+                    self._evict_disk_locked()
+        except OSError as e:
+            print(f"[TTS Cache] Disk write failed: {e}")
+            self._count("errors")
+
+    def _evict_disk_locked(self):
+        # Drop least recently used files down to 90% of the cap, so eviction is not per write
+        files = sorted(self._disk_files())
+        self._disk_used = sum(size for _, size, _ in files)
+        target = self.disk_bytes * 0.9
+        for _, size, path in files:
+            if self._disk_used <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._disk_used -= size
+            self._count("disk_evictions")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_used
+        stats["disk_bytes"] = self._disk_used
+        stats["disk_dir"] = self.directory
+        stats["blob_tier"] = self._blob_get is not None
+        return stats
+
+
+_cache = TTSCache()
+
+
+def get_tts_cache():
+    return _cache
@@ -0,0 +1,95 @@
+"""
+Segmented TTS for IGCSE Geography Guru
+Long text is split on sentence boundaries into segments of at most
+TTS_SEGMENT_CHARS, the segments are synthesized concurrently on a bounded
+worker pool, and the clips are stitched back together in order: WAV segments
+by concatenating their PCM samples, MP3 segments by concatenating frames.
+A full sample answer then takes about as long as its slowest segment.
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from api.qwen_tts import pcm_to_wav, wav_pcm
+
+TTS_SEGMENT_CHARS = int(os.environ.get('TTS_SEGMENT_CHARS', 500))
+TTS_SEGMENT_WORKERS = int(os.environ.get('TTS_SEGMENT_WORKERS', 4))
+# Upper bound on text read aloud in one request
+TTS_MAX_CHARS = int(os.environ.get('TTS_MAX_CHARS', 5000))
+
+
+class SegmentError(Exception):
+    """A segment failed to synthesize; the message is the provider's error."""
+
+
+_SENTENCE_END = re.compile(r'(?<=[.!?;:])\s+|\n+')
+_CLAUSE_END = re.compile(r'(?<=[,)])\s+')
+
+
+def _pieces(text, limit):
+    """Sentences of text, with any sentence longer than limit broken at clauses, then words."""
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) <= limit:
+            yield sentence
+            continue
+        for clause in _CLAUSE_END.split(sentence):
+            while len(clause) > limit:
+                cut = clause.rfind(' ', 0, limit)
+                cut = cut if cut > 0 else limit
+                yield clause[:cut].strip()
+                clause = clause[cut:].strip()
+            if clause:
+                yield clause
+
+
+def split_segments(text, limit=TTS_SEGMENT_CHARS):
+    """Pack consecutive sentences into segments of at most `limit` characters."""
+    segments, current = [], ''
+    for piece in _pieces(text, limit):
+        if current and len(current) + 1 + len(piece) > limit:
+            segments.append(current)
+            current = piece
+        else:
+            current = f"{current} {piece}" if current else piece
+    if current:
+        segments.append(current)
+    return segments
+
+
+def synthesize_segments(segments, synthesize, workers=TTS_SEGMENT_WORKERS):
+    """Run synthesize(segment) -> bytes for every segment concurrently; results keep segment order.
+    The first exception raised by any segment propagates."""
+    if len(segments) == 1:
+        return [synthesize(segments[0])]
+    with ThreadPoolExecutor(max_workers=min(workers, len(segments)), thread_name_prefix='tts-segment') as pool:
+        return list(pool.map(synthesize, segments))
+
+
+def stitch_wav(clips):
+    """One WAV from several mono 16-bit WAV clips of the same sample rate."""
+    if len(clips) == 1:
+        return clips[0]
+    decoded = [wav_pcm(clip) for clip in clips]
+    return pcm_to_wav(b''.join(pcm for pcm, _ in decoded), sample_rate=decoded[0][1])
+
+
+def _strip_id3(clip):
+    if clip[:3] == b'ID3' and len(clip) >= 10:
+        # ID3v2 size is a 28-bit synchsafe integer
+        size = (clip[6] << 21) | (clip[7] << 14) | (clip[8] << 7) | clip[9]
+        clip = clip[10 + size:]
+    if len(clip) >= 128 and clip[-128:-125] == b'TAG':
+        clip = clip[:-128]
+    return clip
+
+
+def stitch_mp3(clips):
+    """One MP3 stream from several clips: MPEG frames are self-delimiting, so the frames are
+    concatenated once any ID3 tags between them are removed."""
+    if len(clips) == 1:
+        return clips[0]
+    return b''.join(_strip_id3(clip) for clip in clips)
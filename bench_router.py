@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for request dispatch
+Times the compiled router (api/router.py) against the if-chain it replaced, for a
+sample path per route. The if-chain is reproduced below as its ordered predicates.
+Usage: python bench_router.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from api.index import routes
+
+# The old do_GET / do_POST conditions, in their original order
+LEGACY_GET = [
+    lambda p: p in ['/', '/health'],
+    lambda p: p == '/auth/me',
+    lambda p: p == '/topics',
+    lambda p: p.startswith('/topics/') and not any(x in p for x in ['/flashcards', '/quiz', '/test', '/teacher']),
+    lambda p: p == '/teacher-definitions',
+    lambda p: p.startswith('/teacher-definitions/'),
+    lambda p: '/teacher-flashcards' in p,
+    lambda p: '/flashcards' in p,
+    lambda p: '/quiz' in p,
+    lambda p: '/test-yourself' in p,
+    lambda p: '/ai/settings' in p,
+    lambda p: '/ai/models/' in p,
+    lambda p: '/tts/voices' in p,
+    lambda p: p == '/progress',
+    lambda p: p == '/exam-questions',
+    lambda p: p.startswith('/exam-questions/'),
+    lambda p: p == '/case-studies',
+    lambda p: p.startswith('/case-studies/topic/'),
+    lambda p: p.startswith('/case-studies/') and '/topic/' not in p,
+    lambda p: p == '/tips',
+    lambda p: p.startswith('/tips/'),
+    lambda p: p == '/common-errors',
+    lambda p: p.startswith('/common-errors/'),
+    lambda p: p == '/learning-objectives',
+    lambda p: p.startswith('/learning-objectives/'),
+    lambda p: p == '/sample-answers',
+    lambda p: p.startswith('/sample-answers/'),
+    lambda p: p.startswith('/topic-content/'),
+    lambda p: p == '/stats',
+    lambda p: p == '/pdf/documents',
+    lambda p: p.startswith('/pdf/documents/') and not p.endswith('/chunks'),
+    lambda p: p.endswith('/chunks'),
+    lambda p: p == '/debug/count',
+    lambda p: p == '/debug/pool',
+    lambda p: p == '/debug/cache',
+    lambda p: p == '/debug/brute',
+    lambda p: p == '/debug/hybrid',
+    lambda p: p == '/debug/embeddings',
+    lambda p: p == '/debug/chunks',
+    lambda p: p == '/debug/search',
+    lambda p: p == '/debug/grep',
+    lambda p: p == '/user-settings',
+    lambda p: p.startswith('/rag/chat/history/'),
+]
+
+LEGACY_POST = [
+    lambda p: '/auth/login' in p,
+    lambda p: '/auth/logout' in p,
+    lambda p: '/ai/validate-key' in p,
+    lambda p: '/ai/settings' in p,
+    lambda p: '/ai/generate-questions' in p,
+    lambda p: '/ai/chat' in p,
+    lambda p: '/tts/speak' in p,
+    lambda p: '/tts/design-voice' in p,
+    lambda p: '/tts/clone-voice' in p,
+    lambda p: '/tts/delete-voice' in p,
+    lambda p: p == '/cache/invalidate',
+    lambda p: '/user-settings' in p,
+    lambda p: '/pdf/create-record' in p,
+    lambda p: '/pdf/upload' in p,
+    lambda p: '/pdf/process' in p,
+    lambda p: '/rag/chat' in p,
+    lambda p: '/pdf/delete' in p,
+]
+
+SAMPLES = [
+    ('GET', '/health'),
+    ('GET', '/topics'),
+    ('GET', '/topics/12'),
+    ('GET', '/topics/12/flashcards'),
+    ('GET', '/test-yourself/1.1'),
+    ('GET', '/ai/models/openai'),
+    ('GET', '/exam-questions/3'),
+    ('GET', '/case-studies/topic/7'),
+    ('GET', '/learning-objectives/4'),
+    ('GET', '/topic-content/5'),
+    ('GET', '/pdf/documents/1b9d6bcd-bbfd-4b2d-9b5d-ab8dfbbd4bed/chunks'),
+    ('GET', '/debug/grep'),
+    ('GET', '/rag/chat/history/1b9d6bcd-bbfd-4b2d-9b5d-ab8dfbbd4bed'),
+    ('GET', '/not-a-route'),
+    ('POST', '/auth/login'),
+    ('POST', '/rag/chat'),
+    ('POST', '/pdf/delete'),
+    ('POST', '/flashcards/3/attempt'),
+]
+
+
+def legacy_dispatch(method, path):
+    for i, predicate in enumerate(LEGACY_GET if method == 'GET' else LEGACY_POST):
+        if predicate(path):
+            return i
+    return None
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"{'route':<70} {'if-chain ns':>12} {'router ns':>10} {'speedup':>8}")
+    totals = [0.0, 0.0]
+    for method, path in SAMPLES:
+        legacy = timeit.timeit(lambda: legacy_dispatch(method, path), number=iterations) / iterations * 1e9
+        compiled = timeit.timeit(lambda: routes.match(method, path), number=iterations) / iterations * 1e9
+        totals[0] += legacy
+        totals[1] += compiled
+        print(f"{method + ' ' + path:<70} {legacy:>12.0f} {compiled:>10.0f} {legacy / compiled:>7.1f}x")
+    print(f"{'mean':<70} {totals[0] / len(SAMPLES):>12.0f} {totals[1] / len(SAMPLES):>10.0f} "
+          f"{totals[0] / totals[1]:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,19 @@
 #!/usr/bin/env python3
 """
 Simple dev server that serves both static files and the API
+Connections are handled by a bounded thread pool with HTTP/1.1 keep-alive, so a
+slow LLM or TTS call no longer blocks static files or other users. SIGINT/SIGTERM
+stop accepting new connections and let in-flight requests finish before exiting.
+
+    python dev_server.py [port] [--host HOST] [--workers N] [--keepalive-timeout S] [--drain-timeout S]
 """
 from http.server import HTTPServer, SimpleHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import signal
 import sys
 import os
-import io
+import threading
 
 # Add api directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -24,61 +32,88 @@ def load_env():
 
 load_env()
 
-class DevHandler(SimpleHTTPRequestHandler):
+# Imported after load_env() because api.index reads its configuration at import time
+from api.index import handler as APIHandler
+from api.compression import encode_body, is_compressible, COMPRESSION_MIN_BYTES
+
+PUBLIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public')
+
+
+class DevHandler(APIHandler, SimpleHTTPRequestHandler):
+    """One handler class for both static files and the API.
+
+    API requests run api.index.handler's do_* methods on this same instance, so no
+    per-request proxy object or subclass is created.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body are separate writes on a reused socket
+    timeout = 5  # idle keep-alive connections are closed after this many seconds
+
     def __init__(self, *args, **kwargs):
         # Serve from public directory
-        super().__init__(*args, directory='public', **kwargs)
+        super().__init__(*args, directory=PUBLIC_DIR, **kwargs)
 
-    def _handle_api(self, method):
-        # Import here to avoid circular imports
-        from api.index import handler as APIHandler
-
-        # Create a new handler instance for this request
-        # We need to re-set the path without /api prefix
-        original_path = self.path
-        self.path = self.path[4:]  # Remove /api prefix
+    def handle(self):
+        # Serve requests on this connection until the client closes it, it idles
+        # past the timeout, or the server starts draining for shutdown
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and not self.server.draining.is_set():
+            self.handle_one_request()
 
-        # Create handler and call method
+    def _handle_api(self, method):
         try:
-            # The BaseHTTPRequestHandler expects to be initialized differently
-            # So we'll just call the methods directly on ourselves after patching
-            # Import the handler class and create instance
-
-            # Trick: create handler that shares our connection
-            class ProxyHandler(APIHandler):
-                pass
-
-            proxy = ProxyHandler.__new__(ProxyHandler)
-            proxy.request = self.request
-            proxy.client_address = self.client_address
-            proxy.server = self.server
-            proxy.requestline = self.requestline
-            proxy.command = self.command
-            proxy.path = self.path
-            proxy.request_version = self.request_version
-            proxy.headers = self.headers
-            proxy.rfile = self.rfile
-            proxy.wfile = self.wfile
-            proxy.close_connection = True
-
-            if method == 'GET':
-                proxy.do_GET()
-            elif method == 'POST':
-                proxy.do_POST()
-            elif method == 'PUT':
-                proxy.do_PUT()
-            elif method == 'DELETE':
-                proxy.do_DELETE()
+            getattr(APIHandler, f'do_{method}')(self)
         except Exception as e:
             import traceback
             print(f"API Error: {traceback.format_exc()}")
-            self.send_error(500, f"API Error: {str(e)}")
+            self.close_connection = True
+            if not getattr(self, '_sse_started', False):
+                self.send_error(500, f"API Error: {str(e)}")
+        finally:
+            self._sse_started = False
+
+    def _send_static(self, head_only=False):
+        """Serve a compressible static file (HTML, JS, CSS, JSON, SVG) with gzip/brotli
+        negotiation; compressed bodies are cached per file version. Returns False for
+        anything else, which falls through to SimpleHTTPRequestHandler."""
+        fs_path = self.translate_path(self.path)
+        if os.path.isdir(fs_path) and self.path.split('?')[0].endswith('/'):
+            fs_path = os.path.join(fs_path, 'index.html')
+        if not os.path.isfile(fs_path):
+            return False
+        content_type = self.guess_type(fs_path)
+        st = os.stat(fs_path)
+        if not is_compressible(content_type) or st.st_size < COMPRESSION_MIN_BYTES:
+            return False
+        with open(fs_path, 'rb') as f:
+            payload = f.read()
+        body, encoding = encode_body(payload, self.headers.get('Accept-Encoding'), static=True,
+                                     cache_key=(fs_path, st.st_mtime_ns, st.st_size))
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Last-Modified', self.date_time_string(st.st_mtime))
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(body)
+        return True
 
     def do_GET(self):
         if self.path.startswith('/api/'):
             self._handle_api('GET')
-        else:
-            super().do_GET()
+        elif not self._send_static():
+            SimpleHTTPRequestHandler.do_GET(self)
+
+    def do_HEAD(self):
+        if not self._send_static(head_only=True):
+            SimpleHTTPRequestHandler.do_HEAD(self)
+
+    def do_OPTIONS(self):
+        APIHandler.do_OPTIONS(self)
 
     def do_POST(self):
         if self.path.startswith('/api/'):
@@ -93,23 +128,77 @@ class DevHandler(SimpleHTTPRequestHandler):
             self.send_error(405, "PUT not allowed for static files")
 
     def do_DELETE(self):
-        if self.path.startswith('/api/'):
-            self._handle_api('DELETE')
-        else:
-            self.send_error(405, "DELETE not allowed for static files")
+        self.send_error(405, "DELETE not supported")
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that hands each accepted connection to a bounded worker pool.
+
+    Connections beyond `workers` wait in the pool's queue until a worker frees up.
+    """
+    def __init__(self, server_address, handler_class, workers=32):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.draining = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dev-server')
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self, timeout):
+        """Stop accepting, then wait up to `timeout` seconds for in-flight requests."""
+        self.draining.set()
+        self.shutdown()
+        done = threading.Event()
+        threading.Thread(target=lambda: (self._pool.shutdown(wait=True), done.set()), daemon=True).start()
+        if not done.wait(timeout):
+            print(f"Drain timeout ({timeout}s) reached, closing remaining connections")
+        self.server_close()
+
 
 if __name__ == '__main__':
-    port = int(sys.argv[1]) if len(sys.argv) > 1 else 3456
+    parser = argparse.ArgumentParser(description='IGCSE Geography Guru dev server')
+    parser.add_argument('port', nargs='?', type=int, default=3456)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('DEV_SERVER_WORKERS', 32)),
+                        help='maximum concurrent connections being served')
+    parser.add_argument('--keepalive-timeout', type=float, default=DevHandler.timeout,
+                        help='seconds an idle keep-alive connection is held open')
+    parser.add_argument('--drain-timeout', type=float, default=30,
+                        help='seconds to wait for in-flight requests on shutdown')
+    args = parser.parse_args()
+    port = args.port
+    DevHandler.timeout = args.keepalive_timeout
 
     # Kill any existing server on this port
     os.system(f'lsof -ti:{port} | xargs kill 2>/dev/null')
 
-    print(f"Starting dev server on http://localhost:{port}")
+    server = PooledHTTPServer((args.host, port), DevHandler, workers=args.workers)
+    print(f"Starting dev server on http://{args.host}:{port} ({args.workers} workers, keep-alive)")
     print("Press Ctrl+C to stop")
 
-    server = HTTPServer(('localhost', port), DevHandler)
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        print("\nShutting down...")
-        server.shutdown()
+    # serve_forever runs in its own thread so the signal handler can drain it
+    stopped = threading.Event()
+
+    def stop(signum, frame):
+        if stopped.is_set():
+            return
+        stopped.set()
+        print("\nShutting down: no new connections, finishing in-flight requests...")
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    serve_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    serve_thread.start()
+    while not stopped.wait(0.5):
+        pass
+    server.drain(args.drain_timeout)
+    print("Stopped")